@@ -0,0 +1,143 @@
+#arch_curve.py
+# Dental arch curve: insertion points taken on the skeleton of the jaw mask, and a quadratic
+# spline through them sampled at a uniform arc length in mm (from the voxel spacing), so the
+# panorama width follows the length of the arch
+import math
+
+import numpy as np
+
+# Insertion points: the fewest (at least MIN_INSERTION_POINTS) whose spline follows the skeleton
+# within ARCH_TOLERANCE_MM (95th percentile of the distance from the spline), but never less than
+# TOLERANCE_PIXELS pixels (the skeleton itself wanders by about a pixel), at most MAX_INSERTION_POINTS
+MIN_INSERTION_POINTS = 5
+MAX_INSERTION_POINTS = 15
+ARCH_TOLERANCE_MM = 1.0
+TOLERANCE_PIXELS = 2
+
+# Polyline points per pixel of chord length used to measure the arc length of the spline
+ARC_LENGTH_OVERSAMPLING = 4
+
+
+class ArchCurveError(ValueError):
+    """Raised when no spline goes through the insertion points (e.g. repeated points) or it is too short to resample"""
+
+
+def in_plane_spacing(spacing):
+    """(x, y) pixel spacing in mm of the axial plane, from a (x, y, z) voxel spacing (1 mm if unknown)"""
+    if spacing is None:
+        return 1.0, 1.0
+    return float(spacing[0]), float(spacing[1])
+
+
+class SkeletonIndex:
+    """
+    Skeleton pixels gathered per column once, so the insertion point at any x (the mean y of
+    the pixels within one column of x) costs O(1) instead of a scan of every skeleton pixel
+    """
+
+    def __init__(self, skeleton):
+        ys, xs = np.nonzero(skeleton)
+        if len(xs) == 0:
+            raise ValueError("The skeleton of the jaw mask is empty!")
+        width = skeleton.shape[1]
+        counts = np.bincount(xs, minlength=width).astype(np.float64)
+        sums = np.bincount(xs, weights=ys, minlength=width)
+        self.x_min, self.x_max = int(xs.min()), int(xs.max())
+        self.xs, self.ys = xs, ys
+        self._tree, self._tree_spacing = None, None  # k-d tree of the pixels, built on first use
+        # Sums over the columns x - 1 .. x + 1
+        self.window_counts = np.convolve(counts, np.ones(3), mode="same")
+        self.window_sums = np.convolve(sums, np.ones(3), mode="same")
+
+    def insertion_points(self, num_points):
+        """(y, x) points at num_points evenly spaced columns from the first to the last skeleton column"""
+        x = np.linspace(self.x_min, self.x_max, num_points).astype(int)
+        x = x[self.window_counts[x] > 0]
+        return np.column_stack([self.window_sums[x] / self.window_counts[x], x]).astype(np.float64)
+
+    def deviation(self, curve_x, curve_y, spacing=None):
+        """Distance in mm from each point of a curve to the closest skeleton pixel"""
+        spacing_x, spacing_y = in_plane_spacing(spacing)
+        if self._tree is None or self._tree_spacing != (spacing_x, spacing_y):
+            from scipy.spatial import cKDTree
+
+            self._tree = cKDTree(np.column_stack([self.xs * spacing_x, self.ys * spacing_y]))
+            self._tree_spacing = (spacing_x, spacing_y)
+        distances, _ = self._tree.query(np.column_stack([curve_x * spacing_x, curve_y * spacing_y]))
+        return distances
+
+
+def _spline(insertion_points):
+    from scipy.interpolate import splprep
+
+    x, y = insertion_points[:, 1], insertion_points[:, 0]
+    # s=0 interpolates the points, quadratic unless there are too few of them
+    try:
+        tck, _ = splprep([x, y], s=0, k=min(2, len(insertion_points) - 1))
+    except (ValueError, TypeError) as e:
+        raise ArchCurveError(f"No arch curve through these {len(insertion_points)} points: {e}") from e
+    return tck
+
+
+def _arc_length_table(tck, insertion_points, spacing):
+    """Spline parameters of a dense polyline along the spline and their cumulative arc length in mm"""
+    from scipy.interpolate import splev
+
+    chord = np.sum(np.linalg.norm(np.diff(insertion_points, axis=0), axis=1))
+    u = np.linspace(0, 1, max(256, int(ARC_LENGTH_OVERSAMPLING * chord)))
+    x, y = splev(u, tck)
+    spacing_x, spacing_y = in_plane_spacing(spacing)
+    steps = np.hypot(np.diff(x) * spacing_x, np.diff(y) * spacing_y)
+    return u, np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def adaptive_insertion_points(index, spacing=None, tolerance_mm=ARCH_TOLERANCE_MM,
+                              min_points=MIN_INSERTION_POINTS, max_points=MAX_INSERTION_POINTS):
+    """Fewest insertion points (y, x) whose spline stays within tolerance_mm of the skeleton (95th percentile)
+
+    More points are needed where the arch bends more than a quadratic spline through a few
+    points can follow, e.g. an asymmetric arch or one with a flat front.
+    """
+    from scipy.interpolate import splev
+
+    tolerance_mm = max(tolerance_mm, TOLERANCE_PIXELS * max(in_plane_spacing(spacing)))
+    candidates = []  # (deviation, insertion points), by number of points
+    for num_points in range(min_points, max_points + 1):
+        insertion_points = index.insertion_points(num_points)
+        if len(insertion_points) < 3:
+            continue
+        tck = _spline(insertion_points)
+        u, _ = _arc_length_table(tck, insertion_points, spacing)
+        curve_x, curve_y = splev(u, tck)
+        deviation = np.percentile(index.deviation(np.asarray(curve_x), np.asarray(curve_y), spacing), 95)
+        if deviation <= tolerance_mm:
+            return insertion_points
+        candidates.append((deviation, insertion_points))
+    if not candidates:
+        raise ValueError("Not enough skeleton columns for the arch curve!")
+    # Not within tolerance with any count: the closest spline
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def sample_arch_spline(insertion_points, spacing=None, sample_spacing=None, num_samples=None):
+    """
+    (x, y) samples of the spline through the insertion points (y, x), evenly spaced along the curve
+
+    Samples are sample_spacing mm apart (the in-plane voxel size by default), so their count
+    follows the arch length; num_samples fixes their count instead.
+    """
+    from scipy.interpolate import splev
+
+    tck = _spline(insertion_points)
+    u, length = _arc_length_table(tck, insertion_points, spacing)
+    if num_samples is None:
+        sample_spacing = sample_spacing or min(in_plane_spacing(spacing))
+        num_samples = max(2, int(math.floor(length[-1] / sample_spacing)) + 1)
+    spline_x, spline_y = splev(np.interp(np.linspace(0, length[-1], num_samples), length, u), tck)
+    return np.asarray(spline_x), np.asarray(spline_y)
+
+
+def arch_length(curve_x, curve_y, spacing=None):
+    """Length in mm of the polyline through the curve samples"""
+    spacing_x, spacing_y = in_plane_spacing(spacing)
+    return float(np.sum(np.hypot(np.diff(curve_x) * spacing_x, np.diff(curve_y) * spacing_y)))
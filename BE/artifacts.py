@@ -0,0 +1,164 @@
+#artifacts.py
+# Artifacts served to the UI (panoramas, tile pyramids, cross-sections, DICOM exports): where
+# they are written, the URLs they are served at and how long they are kept
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from fastapi.staticfiles import StaticFiles
+
+logger = logging.getLogger("panorama.artifacts")
+
+
+class ArtifactStore(ABC):
+    """
+    Named artifacts and their public URLs
+
+    A name is a file, or a directory whose name ends with "/" in URLs (e.g. a tile pyramid).
+    Artifact names are unique (see new_name) and never rewritten, so clients may cache
+    them forever. Their owners (the result cache, sessions) keep names, never paths, and
+    check exists() before reusing them. Backends implement the abstract methods.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+
+    def new_name(self, prefix, suffix=""):
+        return f"{prefix}_{uuid.uuid4()}{suffix}"
+
+    def url(self, name):
+        return self.base_url + name
+
+    @abstractmethod
+    def path(self, name):
+        """Local path an artifact is written to"""
+
+    @abstractmethod
+    def exists(self, name):
+        """Whether an artifact is still there (it may have been collected)"""
+
+    @abstractmethod
+    def size(self, name):
+        """Bytes of an artifact (every file of a directory), 0 if it does not exist"""
+
+    @abstractmethod
+    def delete(self, name):
+        """Delete an artifact, if it exists"""
+
+    @abstractmethod
+    def collect(self):
+        """Delete the expired artifacts and those over quota, returns (count, bytes) deleted"""
+
+
+def _entry_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+class LocalArtifactStore(ArtifactStore):
+    """
+    Artifacts as the entries of a local directory, served by static_files()
+
+    collect() deletes the entries not accessed (written or served) for ttl_seconds, then the
+    least recently accessed ones while the directory holds more than max_bytes. Entries
+    modified in the last min_age_seconds are never deleted, as a worker may still be writing
+    them. Entries owned by the result cache or a session are collected like the others:
+    both check that their artifacts still exist (exists()) before using them.
+    """
+
+    def __init__(self, root, base_url, max_bytes=None, ttl_seconds=None, min_age_seconds=300):
+        super().__init__(base_url)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.min_age_seconds = min_age_seconds
+        self.total_bytes = 0  # as of the last collect()
+        self._last_access = {}  # entry name -> time.time() it was last served
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def size(self, name):
+        try:
+            return _entry_size(self.path(name))
+        except FileNotFoundError:
+            return 0
+
+    def touch(self, name):
+        entry = name.strip("/").split("/", 1)[0]
+        with self._lock:
+            self._last_access[entry] = time.time()
+
+    def delete(self, name):
+        entry = name.strip("/").split("/", 1)[0]
+        path = self.path(entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        with self._lock:
+            self._last_access.pop(entry, None)
+
+    def _entries(self):
+        """(last access, modification time, size, name) of every entry, least recently accessed first"""
+        entries = []
+        with self._lock:
+            last_access = dict(self._last_access)
+        for entry in os.scandir(self.root):
+            try:
+                modified = entry.stat().st_mtime
+                size = _entry_size(entry.path)
+            except FileNotFoundError:
+                continue  # deleted meanwhile (e.g. by a cache eviction)
+            entries.append((max(modified, last_access.get(entry.name, 0)), modified, size, entry.name))
+        return sorted(entries)
+
+    def collect(self, now=None):
+        now = time.time() if now is None else now
+        entries = self._entries()
+        total_bytes = sum(size for _, _, size, _ in entries)
+        deleted, freed = 0, 0
+        for accessed, modified, size, name in entries:
+            if now - modified < self.min_age_seconds:
+                continue
+            expired = self.ttl_seconds is not None and now - accessed > self.ttl_seconds
+            over_quota = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not (expired or over_quota):
+                continue
+            self.delete(name)
+            total_bytes -= size
+            deleted, freed = deleted + 1, freed + size
+        self.total_bytes = total_bytes
+        if deleted:
+            logger.info("Artifacts collected", extra={"deleted": deleted, "freedBytes": freed,
+                                                      "totalBytes": total_bytes})
+        return deleted, freed
+
+    def static_files(self, cache_max_age=31536000):
+        """ASGI app serving the artifacts (ETag, Last-Modified and Range requests from Starlette)"""
+        return _ArtifactFiles(self, cache_max_age)
+
+
+class _ArtifactFiles(StaticFiles):
+    """StaticFiles that records accesses and lets clients cache the artifacts (they never change)"""
+
+    def __init__(self, store, cache_max_age):
+        super().__init__(directory=store.root)
+        self.store = store
+        self.cache_control = f"public, max-age={cache_max_age}, immutable"
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = self.cache_control
+        self.store.touch(os.path.relpath(full_path, self.store.root))
+        return response
@@ -0,0 +1,192 @@
+#batch.py
+# Headless batch processing of a directory of scans:
+#   python -m panorama_extraction batch <dir> [--output <dir>] [--workers N] ...
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import panorama_extraction as pe
+import profiling
+from worker_pool import default_worker_count
+
+logger = logging.getLogger("panorama.batch")
+
+# Volume files processed by the batch mode; DICOM series are directories holding .dcm files
+VOLUME_EXTENSIONS = (".mha", ".mhd", ".nrrd", ".nhdr")
+DICOM_EXTENSIONS = (".dcm",)
+
+MANIFEST_NAME = "manifest.json"
+# Outcomes are appended here as they come, so an interrupted run loses none of them
+JOURNAL_NAME = "manifest.jsonl"
+
+
+def find_scans(input_dir):
+    """Relative paths of the volume files and DICOM series directories under input_dir, sorted"""
+    scans = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        if any(name.lower().endswith(DICOM_EXTENSIONS) for name in files):
+            scans.append(os.path.relpath(root, input_dir))
+        scans.extend(os.path.relpath(os.path.join(root, name), input_dir)
+                     for name in sorted(files) if name.lower().endswith(VOLUME_EXTENSIONS))
+    return scans
+
+
+def panorama_name(scan, image_format):
+    """Output file name of a scan: its relative path flattened, so it stays unique"""
+    flat = scan.replace(os.sep, "__") if scan != "." else "scan"
+    return os.path.splitext(flat)[0] + image_format
+
+
+def load_manifest(output_dir):
+    """Scans already recorded by a previous run: the manifest, then the journal of later outcomes"""
+    scans = {}
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            scans.update(json.load(manifest).get("scans", {}))
+    journal_path = os.path.join(output_dir, JOURNAL_NAME)
+    if os.path.exists(journal_path):
+        with open(journal_path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # last line of an interrupted write
+                scans[entry["scan"]] = entry["record"]
+    return scans
+
+
+def write_manifest(output_dir, input_dir, params, scans):
+    manifest = {"inputDir": os.path.abspath(input_dir), "params": params, "scans": scans}
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    # Everything the journal held is in the manifest now
+    journal_path = os.path.join(output_dir, JOURNAL_NAME)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+
+def is_done(record, params, output_dir):
+    return (record.get("status") == "done" and record.get("params") == params
+            and os.path.exists(os.path.join(output_dir, record["panorama"]["file"])))
+
+
+def process_scan(volume_path, output_file_path, spill_dir, encode_options, pipeline_params):
+    """Process one scan in a worker process, returning its manifest record"""
+    start = time.perf_counter()
+    try:
+        result = pe.process_volume_file(volume_path, output_file_path, spill_dir=spill_dir,
+                                        encode_options=encode_options, **pipeline_params)
+    except Exception as e:
+        return {"status": "failed", "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - start}
+    return {
+        "status": "done",
+        "imageShape": list(result["imageShape"]),
+        "axialBounds": result["axialBounds"],
+        "coronalThreshold": result["coronalThreshold"],
+        "axialThreshold": result["axialThreshold"],
+        "thresholdFits": result["thresholdFits"],
+        "archControlPoints": result["archControlPoints"],
+        "panorama": {**result["panorama"], "file": os.path.basename(output_file_path)},
+        "stageTimings": result["stageTimings"],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_batch(input_dir, output_dir, workers, params, force=False, max_slab_bytes=None, threads=1):
+    """
+    Process every scan under input_dir into output_dir, across a pool of worker processes
+
+    Panoramas are written next to a manifest.json of the bounds, thresholds and timings
+    found for every scan. Scans already done with the same parameters by a previous run
+    are skipped unless force is set, so an interrupted run resumes where it stopped.
+    max_slab_bytes processes the volumes out of core, and threads runs the volume passes of
+    each scan on that many threads (same output, so neither is part of params).
+    Returns the number of failed scans.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    scans = load_manifest(output_dir)
+    pending = [scan for scan in find_scans(input_dir) if force or not is_done(scans.get(scan, {}), params, output_dir)]
+    logger.info("%d scans to process, %d already done", len(pending), sum(
+        is_done(record, params, output_dir) for record in scans.values()))
+
+    encode_options = {"bit_depth": params["bit_depth"]}
+    pipeline_params = {key: value for key, value in params.items() if key not in ("image_format", "bit_depth")}
+    pipeline_params["max_slab_bytes"] = max_slab_bytes
+    pipeline_params["threads"] = threads
+    failed = 0
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(process_scan, os.path.join(input_dir, scan),
+                            os.path.join(output_dir, panorama_name(scan, params["image_format"])),
+                            output_dir, encode_options, pipeline_params): scan
+            for scan in pending
+        }
+        with open(os.path.join(output_dir, JOURNAL_NAME), "a") as journal:
+            for count, future in enumerate(as_completed(futures), 1):
+                scan = futures[future]
+                record = {**future.result(), "params": params}
+                scans[scan] = record
+                journal.write(json.dumps({"scan": scan, "record": record}) + "\n")
+                journal.flush()
+                if record["status"] == "failed":
+                    failed += 1
+                    logger.warning("[%d/%d] %s failed: %s", count, len(pending), scan, record["error"])
+                else:
+                    logger.info("[%d/%d] %s done in %.1f s", count, len(pending), scan, record["seconds"])
+    finally:
+        # Also on interruption: stop the queued scans and consolidate what was done
+        executor.shutdown(wait=True, cancel_futures=True)
+        write_manifest(output_dir, input_dir, params, scans)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m panorama_extraction", description="Headless panorama extraction")
+    commands = parser.add_subparsers(dest="command", required=True)
+    batch = commands.add_parser("batch", help="process every MHA / NRRD volume and DICOM series under a directory")
+    batch.add_argument("input_dir")
+    batch.add_argument("--output", help="output directory (default: <input_dir>/panoramas)")
+    batch.add_argument("--workers", type=int, default=default_worker_count())
+    batch.add_argument("--force", action="store_true", help="reprocess the scans a previous run already did")
+    batch.add_argument("--thickness", type=int, default=100)
+    batch.add_argument("--stretch-factor", type=float, default=1.5)
+    batch.add_argument("--num-spline-points", type=int, help="arch curve samples (default: from the arch length)")
+    batch.add_argument("--sample-spacing", type=float, help="mm between arch curve samples (default: voxel size)")
+    batch.add_argument("--downsample", type=int, default=1, help="coarse-to-fine arch detection factor")
+    batch.add_argument("--interpolation", choices=pe.PANORAMIC_INTERPOLATIONS, default="nearest")
+    batch.add_argument("--reduction", choices=pe.PANORAMIC_REDUCTIONS, default="max")
+    batch.add_argument("--max-slab-bytes", type=int, help="process volumes out of core within this budget")
+    batch.add_argument("--threads", type=int, help="threads per worker for the volume passes (default: cores / workers)")
+    batch.add_argument("--format", default=".jpg", choices=(".jpg", ".png", ".webp"))
+    batch.add_argument("--bit-depth", type=int, default=8, choices=(8, 16))
+    args = parser.parse_args(argv)
+
+    profiling.configure_logging(os.environ.get("PANORAMA_LOG_LEVEL", "INFO"),
+                                json_format=os.environ.get("PANORAMA_LOG_FORMAT", "text") == "json")
+    # The per-scan pipeline logs are in the manifest
+    logging.getLogger(pe.__name__).setLevel(logging.WARNING)
+
+    params = {
+        "thickness": args.thickness,
+        "stretch_factor": args.stretch_factor,
+        "num_spline_points": args.num_spline_points,
+        "sample_spacing": args.sample_spacing,
+        "downsample": args.downsample,
+        "interpolation": args.interpolation,
+        "reduction": args.reduction,
+        "image_format": args.format,
+        "bit_depth": args.bit_depth,
+    }
+    output_dir = args.output or os.path.join(args.input_dir, "panoramas")
+    failed = run_batch(args.input_dir, output_dir, args.workers, params, force=args.force,
+                       max_slab_bytes=args.max_slab_bytes,
+                       threads=args.threads or max(1, default_worker_count() // args.workers))
+    return 1 if failed else 0
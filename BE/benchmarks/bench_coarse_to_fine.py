@@ -0,0 +1,56 @@
+# Accuracy and cost of coarse-to-fine arch detection against the full resolution path
+#
+# Usage (from BE/): python benchmarks/bench_coarse_to_fine.py --factors 2 3 4
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import panorama_extraction as pe
+from phantoms import dental_arch_phantom
+
+# Stages whose cost the downsampling reduces
+MORPHOLOGY_STAGES = ("coronal_mask", "jaw_mask", "skeleton", "arch_points", "arch_curve")
+
+
+def curve_distance(curve, reference):
+    """Distances (pixels) from every point of curve to the closest point of reference"""
+    return cKDTree(np.column_stack(reference)).query(np.column_stack(curve))[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coarse-to-fine arch detection benchmark")
+    parser.add_argument("--shape", type=int, nargs=3, default=(100, 400, 400), metavar=("D", "H", "W"))
+    parser.add_argument("--factors", type=int, nargs="+", default=(2, 3, 4))
+    parser.add_argument("--max-mean-distance", type=float, default=3.0,
+                        help="fail when the mean curve distance exceeds this many pixels")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    volume = dental_arch_phantom(tuple(args.shape))
+    reference = pe.PanoramaPipeline(volume)
+    reference.arch_curve()
+    reference_cost = sum(reference.timings[stage] for stage in MORPHOLOGY_STAGES)
+    print(f"volume {volume.shape}, full resolution: bounds {reference.axial_bounds()}, "
+          f"morphology {reference_cost * 1000:.1f} ms")
+
+    failed = False
+    for factor in args.factors:
+        pipeline = pe.PanoramaPipeline(volume, downsample=factor)
+        pipeline.arch_curve()
+        cost = sum(pipeline.timings[stage] for stage in MORPHOLOGY_STAGES)
+        distance = curve_distance(pipeline.arch_curve(), reference.arch_curve())
+        failed |= distance.mean() > args.max_mean_distance
+        print(f"x{factor}: bounds {pipeline.axial_bounds()}, morphology {cost * 1000:7.1f} ms "
+              f"(x{reference_cost / cost:.1f} faster), curve distance mean {distance.mean():.2f} px "
+              f"max {distance.max():.2f} px")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Benchmark of the batched panoramic resampler against the original per-voxel loop
+#
+# Usage (from BE/): python benchmarks/bench_panoramic_resampler.py --depth 40 --size 400
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import panorama_extraction as pe
+
+
+# Original implementation of extract_panoramic_view, kept as the reference
+def extract_panoramic_view_loop(cbct_data, curve_x, curve_y, thickness=100, stretch_factor=1.5):
+    depth, height, width = cbct_data.shape
+
+    num_points = int(len(curve_x) * stretch_factor)
+    panoramic = np.zeros((depth, num_points))
+
+    t = np.linspace(0, 1, len(curve_x))
+    t_new = np.linspace(0, 1, num_points)
+    curve_x_stretched = np.interp(t_new, t, curve_x)
+    curve_y_stretched = np.interp(t_new, t, curve_y)
+
+    dx = np.gradient(curve_x_stretched)
+    dy = np.gradient(curve_y_stretched)
+
+    for z in range(depth):
+        slice_data = cbct_data[z]
+
+        for i in range(num_points):
+            x, y = int(curve_x_stretched[i]), int(curve_y_stretched[i])
+
+            normal_x = -dy[i]
+            normal_y = dx[i]
+            norm = np.sqrt(normal_x**2 + normal_y**2)
+            if norm != 0:
+                normal_x /= norm
+                normal_y /= norm
+
+            samples = []
+            for t in range(-thickness // 2, thickness // 2):
+                sample_x = int(x + normal_x * t)
+                sample_y = int(y + normal_y * t)
+
+                if (0 <= sample_x < width and 0 <= sample_y < height):
+                    samples.append(slice_data[sample_y, sample_x])
+
+            if samples:
+                panoramic[z, i] = np.max(samples)
+
+    return panoramic
+
+
+def synthetic_arch(depth, size, num_curve_points=750, seed=0):
+    # Noise volume with a bright U-shaped arch, plus a parabola through the arch
+    rng = np.random.default_rng(seed)
+    volume = rng.integers(0, 1000, (depth, size, size)).astype(np.int16)
+    t = np.linspace(0, np.pi, num_curve_points)
+    curve_x = size / 2 + 0.4 * size * np.cos(t)
+    curve_y = 0.15 * size + 0.6 * size * np.sin(t)
+    rows = np.clip(curve_y.astype(int), 0, size - 1)
+    cols = np.clip(curve_x.astype(int), 0, size - 1)
+    volume[:, rows, cols] = 3000
+    return volume, curve_x, curve_y
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Panoramic resampler benchmark")
+    parser.add_argument("--depth", type=int, default=20, help="number of slices (the loop is slow)")
+    parser.add_argument("--size", type=int, default=400, help="in-plane size of the volume")
+    parser.add_argument("--thickness", type=int, default=100)
+    parser.add_argument("--points", type=int, default=750, help="number of spline samples")
+    args = parser.parse_args()
+
+    volume, curve_x, curve_y = synthetic_arch(args.depth, args.size, args.points)
+    print(f"volume {volume.shape}, {args.points} curve points, thickness {args.thickness}")
+
+    reference, loop_time = timed(extract_panoramic_view_loop, volume, curve_x, curve_y, args.thickness)
+    print(f"loop               {loop_time:8.3f} s")
+
+    for interpolation in pe.PANORAMIC_INTERPOLATIONS:
+        for reduction in pe.PANORAMIC_REDUCTIONS:
+            result, elapsed = timed(pe.extract_panoramic_view, volume, curve_x, curve_y, args.thickness,
+                                    interpolation=interpolation, reduction=reduction)
+            line = f"{interpolation:9s} {reduction:10s} {elapsed:8.3f} s  x{loop_time / elapsed:7.1f}"
+            if (interpolation, reduction) == ("nearest", "max"):
+                line += f"  max abs diff vs loop: {np.max(np.abs(result - reference)):g}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Scaling of the threaded volume passes (MIPs, panoramic resampling, cross-sections) from 1 to
+# N threads, checking that every thread count gives exactly the single-thread output
+#
+# Usage (from BE/): python benchmarks/bench_slab_threads.py --shape 400 800 800 --threads 1 2 4 8
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import panorama_extraction as pe
+from phantoms import dental_arch_phantom
+from worker_pool import default_worker_count
+
+
+def best_time(fn, repeat):
+    """Result of fn and its fastest duration (seconds) over repeat calls after a warm-up call"""
+    result, durations = fn(), []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return result, min(durations)
+
+
+def passes(volume, pipeline, max_slab_bytes):
+    """(name, fn(threads)) of the threaded passes, on the intermediates of a pipeline run"""
+    axial_start, axial_end = pipeline.axial_bounds()
+    spline_x, spline_y = pipeline.arch_curve()
+    grid = pe.build_panoramic_grid(spline_x, spline_y)
+    return [
+        ("coronal_mip", lambda threads: pe.generate_coronal_mip(volume, max_slab_bytes, threads)),
+        ("axial_mip", lambda threads: pe.generate_axial_mip(volume, axial_start, axial_end, max_slab_bytes, threads)),
+        ("panoramic[nearest,max]", lambda threads: pe.resample_panoramic_view(
+            volume, grid, max_slab_bytes=max_slab_bytes, threads=threads)),
+        ("panoramic[trilinear,mean]", lambda threads: pe.resample_panoramic_view(
+            volume, grid, "trilinear", "mean", max_slab_bytes=max_slab_bytes, threads=threads)),
+        ("panoramic[nearest,percentile]", lambda threads: pe.resample_panoramic_view(
+            volume, grid, reduction="percentile", max_slab_bytes=max_slab_bytes, threads=threads)),
+        ("cross_sections", lambda threads: pe.extract_cross_sections(
+            volume, spline_x, spline_y, max_slab_bytes=max_slab_bytes, threads=threads)[0]),
+    ]
+
+
+def main():
+    cores = default_worker_count()
+    parser = argparse.ArgumentParser(description="Threaded slab passes scaling benchmark")
+    parser.add_argument("--shape", type=int, nargs=3, default=(200, 400, 400), metavar=("D", "H", "W"))
+    parser.add_argument("--threads", type=int, nargs="+",
+                        default=sorted({1, *(2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores), cores}))
+    parser.add_argument("--max-slab-bytes", type=int, help="out-of-core budget shared by the threads")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    volume = dental_arch_phantom(tuple(args.shape))
+    pipeline = pe.PanoramaPipeline(volume)
+    pipeline.arch_curve()
+    print(f"volume {volume.shape}, {cores} cores, threads {args.threads}, "
+          f"slab cache budget {pe.SLAB_CACHE_BYTES >> 20} MiB")
+
+    failed = False
+    header = f"{'pass':30s}" + "".join(f"{f'{threads} thr':>16s}" for threads in args.threads)
+    print(header)
+    totals, serial_total = dict.fromkeys(args.threads, 0.0), 0.0
+    for name, run in passes(volume, pipeline, args.max_slab_bytes):
+        reference, serial_time = best_time(lambda: run(1), args.repeat)
+        serial_total += serial_time
+        line = f"{name:30s}"
+        for threads in args.threads:
+            result, elapsed = (reference, serial_time) if threads == 1 else best_time(lambda: run(threads), args.repeat)
+            identical = np.array_equal(result, reference)
+            failed |= not identical
+            totals[threads] += elapsed
+            line += f"{elapsed * 1000:9.1f} ms x{serial_time / elapsed:4.1f}" + ("" if identical else " DIFF")
+        print(line)
+    print(f"{'total':30s}" + "".join(f"{totals[threads] * 1000:9.1f} ms x{serial_total / totals[threads]:4.1f}"
+                                      for threads in args.threads))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
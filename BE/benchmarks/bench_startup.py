@@ -0,0 +1,95 @@
+# Cold start of the server: import time of main, startup (worker pool) time and latency of
+# the first /upload-image requests, with and without the warm worker pool
+#
+# Usage (from BE/): python benchmarks/bench_startup.py --runs 3 --output startup.json
+#
+# Every measurement runs in a fresh interpreter, so imports and workers are really cold.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter from a scratch directory: prints the measurements as JSON
+COLD_START = """
+import json, os, sys, time
+start = time.perf_counter()
+import main
+timings = {"importMain": time.perf_counter() - start}
+from fastapi.testclient import TestClient
+start = time.perf_counter()
+with TestClient(main.app) as client:
+    timings["startup"] = time.perf_counter() - start
+    for name, path in zip(("firstRequest", "secondRequest"), sys.argv[1:3]):
+        with open(path, "rb") as upload:
+            start = time.perf_counter()
+            response = client.post("/upload-image", files={"file": (os.path.basename(path), upload)})
+            timings[name] = time.perf_counter() - start
+        assert response.status_code == 200, response.text
+print(json.dumps(timings))
+"""
+
+
+def write_uploads(directory):
+    """Two different small phantoms, so neither request is answered by the result cache"""
+    sys.path.insert(0, BE_DIR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import SimpleITK as sitk
+    from phantoms import dental_arch_phantom
+
+    paths = []
+    for seed in (0, 1):
+        path = os.path.join(directory, f"phantom_{seed}.mha")
+        sitk.WriteImage(sitk.GetImageFromArray(dental_arch_phantom((100, 400, 400), seed=seed)), path)
+        paths.append(path)
+    return paths
+
+
+def cold_start(uploads, warm_pool, work_dir):
+    env = {**os.environ, "PYTHONPATH": BE_DIR, "PANORAMA_WARM_POOL": "1" if warm_pool else "0",
+           "PANORAMA_LOG_LEVEL": "WARNING", "PYTHONWARNINGS": "ignore"}
+    output = subprocess.run([sys.executable, "-c", COLD_START, *uploads], cwd=work_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_time(module, work_dir):
+    env = {**os.environ, "PYTHONPATH": BE_DIR}
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=work_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server cold start benchmark")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per configuration")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        uploads = write_uploads(work_dir)
+        for module in ("panorama_extraction", "main"):
+            times = [import_time(module, work_dir) for _ in range(args.runs)]
+            results[f"import {module}"] = {"median": statistics.median(times), "runs": times}
+            print(f"import {module:20s} median {statistics.median(times) * 1000:8.1f} ms")
+
+        for warm_pool in (False, True):
+            runs = [cold_start(uploads, warm_pool, work_dir) for _ in range(args.runs)]
+            configuration = "warm pool" if warm_pool else "cold pool"
+            results[configuration] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            print(configuration + ": " + ", ".join(
+                f"{key} {value * 1000:.0f} ms" for key, value in results[configuration].items()))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
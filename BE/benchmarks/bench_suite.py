@@ -0,0 +1,221 @@
+# Benchmark suite: times the public functions of panorama_extraction and the end-to-end
+# /upload-image path on synthetic phantoms, and saves the results as JSON to compare commits
+#
+# Usage (from BE/):
+#   python benchmarks/bench_suite.py --sizes small medium --output results.json
+#   python benchmarks/bench_suite.py --sizes small --compare results.json
+#
+# Runs offline on the CPU only: the phantoms are generated locally and the server runs in-process.
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import SimpleITK as sitk
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BE_DIR)
+import panorama_extraction as pe
+from phantoms import PHANTOM_SIZES, check_phantom_shape, dental_arch_phantom
+
+
+def time_call(fn, repeat):
+    """Durations (seconds) of repeat calls of fn after one warm-up call"""
+    durations = []
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        fn()
+        if i > 0:
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations):
+    return {
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "max": max(durations),
+        "repeat": len(durations),
+    }
+
+
+def function_benchmarks(volume, output_dir):
+    """(name, callable) of every public function, fed with the intermediates of a pipeline run"""
+    pipeline = pe.PanoramaPipeline(volume)
+    pipeline.panoramic_view()
+    coronal_mip = pipeline.coronal_mip()
+    axial_start, axial_end = pipeline.axial_bounds()
+    axial_mip_blurred, threshold_axial = pipeline.axial_threshold()
+    binary_mask_axial = (axial_mip_blurred > threshold_axial).astype(np.uint8)
+    skeleton = pipeline.skeleton()
+    insertion_points = pipeline.arch_points()
+    spline_x, spline_y = pipeline.arch_curve()
+    grid = pe.build_panoramic_grid(spline_x, spline_y)
+    panoramic_view = pipeline.panoramic_view()
+    hist, bin_edges = np.histogram(coronal_mip[coronal_mip > 0], bins=256)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    volume_path = os.path.join(output_dir, "phantom.mha")
+    sitk.WriteImage(sitk.GetImageFromArray(volume), volume_path)
+    output_path = os.path.join(output_dir, "panorama.jpg")
+
+    return [
+        ("generate_coronal_mip", lambda: pe.generate_coronal_mip(volume)),
+        ("preprocess_histogram", lambda: pe.preprocess_histogram(hist, bin_centers)),
+        ("detect_and_fit_largest_valid_peak", lambda: pe.detect_and_fit_largest_valid_peak(hist, bin_centers)),
+        ("fit_mip_threshold", lambda: pe.fit_mip_threshold(coronal_mip)),
+        ("compute_axial_indices_and_plot", lambda: pe.compute_axial_indices_and_plot(
+            pipeline.coronal_mask(), coronal_mip)),
+        ("generate_axial_mip", lambda: pe.generate_axial_mip(volume, axial_start, axial_end)),
+        ("process_jaws_and_teeth", lambda: pe.process_jaws_and_teeth(binary_mask_axial)),
+        ("analyze_skeleton", lambda: pe.analyze_skeleton(skeleton)),
+        ("arch_insertion_points", lambda: pe.arch_insertion_points(skeleton)),
+        ("fit_arch_spline", lambda: pe.fit_arch_spline(insertion_points)),
+        ("fit_arch_curve", lambda: pe.fit_arch_curve(skeleton)),
+        ("build_panoramic_grid", lambda: pe.build_panoramic_grid(spline_x, spline_y)),
+        ("resample_panoramic_view", lambda: pe.resample_panoramic_view(volume, grid)),
+        ("extract_panoramic_view", lambda: pe.extract_panoramic_view(volume, spline_x, spline_y)),
+        ("extract_panoramic_view[trilinear,mean]", lambda: pe.extract_panoramic_view(
+            volume, spline_x, spline_y, interpolation="trilinear", reduction="mean")),
+        ("extract_cross_sections", lambda: pe.extract_cross_sections(volume, spline_x, spline_y)),
+        ("save_panoramic_view", lambda: pe.save_panoramic_view(panoramic_view, output_path)),
+        ("PanoramaPipeline.panoramic_view", lambda: pe.PanoramaPipeline(volume).panoramic_view()),
+        ("process_cbct", lambda: pe.process_cbct(volume)),
+        ("process_volume_array", lambda: pe.process_volume_array(volume, output_path)),
+        ("process_volume_file", lambda: pe.process_volume_file(volume_path, output_path)),
+    ], volume_path
+
+
+def upload_benchmark(volume_path, repeat, server_dir):
+    """Durations of POST /upload-image through the FastAPI test client, one worker process"""
+    # Run the server in a scratch directory (it creates uploads/ and static/ there when imported)
+    os.environ.setdefault("PANORAMA_WORKERS", "1")
+    os.environ.setdefault("PANORAMA_LOG_LEVEL", "WARNING")
+    cwd = os.getcwd()
+    os.chdir(server_dir)
+    try:
+        from fastapi.testclient import TestClient
+        import main
+
+        image = sitk.ReadImage(volume_path)
+        durations = []
+        with TestClient(main.app) as client:
+            for i in range(repeat + 1):
+                # A different spacing per upload changes its hash so it misses the result cache
+                image.SetSpacing((1.0, 1.0, 1.0 + (i + 1) * 1e-6))
+                upload_path = os.path.join(server_dir, f"upload_{i}.mha")
+                sitk.WriteImage(image, upload_path)
+                with open(upload_path, "rb") as upload:
+                    start = time.perf_counter()
+                    response = client.post("/upload-image", files={"file": ("phantom.mha", upload)})
+                    duration = time.perf_counter() - start
+                os.remove(upload_path)
+                if response.status_code != 200:
+                    raise RuntimeError(f"/upload-image answered {response.status_code}: {response.text}")
+                if i > 0:
+                    durations.append(duration)
+        return durations
+    finally:
+        os.chdir(cwd)
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BE_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpuCount": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the median ratio to the baseline of every benchmark, returns the regressed ones"""
+    regressions = []
+    for size, benchmarks in results["sizes"].items():
+        baseline_benchmarks = baseline.get("sizes", {}).get(size, {}).get("benchmarks", {})
+        for name, timing in benchmarks["benchmarks"].items():
+            if name not in baseline_benchmarks:
+                continue
+            ratio = timing["median"] / baseline_benchmarks[name]["median"]
+            flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+            print(f"{size:8s} {name:40s} x{ratio:5.2f}{flag}")
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Panorama extraction benchmark suite")
+    parser.add_argument("--sizes", nargs="+", default=["small"],
+                        help=f"phantom sizes among {', '.join(PHANTOM_SIZES)}, or DxHxW")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per benchmark (after a warm-up call)")
+    parser.add_argument("--skip-upload", action="store_true", help="skip the end-to-end /upload-image benchmark")
+    parser.add_argument("--only", nargs="+", help="only run the benchmarks with these names")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare the medians with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown of a median reported as a regression")
+    args = parser.parse_args()
+    shapes = {}
+    for size in args.sizes:
+        try:
+            shapes[size] = PHANTOM_SIZES.get(size) or tuple(int(n) for n in size.split("x"))
+            if len(shapes[size]) != 3:
+                raise ValueError(f"Size {size} is neither {', '.join(PHANTOM_SIZES)} nor DxHxW")
+            check_phantom_shape(shapes[size])
+        except ValueError as e:
+            parser.error(str(e))
+    warnings.simplefilter("ignore")
+    logging.disable(logging.INFO)
+
+    results = {"environment": environment(), "repeat": args.repeat, "sizes": {}}
+    server_dir = tempfile.TemporaryDirectory()
+    for size, shape in shapes.items():
+        start = time.perf_counter()
+        volume = dental_arch_phantom(shape)
+        print(f"{size}: phantom {shape} generated in {time.perf_counter() - start:.1f} s")
+
+        benchmarks = {}
+        with tempfile.TemporaryDirectory() as work_dir:
+            functions, volume_path = function_benchmarks(volume, work_dir)
+            for name, fn in functions:
+                if args.only and name not in args.only:
+                    continue
+                benchmarks[name] = summarize(time_call(fn, args.repeat))
+                print(f"  {name:40s} median {benchmarks[name]['median'] * 1000:10.1f} ms")
+            if not args.skip_upload and (not args.only or "upload_image" in args.only):
+                benchmarks["upload_image"] = summarize(upload_benchmark(volume_path, args.repeat, server_dir.name))
+                print(f"  {'upload_image':40s} median {benchmarks['upload_image']['median'] * 1000:10.1f} ms")
+        results["sizes"][size] = {"shape": list(shape), "benchmarks": benchmarks}
+        del volume
+    server_dir.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Synthetic CBCT phantoms: a soft-tissue head with a U-shaped bony dental arch
+import numpy as np
+
+# Phantom sizes (Depth, Height, Width) of the benchmark suite, by name
+PHANTOM_SIZES = {
+    "small": (256, 256, 256),
+    "medium": (400, 800, 800),
+    "large": (600, 600, 600),
+}
+
+# The pipeline's structuring elements have fixed pixel sizes (a 15 px coronal opening, a 27 px
+# jaw opening), so on small phantoms the arch is at least this many pixels thick on each side and
+# this many slices above and below the middle slice; even then it is lost below MIN_PHANTOM_SHAPE
+MIN_ARCH_HALF_WIDTH = 14
+MIN_ARCH_HALF_DEPTH = 8
+MIN_PHANTOM_SHAPE = (48, 96, 96)
+
+
+def check_phantom_shape(shape):
+    """Raise ValueError for (Depth, Height, Width) shapes whose arch the pipeline cannot find"""
+    depth, height, width = shape
+    min_depth, min_height, min_width = MIN_PHANTOM_SHAPE
+    if depth < min_depth or height < min_height or width < min_width:
+        raise ValueError(f"Phantom {depth}x{height}x{width} is too small for the panorama pipeline, "
+                         f"the smallest is {min_depth}x{min_height}x{min_width}")
+
+
+def dental_arch_phantom(shape=(100, 400, 400), arch_half_width=None, seed=0, slab=16):
+    """
+    Volume (Depth, Height, Width) of int16 intensities the panorama pipeline can process
+
+    Background noise around 300, an ellipsoidal head around 1000 and a U-shaped arch
+    of bone (uniform 1800-3500, so it forms a tail rather than a histogram peak)
+    arch_half_width pixels thick on each side (5.5% of the in-plane size by default),
+    in the middle 24% of the slices, both raised to the minimums above on small shapes.
+    The volume is generated slab by slab, so large phantoms only need their own int16 memory.
+    """
+    check_phantom_shape(shape)
+    depth, height, width = shape
+    if arch_half_width is None:
+        arch_half_width = max(0.055 * min(height, width), MIN_ARCH_HALF_WIDTH)
+    arch_half_depth = max(0.12 * depth, MIN_ARCH_HALF_DEPTH)
+    rng = np.random.default_rng(seed)
+    volume = np.empty(shape, dtype=np.int16)
+
+    y = np.arange(height)[:, None]
+    x = np.arange(width)[None, :]
+
+    # Arch: lower half of an elliptic ring in the axial plane, over a slab of slices
+    center_y, center_x = 0.35 * height, width / 2
+    radius_y, radius_x = 0.35 * height, 0.3 * width
+    ring = np.sqrt(((y - center_y) / radius_y) ** 2 + ((x - center_x) / radius_x) ** 2)
+    arch_2d = (np.abs(ring - 1) * min(radius_y, radius_x) < arch_half_width) & (y > center_y)
+    in_plane = ((y - height / 2) / (0.45 * height)) ** 2 + ((x - width / 2) / (0.45 * width)) ** 2
+
+    for z0 in range(0, depth, slab):
+        z = np.arange(z0, min(z0 + slab, depth))[:, None, None]
+        values = rng.normal(300, 40, (len(z), height, width)).astype(np.float32)
+
+        # Head: soft tissue ellipsoid
+        values += 700 * (((z - depth / 2) / (0.48 * depth)) ** 2 + in_plane < 1)
+
+        arch = arch_2d & (np.abs(z - depth * 0.5) < arch_half_depth)
+        values[arch] = rng.uniform(1800, 3500, int(arch.sum()))
+        volume[z0:z0 + len(z)] = values
+
+    return volume
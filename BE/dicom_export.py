@@ -0,0 +1,294 @@
+#dicom_export.py
+# Export of a volume as DICOM for the viewer (Crosshairs.tsx): one file per slice, a single
+# multi-frame file, or a zip of the slices streamed while it is written
+import datetime
+import os
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+ENHANCED_CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2.1"
+
+# Tags that differ between the slices of a series, everything else comes from the header template
+SLICE_TAGS = (
+    0x00080018,  # SOPInstanceUID
+    0x00200013,  # InstanceNumber
+    0x00200032,  # ImagePositionPatient
+    0x00201041,  # SliceLocation
+)
+PIXEL_DATA_TAG = 0x7FE00010
+
+DICOM_PREAMBLE = b"\0" * 128 + b"DICM"
+
+
+class VolumeGeometry(NamedTuple):
+    spacing: tuple  # (x, y, z) in mm, like SimpleITK's GetSpacing()
+    origin: tuple  # (x, y, z)
+    direction: tuple  # row-major 3x3 matrix, like SimpleITK's GetDirection()
+
+
+def read_volume(path):
+    """
+    Read a volume file with SimpleITK, returning the image, a zero-copy (Depth, Height, Width)
+    view of its pixels and its geometry (the image owns the memory of the view, keep it alive)
+    """
+    import SimpleITK as sitk
+
+    image = sitk.ReadImage(path)
+    if image.GetDimension() != 3 or image.GetNumberOfComponentsPerPixel() != 1:
+        raise ValueError("Only single-channel 3D volumes can be exported")
+    geometry = VolumeGeometry(image.GetSpacing(), image.GetOrigin(), image.GetDirection())
+    return image, sitk.GetArrayViewFromImage(image), geometry
+
+
+def _ds(value):
+    from pydicom.valuerep import DSfloat
+
+    return DSfloat(float(value), auto_format=True)
+
+
+def encode_pixels(volume, slab=16):
+    """
+    16-bit pixels of a volume, with their PixelRepresentation, RescaleSlope and RescaleIntercept
+
+    Volumes that fit in int16 or uint16 are written as they are (no copy for int16 / uint16),
+    anything else is rescaled into uint16 with one scale for the whole volume, so the slices
+    keep consistent intensities and the rescale tags give back the original values.
+    """
+    low, high = volume.min(), volume.max()
+    if np.issubdtype(volume.dtype, np.integer) or volume.dtype == np.bool_:
+        for dtype, representation in ((np.uint16, 0), (np.int16, 1)):
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                return np.ascontiguousarray(volume, np.dtype(dtype).newbyteorder("<")), representation, 1.0, 0.0
+
+    low, high = float(low), float(high)
+    slope = (high - low) / 65535 if high > low else 1.0
+    pixels = np.empty(volume.shape, dtype="<u2")
+    for z in range(0, volume.shape[0], slab):
+        values = (volume[z:z + slab] - low) / slope
+        pixels[z:z + slab] = np.rint(values, out=values)
+    return pixels, 0, slope, low
+
+
+class DicomExporter:
+    """
+    DICOM files of a volume: the header shared by the slices is built and encoded once,
+    each slice only encodes its own SLICE_TAGS, and the pixel data is written straight
+    from a view of the (once encoded) volume.
+    """
+
+    def __init__(self, volume, geometry, series_description="CBCT volume", owner=None):
+        import pydicom
+        from pydicom.uid import generate_uid
+
+        # The owner of the memory of a volume view (e.g. the SimpleITK image of read_volume) is kept
+        # alive with the exporter, as the pixels may still be that view
+        self._owner = owner
+        self.pixels, pixel_representation, slope, intercept = encode_pixels(volume)
+        self.depth, self.rows, self.columns = self.pixels.shape
+        self.geometry = geometry
+        direction = np.array(geometry.direction, dtype=float).reshape(3, 3)
+        self.normal = direction[:, 2]
+        self.study_uid = generate_uid()
+        self.series_uid = generate_uid()
+        self.frame_of_reference_uid = generate_uid()
+        now = datetime.datetime.now()
+        self.date_time = now.timetuple()[:6]
+
+        template = pydicom.Dataset()
+        template.SOPClassUID = CT_IMAGE_STORAGE
+        template.StudyDate = template.SeriesDate = template.ContentDate = now.strftime("%Y%m%d")
+        template.StudyTime = template.SeriesTime = template.ContentTime = now.strftime("%H%M%S.%f")
+        template.Modality = "CT"
+        template.SeriesDescription = series_description
+        template.PatientName = "Anonymous"
+        template.PatientID = "Unknown"
+        template.StudyInstanceUID = self.study_uid
+        template.SeriesInstanceUID = self.series_uid
+        template.StudyID = "1"
+        template.SeriesNumber = 1
+        template.FrameOfReferenceUID = self.frame_of_reference_uid
+        # Rows follow the direction of the image x axis, columns the y axis
+        template.ImageOrientationPatient = [_ds(v) for v in (*direction[:, 0], *direction[:, 1])]
+        template.PixelSpacing = [_ds(geometry.spacing[1]), _ds(geometry.spacing[0])]
+        template.SliceThickness = _ds(geometry.spacing[2])
+        template.SamplesPerPixel = 1
+        template.PhotometricInterpretation = "MONOCHROME2"
+        template.Rows = self.rows
+        template.Columns = self.columns
+        template.BitsAllocated = 16
+        template.BitsStored = 16
+        template.HighBit = 15
+        template.PixelRepresentation = pixel_representation
+        # Same window for every slice: the whole range of the volume
+        low, high = self.pixels.min() * slope + intercept, self.pixels.max() * slope + intercept
+        template.WindowCenter = _ds((low + high) / 2)
+        template.WindowWidth = _ds(max(high - low, 1))
+        template.RescaleIntercept = _ds(intercept)
+        template.RescaleSlope = _ds(slope)
+        template.RescaleType = "US"
+        self.template = template
+        self._segments = self._encode_segments(template)
+
+    @staticmethod
+    def _encode(elements):
+        from pydicom.filebase import DicomBytesIO
+        from pydicom.filewriter import write_data_element
+
+        fp = DicomBytesIO()
+        fp.is_little_endian, fp.is_implicit_VR = True, False
+        for element in elements:
+            write_data_element(fp, element)
+        return fp.getvalue()
+
+    def _encode_segments(self, template):
+        """Encoded runs of template elements between the SLICE_TAGS (len(SLICE_TAGS) + 1 runs)"""
+        bounds = (-1, *SLICE_TAGS, PIXEL_DATA_TAG)
+        elements = [template[tag] for tag in sorted(template.keys())]
+        return [self._encode(element for element in elements if low < element.tag < high)
+                for low, high in zip(bounds, bounds[1:])]
+
+    def slice_position(self, index):
+        return np.array(self.geometry.origin, dtype=float) + index * self.geometry.spacing[2] * self.normal
+
+    def _file_meta(self, sop_class_uid, sop_instance_uid):
+        import pydicom
+        from pydicom.filebase import DicomBytesIO
+        from pydicom.filewriter import write_file_meta_info
+
+        meta = pydicom.dataset.FileMetaDataset()
+        meta.MediaStorageSOPClassUID = sop_class_uid
+        meta.MediaStorageSOPInstanceUID = sop_instance_uid
+        meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+        fp = DicomBytesIO()
+        fp.is_little_endian, fp.is_implicit_VR = True, False
+        write_file_meta_info(fp, meta)
+        return DICOM_PREAMBLE + fp.getvalue()
+
+    @staticmethod
+    def _pixel_data_header(nbytes):
+        if nbytes >= 1 << 32:
+            raise ValueError("The volume is too large for a single DICOM pixel data element")
+        return struct.pack("<HH2sHI", PIXEL_DATA_TAG >> 16, PIXEL_DATA_TAG & 0xFFFF, b"OW", 0, nbytes)
+
+    def slice_name(self, index):
+        return f"slice_{index:04d}.dcm"
+
+    def slice_header(self, index):
+        """Every byte of the DICOM file of a slice before its pixel values"""
+        import pydicom
+        from pydicom.uid import generate_uid
+
+        sop_instance_uid = generate_uid()
+        position = self.slice_position(index)
+        own = pydicom.Dataset()
+        own.SOPInstanceUID = sop_instance_uid
+        own.InstanceNumber = index + 1
+        own.ImagePositionPatient = [_ds(v) for v in position]
+        own.SliceLocation = _ds(np.dot(self.normal, position))
+        parts = [self._file_meta(CT_IMAGE_STORAGE, sop_instance_uid), self._segments[0]]
+        for tag, segment in zip(SLICE_TAGS, self._segments[1:]):
+            parts += [self._encode([own[tag]]), segment]
+        parts.append(self._pixel_data_header(self.rows * self.columns * 2))
+        return b"".join(parts)
+
+    def slice_pixels(self, index):
+        """Zero-copy view of the little-endian 16-bit pixels of a slice"""
+        return memoryview(self.pixels[index]).cast("B")
+
+    def write_slice(self, output_dir, index):
+        name = self.slice_name(index)
+        with open(os.path.join(output_dir, name), "wb") as output:
+            output.write(self.slice_header(index))
+            output.write(self.slice_pixels(index))
+        return name
+
+    def write_series(self, output_dir, max_workers=None):
+        """Write one DICOM file per slice in parallel, returning their names in slice order"""
+        os.makedirs(output_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(lambda index: self.write_slice(output_dir, index), range(self.depth)))
+
+    def write_multiframe(self, output_path):
+        """Write the volume as a single Enhanced CT multi-frame DICOM file"""
+        import pydicom
+        from pydicom.uid import generate_uid
+
+        sop_instance_uid = generate_uid()
+        dataset = pydicom.Dataset()
+        dataset.update(self.template)
+        for keyword in ("ImageOrientationPatient", "PixelSpacing", "SliceThickness",
+                        "RescaleIntercept", "RescaleSlope", "RescaleType"):
+            delattr(dataset, keyword)  # in the shared functional groups below
+        dataset.SOPClassUID = ENHANCED_CT_IMAGE_STORAGE
+        dataset.SOPInstanceUID = sop_instance_uid
+        dataset.InstanceNumber = 1
+        dataset.ImageType = ["DERIVED", "PRIMARY", "VOLUME", "NONE"]
+        dataset.NumberOfFrames = self.depth
+
+        pixel_measures = pydicom.Dataset()
+        pixel_measures.PixelSpacing = self.template.PixelSpacing
+        pixel_measures.SliceThickness = self.template.SliceThickness
+        plane_orientation = pydicom.Dataset()
+        plane_orientation.ImageOrientationPatient = self.template.ImageOrientationPatient
+        transformation = pydicom.Dataset()
+        transformation.RescaleIntercept = self.template.RescaleIntercept
+        transformation.RescaleSlope = self.template.RescaleSlope
+        transformation.RescaleType = self.template.RescaleType
+        shared = pydicom.Dataset()
+        shared.PixelMeasuresSequence = [pixel_measures]
+        shared.PlaneOrientationSequence = [plane_orientation]
+        shared.PixelValueTransformationSequence = [transformation]
+        dataset.SharedFunctionalGroupsSequence = [shared]
+
+        frames = []
+        for index in range(self.depth):
+            plane_position = pydicom.Dataset()
+            plane_position.ImagePositionPatient = [_ds(v) for v in self.slice_position(index)]
+            frame = pydicom.Dataset()
+            frame.PlanePositionSequence = [plane_position]
+            frames.append(frame)
+        dataset.PerFrameFunctionalGroupsSequence = frames
+
+        with open(output_path, "wb") as output:
+            output.write(self._file_meta(ENHANCED_CT_IMAGE_STORAGE, sop_instance_uid))
+            output.write(self._encode(dataset[tag] for tag in sorted(dataset.keys())))
+            output.write(self._pixel_data_header(self.pixels.nbytes))
+            output.write(memoryview(self.pixels).cast("B"))
+        return sop_instance_uid
+
+    def iter_zip(self):
+        """Chunks of a zip of the slice files, produced slice by slice (for a streamed response)"""
+        output = _ChunkWriter()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+            for index in range(self.depth):
+                header, pixels = self.slice_header(index), self.slice_pixels(index)
+                info = zipfile.ZipInfo(self.slice_name(index), date_time=self.date_time)
+                info.file_size = len(header) + pixels.nbytes
+                with archive.open(info, "w") as member:
+                    member.write(header)
+                    member.write(pixels)
+                yield output.take()
+        yield output.take()
+
+
+class _ChunkWriter:
+    """Write-only file object collecting what a ZipFile writes (not seekable, so it streams)"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
@@ -0,0 +1,175 @@
+#dicom_series.py
+import hashlib
+import io
+import os
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+import volume_ingest
+
+
+class DicomSeriesError(ValueError):
+    """Raised for uploads that are not a single, consistent DICOM image series"""
+
+
+class SeriesTooLargeError(DicomSeriesError):
+    """Raised for archives with more files or decompressed bytes than allowed"""
+
+
+class SeriesSlice(NamedTuple):
+    source: object  # file path or file object the slice is read from
+    position: float  # ImagePositionPatient projected on the slice normal
+    slope: float
+    intercept: float
+
+
+class DicomSeries(NamedTuple):
+    slices: list  # SeriesSlice, sorted along the slice normal
+    rows: int
+    columns: int
+    dtype: np.dtype  # of the rescaled volume
+    spacing: tuple  # (x, y, z) in mm
+    series_uid: str
+
+
+def zip_members(zip_file, max_files=None, max_bytes=None):
+    """
+    File objects of the members of a zip archive (directories and hidden files skipped)
+
+    Archives with more than max_files members or max_bytes decompressed bytes are rejected
+    from their directory, before anything is decompressed (zipfile never decompresses a
+    member beyond its recorded size, so these sizes can be trusted).
+    """
+    archive = zipfile.ZipFile(zip_file)
+    infos = [info for info in archive.infolist()
+             if not info.is_dir() and not os.path.basename(info.filename).startswith(".")]
+    if max_files is not None and len(infos) > max_files:
+        raise SeriesTooLargeError(f"The archive holds {len(infos)} files, at most {max_files} are allowed")
+    total_bytes = sum(info.file_size for info in infos)
+    if max_bytes is not None and total_bytes > max_bytes:
+        raise SeriesTooLargeError(f"The archive holds {total_bytes} bytes once decompressed, "
+                                  f"at most {max_bytes} are allowed")
+    return [io.BytesIO(archive.read(info)) for info in infos]
+
+
+def _read_header(source):
+    import pydicom
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        return pydicom.dcmread(source, stop_before_pixels=True)
+    except pydicom.errors.InvalidDicomError:
+        return None
+
+
+def _volume_dtype(headers, slopes, intercepts):
+    # Integer rescales keep integers when int16 or uint16 holds the whole rescaled range, anything else
+    # (e.g. unsigned 16-bit with RescaleIntercept -1024) becomes float32: exact for 16-bit values
+    # plus an intercept, and filtered by OpenCV in the pipeline, unlike int32
+    if any(slope != 1 for slope in slopes) or any(intercept != int(intercept) for intercept in intercepts):
+        return np.dtype(np.float32)
+    low, high = 0, 0
+    for header in headers:
+        bits_stored = int(getattr(header, "BitsStored", header.BitsAllocated))
+        if int(getattr(header, "PixelRepresentation", 0)) == 1:
+            low, high = min(low, -(1 << (bits_stored - 1))), max(high, (1 << (bits_stored - 1)) - 1)
+        else:
+            high = max(high, (1 << bits_stored) - 1)
+    low, high = low + min(intercepts), high + max(intercepts)
+    for dtype in (np.int16, np.uint16):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.float32)
+
+
+def read_series(sources, max_workers=None):
+    """
+    Read the headers of the slices of a DICOM series (file paths or file objects) in parallel,
+    and sort them along the slice normal by ImagePositionPatient (InstanceNumber without it)
+
+    Files that are not DICOM images (e.g. a README or DICOMDIR in a zip) are skipped.
+    """
+    with ThreadPoolExecutor(max_workers) as executor:
+        headers = list(executor.map(_read_header, sources))
+    images = [(source, header) for source, header in zip(sources, headers) if header is not None and "Rows" in header]
+    if not images:
+        raise DicomSeriesError("No DICOM image found in the upload")
+
+    series_uids = Counter(str(getattr(header, "SeriesInstanceUID", "")) for _, header in images)
+    if len(series_uids) > 1:
+        raise DicomSeriesError(f"The upload holds {len(series_uids)} series, upload one series at a time")
+
+    rows, columns = int(images[0][1].Rows), int(images[0][1].Columns)
+    if any((int(header.Rows), int(header.Columns)) != (rows, columns) for _, header in images):
+        raise DicomSeriesError("Slices of the series have different sizes")
+
+    slices = []
+    orientation = getattr(images[0][1], "ImageOrientationPatient", None)
+    normal = np.cross(np.array(orientation[:3], dtype=float), np.array(orientation[3:], dtype=float)) \
+        if orientation is not None else None
+    for source, header in images:
+        position = getattr(header, "ImagePositionPatient", None)
+        if normal is not None and position is not None:
+            location = float(np.dot(normal, np.array(position, dtype=float)))
+        else:
+            location = float(getattr(header, "InstanceNumber", len(slices)))
+        slices.append(SeriesSlice(source, location, float(getattr(header, "RescaleSlope", 1) or 1),
+                                  float(getattr(header, "RescaleIntercept", 0) or 0)))
+    order = np.argsort([item.position for item in slices], kind="stable")
+    slices = [slices[i] for i in order]
+    if len({item.position for item in slices}) != len(slices):
+        raise DicomSeriesError("Several slices share the same position")
+
+    pixel_spacing = getattr(images[0][1], "PixelSpacing", None) or (1.0, 1.0)
+    gaps = np.diff([item.position for item in slices])
+    slice_spacing = float(np.median(gaps)) if len(gaps) else float(getattr(images[0][1], "SliceThickness", 1) or 1)
+    dtype = _volume_dtype([header for _, header in images], [item.slope for item in slices],
+                          [item.intercept for item in slices])
+    return DicomSeries(slices, rows, columns, dtype, (float(pixel_spacing[1]), float(pixel_spacing[0]), slice_spacing),
+                       str(getattr(images[0][1], "SeriesInstanceUID", "")))
+
+
+def _decode_slice(item, volume, index):
+    import pydicom
+
+    if hasattr(item.source, "seek"):
+        item.source.seek(0)
+    pixels = pydicom.dcmread(item.source).pixel_array
+    if pixels.shape != volume.shape[1:]:
+        raise DicomSeriesError(f"Slice {index} is not a single {volume.shape[1]}x{volume.shape[2]} frame")
+    if item.slope != 1 or item.intercept != 0:
+        pixels = pixels * item.slope + item.intercept
+    volume[index] = pixels
+    # Slice digests are combined in order into the volume digest
+    return hashlib.sha256(volume[index]).digest()
+
+
+def decode_series(series, buffer_dir=None, spill_dir=None, spill_bytes=None, max_workers=None):
+    """
+    Decode the slices of a series in parallel, straight into one preallocated (Depth, Height, Width)
+    volume (a memmap in buffer_dir if given, see volume_ingest.allocate_volume)
+
+    Returns the volume, the path of its memmap file (or None) and the sha256 hex digest of its content.
+    """
+    shape = (len(series.slices), series.rows, series.columns)
+    volume, path = volume_ingest.allocate_volume(shape, series.dtype, buffer_dir, spill_dir, spill_bytes)
+    try:
+        with ThreadPoolExecutor(max_workers) as executor:
+            slice_digests = list(executor.map(_decode_slice, series.slices, [volume] * len(series.slices),
+                                              range(len(series.slices))))
+        if isinstance(volume, np.memmap):
+            volume.flush()
+    except BaseException:
+        volume = None  # unmap before removing the file
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        raise
+    digest = hashlib.sha256(f"{shape}{series.dtype.str}".encode())
+    for slice_digest in slice_digests:
+        digest.update(slice_digest)
+    return volume, path, digest.hexdigest()
@@ -0,0 +1,173 @@
+#histogram_analysis.py
+# Histograms of the MIP intensities and Gaussian fits of their peaks, for the thresholds and
+# slice bounds of the panorama pipeline (numpy only, scipy is only needed for refinement)
+import math
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+# Histograms of float data with more values than this are computed on a strided subsample
+MAX_HISTOGRAM_SAMPLES = 1 << 20
+# A closed-form Gaussian estimate is used as it is when its RMS residual over the fit window
+# is within this fraction of the peak height, otherwise it initializes a least squares fit
+CLOSED_FORM_TOLERANCE = 0.05
+
+
+class GaussianFit(NamedTuple):
+    amplitude: float
+    mean: float
+    std_dev: float
+    method: str  # "log_parabola" or "moments" (closed form), or "least_squares"
+    residual: float  # RMS residual over the fitted samples, relative to the peak height
+
+
+class ThresholdFit(NamedTuple):
+    threshold: float
+    method: str  # method of the Gaussian fit, or "percentile" when no fit was possible
+    mean: Optional[float]
+    std_dev: Optional[float]
+    residual: Optional[float]
+    peak: float  # intensity of the peak the Gaussian is fitted on
+    samples: int  # values counted in the histogram
+
+    def diagnostics(self):
+        return {key: (float(value) if isinstance(value, (float, np.floating)) else value)
+                for key, value in self._asdict().items()}
+
+
+def gaussian(x, a, mean, std_dev):
+    return a * np.exp(-((x - mean) ** 2) / (2 * std_dev ** 2))
+
+
+def histogram(values, bins=256, max_samples=MAX_HISTOGRAM_SAMPLES):
+    """
+    Histogram and bin centers of values over their range, like np.histogram(values, bins)
+
+    Integer values are counted per value with np.bincount and then gathered into the bins,
+    which gives exactly the np.histogram counts; float values beyond max_samples are
+    histogrammed on a strided subsample (a deterministic one).
+    """
+    values = np.asarray(values).ravel()
+    if values.size == 0:
+        raise ValueError("Cannot compute the histogram of no values")
+    low, high = values.min(), values.max()
+    if np.issubdtype(values.dtype, np.integer) and int(high) - int(low) < 1 << 24:
+        counts = np.bincount(values.astype(np.intp) - int(low))
+        hist, bin_edges = np.histogram(np.arange(int(low), int(high) + 1), bins=bins, range=(low, high),
+                                       weights=counts)
+        hist = hist.astype(np.int64)
+    else:
+        if max_samples is not None and values.size > max_samples:
+            values = values[::math.ceil(values.size / max_samples)]
+        hist, bin_edges = np.histogram(values, bins=bins, range=(low, high))
+    return hist, (bin_edges[:-1] + bin_edges[1:]) / 2
+
+
+def local_maxima(values, height=None):
+    """
+    Indices of the local maxima of a 1D signal above height, like scipy.signal.find_peaks(values, height):
+    a flat peak is reported at its middle and the ends of the signal are never peaks
+    """
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.zeros(0, dtype=np.intp)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1))  # runs of equal values
+    ends = np.concatenate((starts[1:] - 1, [len(values) - 1]))
+    run_values = values[starts]
+    is_peak = (run_values[1:-1] > run_values[:-2]) & (run_values[1:-1] > run_values[2:])
+    peaks = (starts[1:-1][is_peak] + ends[1:-1][is_peak]) // 2
+    if height is not None:
+        peaks = peaks[values[peaks] >= height]
+    return peaks
+
+
+def _closed_form_estimates(x, y):
+    """Gaussian parameters from a log-parabola fit (weighted by y^2) and from the moments of y(x)"""
+    estimates = []
+    positive = y > 0
+    if positive.sum() >= 3:
+        # log y = c0 + c1 (x - x0) + c2 (x - x0)^2, centered at x0 for conditioning
+        x0 = x[np.argmax(y)]
+        c2, c1, c0 = np.polyfit(x[positive] - x0, np.log(y[positive]), 2, w=y[positive])
+        if c2 < 0:
+            estimates.append(("log_parabola", math.exp(c0 - c1 ** 2 / (4 * c2)), float(x0 - c1 / (2 * c2)),
+                              math.sqrt(-1 / (2 * c2))))
+    total = y.sum()
+    if total > 0:
+        mean = float((x * y).sum() / total)
+        std_dev = math.sqrt(float((y * (x - mean) ** 2).sum() / total))
+        if std_dev > 0:
+            estimates.append(("moments", float(y.max()), mean, std_dev))
+    return estimates
+
+
+def fit_gaussian(x, y, tolerance=CLOSED_FORM_TOLERANCE):
+    """
+    Gaussian fitted on the samples y(x) of a single peak, or None if no fit is possible
+
+    The closed-form estimates (log-parabola and moments) are tried first and the best one
+    is used as it is when within tolerance; otherwise it initializes scipy's curve_fit.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    scale = y.max() if len(y) else 0
+    if scale <= 0:
+        return None
+
+    def relative_residual(params):
+        return float(np.sqrt(np.mean((gaussian(x, *params) - y) ** 2)) / scale)
+
+    best = None
+    for method, *params in _closed_form_estimates(x, y):
+        if all(np.isfinite(params)):
+            fit = GaussianFit(*params, method, relative_residual(params))
+            if best is None or fit.residual < best.residual:
+                best = fit
+    if best is not None and best.residual <= tolerance:
+        return best
+
+    import warnings
+    from scipy.optimize import OptimizeWarning, curve_fit
+
+    p0 = best[:3] if best is not None else (scale, x[np.argmax(y)], max(x.std(), 1.0))
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", OptimizeWarning)
+            params, _ = curve_fit(gaussian, x, y, p0=p0)
+    except RuntimeError:
+        return best
+    a, mean, std_dev = (float(value) for value in params)
+    fit = GaussianFit(a, mean, abs(std_dev), "least_squares", relative_residual(params))
+    return fit if best is None or fit.residual < best.residual else best
+
+
+def percentile_from_histogram(hist, bin_centers, percentile):
+    """Bin center at which the cumulative histogram reaches percentile"""
+    cumulative = np.cumsum(hist)
+    return float(bin_centers[np.searchsorted(cumulative, cumulative[-1] * percentile / 100.0)])
+
+
+def fit_peak_threshold(hist, bin_centers, peak_width=20, intensity_cutoff=0.95, sigmas=1.98,
+                       fallback_percentile=95):
+    """
+    Threshold mean + sigmas * std_dev of a Gaussian fitted on the highest intensity peak of a histogram
+
+    Peaks are searched below intensity_cutoff of the intensity range (bright spikes excluded),
+    and the Gaussian is fitted within peak_width of the peak. When no fit is possible the
+    threshold is the fallback_percentile of the histogrammed values (the pipeline used to take
+    np.percentile of the bin centers, which ignores the counts).
+    """
+    valid_intensity_mask = bin_centers < intensity_cutoff * np.max(bin_centers)
+    filtered_hist = hist * valid_intensity_mask
+    peaks = local_maxima(filtered_hist, height=np.mean(filtered_hist) * 1.5)
+    if len(peaks) == 0:
+        raise ValueError("No valid peaks detected after filtering the histogram!")
+
+    peak_center = float(bin_centers[peaks[np.argmax(bin_centers[peaks])]])
+    fit_mask = (bin_centers >= peak_center - peak_width) & (bin_centers <= peak_center + peak_width)
+    fit = fit_gaussian(bin_centers[fit_mask], hist[fit_mask])
+    samples = int(np.sum(hist))
+    if fit is None:
+        threshold = percentile_from_histogram(hist, bin_centers, fallback_percentile)
+        return ThresholdFit(threshold, "percentile", None, None, None, peak_center, samples)
+    return ThresholdFit(fit.mean + sigmas * fit.std_dev, fit.method, fit.mean, fit.std_dev, fit.residual,
+                        peak_center, samples)
@@ -0,0 +1,104 @@
+#jobs.py
+import threading
+import time
+import uuid
+
+
+class Job:
+    """State of one panorama extraction job"""
+
+    def __init__(self, job_id, stages):
+        self.id = job_id
+        self.stages = tuple(stages)
+        self.status = "queued"  # queued -> running -> done | failed
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    @property
+    def progress(self):
+        """Fraction of the stages completed, 1.0 once the job is done"""
+        if self.status == "done":
+            return 1.0
+        if self.stage not in self.stages:
+            return 0.0
+        return self.stages.index(self.stage) / len(self.stages)
+
+    def to_dict(self):
+        data = {
+            "jobId": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": list(self.stages),
+            "progress": self.progress,
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobRegistry:
+    """
+    In-process registry of jobs, evicted ttl_seconds after their last update
+
+    Updates come from the request handlers and from the pool's progress and
+    completion threads, so every access goes through one lock.
+    """
+
+    def __init__(self, stages, ttl_seconds=3600):
+        self.stages = tuple(stages)
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _evict_expired(self, now):
+        expired = [job_id for job_id, job in self._jobs.items() if now - job.updated_at > self.ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def create(self):
+        with self._lock:
+            now = time.time()
+            self._evict_expired(now)
+            job = Job(str(uuid.uuid4()), self.stages)
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_expired(time.time())
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+
+    def start_stage(self, job_id, stage):
+        # Progress events are delivered asynchronously and may arrive after completion
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in ("done", "failed"):
+                return
+            job.status = "running"
+            job.stage = stage
+            job.updated_at = time.time()
+
+    def finish(self, job_id, result):
+        self._update(job_id, status="done", result=result)
+
+    def fail(self, job_id, error):
+        self._update(job_id, status="failed", error=error)
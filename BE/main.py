@@ -1,31 +1,41 @@
 #main.py
+import asyncio
+import functools
+import logging
+import math
 import os
+import time
 import uuid
 import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-import SimpleITK as sitk
-import numpy as np
-import matplotlib.pyplot as plt
-import datetime
-import pydicom
-
-
-# Additional required imports for processing
-import cv2
-from skimage.morphology import opening, disk, skeletonize
-from scipy.signal import find_peaks
-from scipy.optimize import curve_fit
-from scipy.interpolate import splprep, splev
+import zipfile
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 
 # Import your panorama extraction module (replace 'pe' with your actual module name if different)
 import panorama_extraction as pe
 
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
 
+import arch_curve
+import profiling
+from artifacts import LocalArtifactStore
+from dicom_export import DicomExporter, read_volume
+from dicom_series import DicomSeriesError, SeriesTooLargeError, decode_series, read_series, zip_members
+from jobs import JobRegistry
+from metrics import MEMORY_BUCKETS, MetricsRegistry
+from result_cache import ResultCache, cache_key, copy_and_hash
+from sessions import SessionStore
+from volume_ingest import StreamingVolumeReader, VolumeFormatError, remove_stale_buffers
+from worker_pool import ProcessingPool, PoolBusyError, default_worker_count, report_progress
 
-app = FastAPI()
+# Structured logs: JSON lines by default, PANORAMA_LOG_FORMAT=text for plain text
+profiling.configure_logging(os.environ.get("PANORAMA_LOG_LEVEL", "INFO"),
+                            json_format=os.environ.get("PANORAMA_LOG_FORMAT", "json") == "json")
+logger = logging.getLogger("panorama.server")
 
 # Create directories for temporary uploads and static files
 UPLOAD_DIR = "uploads"
@@ -33,8 +43,147 @@ STATIC_DIR = "static"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(STATIC_DIR, exist_ok=True)
 
+# Artifacts (panoramas, tiles, cross-sections, DICOM exports) are written under STATIC_DIR and served
+# at PANORAMA_PUBLIC_URL. Every PANORAMA_ARTIFACT_GC_INTERVAL seconds, those not accessed for
+# PANORAMA_ARTIFACT_TTL seconds are deleted, then the least recently accessed beyond PANORAMA_ARTIFACT_BYTES
+ARTIFACT_BASE_URL = os.environ.get("PANORAMA_PUBLIC_URL", "http://localhost:8000/static/")
+ARTIFACT_TTL_SECONDS = int(os.environ.get("PANORAMA_ARTIFACT_TTL", 24 * 3600))
+ARTIFACT_MAX_BYTES = int(os.environ.get("PANORAMA_ARTIFACT_BYTES", 4 << 30))
+ARTIFACT_GC_INTERVAL = int(os.environ.get("PANORAMA_ARTIFACT_GC_INTERVAL", 60))
+
+# Streamed volumes are decoded into memmap buffers the workers open directly: in RAM
+# (/dev/shm) when available, on disk under UPLOAD_DIR above VOLUME_BUFFER_MAX_BYTES or when the
+# buffer directory is full. Buffers left there by an earlier run are removed at startup, so
+# PANORAMA_BUFFER_DIR must not be shared with another running server
+VOLUME_BUFFER_DIR = os.environ.get("PANORAMA_BUFFER_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else UPLOAD_DIR)
+VOLUME_BUFFER_MAX_BYTES = int(os.environ.get("PANORAMA_BUFFER_MAX_BYTES", 2 << 30))
+
+# DICOM series uploads (/upload-series): at most PANORAMA_MAX_SERIES_FILES files, and zips of at
+# most PANORAMA_MAX_SERIES_BYTES once decompressed (read in memory), read and decoded by
+# PANORAMA_DECODE_THREADS threads (the ThreadPoolExecutor default if unset)
+MAX_SERIES_FILES = int(os.environ.get("PANORAMA_MAX_SERIES_FILES", 4096))
+MAX_SERIES_BYTES = int(os.environ.get("PANORAMA_MAX_SERIES_BYTES", 2 << 30))
+DECODE_THREADS = int(os.environ["PANORAMA_DECODE_THREADS"]) if "PANORAMA_DECODE_THREADS" in os.environ else None
+
+# Worker processes for the panorama processing, and how many uploads may wait for one
+# before the server answers 503
+PROCESSING_WORKERS = int(os.environ.get("PANORAMA_WORKERS", default_worker_count()))
+PROCESSING_QUEUE_DEPTH = int(os.environ.get("PANORAMA_QUEUE_DEPTH", PROCESSING_WORKERS))
+RETRY_AFTER_SECONDS = 30
+# Start the workers with the server and warm each one up on a small synthetic volume, so
+# the first requests do not pay the worker start and import costs (PANORAMA_WARM_POOL=0 to disable)
+WARM_POOL = os.environ.get("PANORAMA_WARM_POOL", "1") == "1"
+
+# Jobs of the /jobs API are forgotten this many seconds after their last update
+JOB_TTL_SECONDS = int(os.environ.get("PANORAMA_JOB_TTL", 3600))
+
+# Parameters of the panorama pipeline, part of the result cache key; PANORAMA_DOWNSAMPLE > 1
+# detects the arch coarse-to-fine on MIPs downsampled by that factor. The arch curve is sampled
+# every PANORAMA_SAMPLE_SPACING mm (the in-plane voxel size if unset), so the panorama width follows
+# the arch length, or at PANORAMA_SPLINE_POINTS points if set
+PIPELINE_PARAMS = {
+    "thickness": 100,
+    "stretch_factor": 1.5,
+    "num_spline_points": int(os.environ["PANORAMA_SPLINE_POINTS"]) if "PANORAMA_SPLINE_POINTS" in os.environ else None,
+    "sample_spacing": float(os.environ["PANORAMA_SAMPLE_SPACING"]) if "PANORAMA_SAMPLE_SPACING" in os.environ else None,
+    "downsample": int(os.environ.get("PANORAMA_DOWNSAMPLE", 1)),
+}
+
+# Format of the saved panorama (.jpg, .png or .webp), 16-bit needs .png; with
+# PANORAMA_TILES=1 a tile pyramid is written next to it for progressive loading
+IMAGE_FORMAT = os.environ.get("PANORAMA_IMAGE_FORMAT", ".jpg")
+IMAGE_BIT_DEPTH = int(os.environ.get("PANORAMA_BIT_DEPTH", 8))
+IMAGE_TILES = os.environ.get("PANORAMA_TILES", "0") == "1"
+ENCODE_PARAMS = {"image_format": IMAGE_FORMAT, "bit_depth": IMAGE_BIT_DEPTH, "tiles": IMAGE_TILES}
+
+# Out-of-core mode: with PANORAMA_MAX_SLAB_BYTES set, volumes are memory-mapped and
+# reduced slab by slab within that budget. The MIPs and resampling of a scan run on
+# PANORAMA_SLAB_THREADS threads, by default the cores left to each worker (e.g. all of them
+# with PANORAMA_WORKERS=1, for big scans). Neither changes the output, so not part of the cache key
+MAX_SLAB_BYTES = int(os.environ["PANORAMA_MAX_SLAB_BYTES"]) if "PANORAMA_MAX_SLAB_BYTES" in os.environ else None
+SLAB_THREADS = int(os.environ.get("PANORAMA_SLAB_THREADS", max(1, default_worker_count() // PROCESSING_WORKERS)))
+PROCESSING_OPTIONS = {"max_slab_bytes": MAX_SLAB_BYTES, "threads": SLAB_THREADS}
+
+# Results of previous uploads, keyed on the content hash, PIPELINE_PARAMS and ENCODE_PARAMS;
+# evicting an entry deletes its panorama (and tiles) from STATIC_DIR
+RESULT_CACHE_ENTRIES = int(os.environ.get("PANORAMA_CACHE_ENTRIES", 256))
+RESULT_CACHE_BYTES = int(os.environ.get("PANORAMA_CACHE_BYTES", 1 << 30))
+
+# Re-slicing sessions keep their decoded volume buffer until evicted: after PANORAMA_SESSION_TTL
+# seconds without access, or least recently used first beyond PANORAMA_SESSIONS sessions or
+# PANORAMA_SESSION_BYTES of volumes
+SESSION_TTL_SECONDS = int(os.environ.get("PANORAMA_SESSION_TTL", 1800))
+MAX_SESSIONS = int(os.environ.get("PANORAMA_SESSIONS", 8))
+MAX_SESSION_BYTES = int(os.environ.get("PANORAMA_SESSION_BYTES", 4 << 30))
+
+# Per-request profiling: with PANORAMA_PROFILE_DIR set, requests with ?profile=true run under
+# cProfile and their report is saved there (served at /profiles/<name>)
+PROFILE_DIR = os.environ.get("PANORAMA_PROFILE_DIR")
+if PROFILE_DIR:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+artifact_store = LocalArtifactStore(STATIC_DIR, ARTIFACT_BASE_URL, ARTIFACT_MAX_BYTES, ARTIFACT_TTL_SECONDS)
+result_cache = ResultCache(artifact_store, RESULT_CACHE_ENTRIES, RESULT_CACHE_BYTES)
+sessions = SessionStore(artifact_store, SESSION_TTL_SECONDS, MAX_SESSIONS, MAX_SESSION_BYTES)
+jobs = JobRegistry(pe.PIPELINE_STAGES, JOB_TTL_SECONDS)
+processing_pool = ProcessingPool(PROCESSING_WORKERS, PROCESSING_QUEUE_DEPTH, on_progress=jobs.start_stage,
+                                 warm_up=pe.warm_up if WARM_POOL else None)
+
+# Metrics served at /metrics in the Prometheus text format
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "panorama_stage_seconds", "Duration of the panorama pipeline stages", ["stage"])
+stage_peak_memory = metrics.histogram(
+    "panorama_stage_peak_memory_bytes", "Peak resident memory of the worker during each pipeline stage",
+    ["stage"], buckets=MEMORY_BUCKETS)
+request_seconds = metrics.histogram(
+    "panorama_http_request_seconds", "Duration of the HTTP requests", ["method", "route", "status"])
+results_total = metrics.counter(
+    "panorama_results_total", "Panoramas returned, processed or from the result cache", ["source"])
+metrics.gauge("panorama_pool_pending_jobs", "Jobs running or waiting in the processing pool",
+              lambda: processing_pool.pending)
+metrics.gauge("panorama_result_cache_entries", "Entries in the result cache", lambda: len(result_cache))
+metrics.gauge("panorama_sessions", "Open re-slicing sessions", lambda: len(sessions))
+metrics.gauge("panorama_artifact_bytes", "Disk space of the served artifacts (as of the last collection)",
+              lambda: artifact_store.total_bytes)
+artifacts_collected = metrics.counter(
+    "panorama_artifacts_collected_total", "Artifacts deleted by the artifact garbage collection")
+
+
+async def collect_artifacts():
+    """Collect the artifacts now, then every ARTIFACT_GC_INTERVAL seconds"""
+    while True:
+        try:
+            deleted, _ = await asyncio.to_thread(artifact_store.collect)
+            artifacts_collected.inc(deleted)
+        except Exception:
+            logger.exception("Artifact collection failed")
+        await asyncio.sleep(ARTIFACT_GC_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # The first collection also removes what earlier runs of the server left behind, and so
+    # does this for the volume buffers (which would otherwise stay in RAM, in /dev/shm)
+    for directory in {VOLUME_BUFFER_DIR, UPLOAD_DIR}:
+        removed = remove_stale_buffers(directory)
+        if removed:
+            logger.info("Stale volume buffers removed", extra={"directory": directory, "removed": removed})
+    collector = asyncio.create_task(collect_artifacts())
+    if WARM_POOL:
+        start = time.perf_counter()
+        await asyncio.to_thread(processing_pool.start)
+        logger.info("Worker pool started", extra={"workers": processing_pool.max_workers,
+                                                  "seconds": round(time.perf_counter() - start, 3)})
+    yield
+    collector.cancel()
+    processing_pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
 # Mount the static directory to serve files
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/static", artifact_store.static_files(), name="static")
 
 # Configure CORS middleware
 app.add_middleware(
@@ -46,281 +195,652 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/upload-image")
-async def upload_image(file: UploadFile = File(...)):
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        request_seconds.observe(time.perf_counter() - start, method=request.method,
+                                route=route_label(request.scope), status=status)
+
+
+def route_label(scope):
+    """
+    Metrics label of a request: the route template (/jobs/{job_id}) rather than the path, to bound
+    the series, the mount prefix (/static) for mounted apps and "unmatched" for anything else
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mounts append their prefix to root_path and set no route
+    app_root_path = scope.get("app_root_path", "")
+    mount_path = scope.get("root_path", "")[len(app_root_path):]
+    return mount_path or "unmatched"
+
+
+def record_stage_metrics(result):
+    """Feed the stage timings and peak memory of a worker result to the metrics"""
+    for stage, seconds in result.get("stageTimings", {}).items():
+        stage_seconds.observe(seconds, stage=stage)
+    for stage, peak_bytes in result.get("stagePeakMemory", {}).items():
+        if peak_bytes is not None:
+            stage_peak_memory.observe(peak_bytes, stage=stage)
+
+
+def profiled(process, profile):
+    """
+    Wrap process to run under cProfile when the request asked for a profile
+
+    Returns the function to submit to the pool and the name of the report (None without profiling).
+    """
+    if not profile:
+        return process, None
+    if not PROFILE_DIR:
+        raise HTTPException(status_code=403, detail="Profiling is disabled, set PANORAMA_PROFILE_DIR to enable it")
+    name = f"profile_{uuid.uuid4()}.prof"
+    return functools.partial(profiling.run_profiled, os.path.join(PROFILE_DIR, name), process), name
+
+
+def profile_urls(profile_name):
+    if profile_name is None:
+        return {}
+    return {"profileUrl": f"/profiles/{profile_name}", "profileReportUrl": f"/profiles/{profile_name}.txt"}
+
+
+def server_busy():
+    """503 with Retry-After, returned when the processing pool is saturated"""
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy processing other images, retry later",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+async def save_upload(file: UploadFile) -> tuple[str, str]:
+    """
+    Save an upload to a unique temporary file, answering 503 first if the pool is saturated
+
+    Returns the temporary file path and the result cache key of the upload.
+    """
     # Create a unique temporary file path for the uploaded file
-    temp_file_name = f"{uuid.uuid4()}_{file.filename}"
+    temp_file_name = f"{uuid.uuid4()}_{os.path.basename(file.filename or '')}"
     temp_file_path = os.path.join(UPLOAD_DIR, temp_file_name)
-    
-    # Save the uploaded file to the temporary file path
+
+    # Reject early when the pool is saturated, before writing the upload to disk
+    if processing_pool.pending >= processing_pool.capacity:
+        raise server_busy()
+
+    # Save the uploaded file to the temporary file path, hashing it on the way (in a thread, off the event loop)
     try:
         with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            content_digest = await asyncio.to_thread(copy_and_hash, file.file, buffer)
     except Exception as e:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
         raise HTTPException(status_code=500, detail="Could not save the uploaded file") from e
 
+    # The extension decides how the volume is read, so it is part of the key
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    return temp_file_path, cache_key(content_digest, extension=extension, **PIPELINE_PARAMS, **ENCODE_PARAMS)
+
+
+def panorama_url(output_filename):
+    return artifact_store.url(output_filename)
+
+
+def new_panorama_output():
+    """File name of a new panorama under STATIC_DIR, and of its tile directory if tiles are enabled"""
+    name = artifact_store.new_name("panorama")
+    return name + IMAGE_FORMAT, (f"{name}_tiles" if IMAGE_TILES else None)
+
+
+def encode_options(tiles_name):
+    return {
+        "bit_depth": IMAGE_BIT_DEPTH,
+        "tiles_dir": artifact_store.path(tiles_name) if tiles_name else None,
+    }
+
+
+def panorama_artifacts(output_filename, tiles_name):
+    """URLs of a saved panorama (and its tiles), and the names of the artifacts they serve"""
+    urls = {"panoramicViewUrl": panorama_url(output_filename)}
+    artifacts = [output_filename]
+    if tiles_name:
+        urls["tilesUrl"] = panorama_url(f"{tiles_name}/")
+        artifacts.append(tiles_name)
+    return urls, artifacts
+
+
+def panorama_result(key, result, output_filename, tiles_name):
+    """Add the URLs of the saved panorama to a pipeline result, and cache it with its artifacts"""
+    record_stage_metrics(result)
+    results_total.inc(source="processed")
+    urls, artifacts = panorama_artifacts(output_filename, tiles_name)
+    response_data = {**result, **urls}
+    result_cache.put(key, response_data, artifacts=artifacts)
+    return response_data
+
+
+def cached_result(key):
+    cached = result_cache.get(key)
+    if cached is not None:
+        results_total.inc(source="cached")
+    return cached
+
+
+@app.post("/upload-image")
+async def upload_image(file: UploadFile = File(...), profile: bool = False):
+    process, profile_name = profiled(pe.process_volume_file, profile)
+    temp_file_path, key = await save_upload(file)
+
+    # Same volume with the same parameters: reuse the previous panorama (unless profiling the processing)
+    cached = None if profile else cached_result(key)
+    if cached is not None:
+        os.remove(temp_file_path)
+        return JSONResponse(content={**cached, "cached": True})
+
+    output_filename, tiles_name = new_panorama_output()
+    output_file_path = artifact_store.path(output_filename)
     try:
-        # Step 1: Read the image from the uploaded file using SimpleITK
-        cbct_image = sitk.ReadImage(temp_file_path)
-        
-        # Step 2: Convert the SimpleITK image to a NumPy array
-        cbct_array = sitk.GetArrayFromImage(cbct_image)
-        
-        # Generate a coronal maximum intensity projection (MIP)
-        coronal_mip = pe.generate_coronal_mip(cbct_array)
-        hist, bin_edges = np.histogram(coronal_mip[coronal_mip > 0], bins=256)
-        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-        mean, std_dev, threshold = pe.detect_and_fit_largest_valid_peak(hist, bin_centers)
-        binary_mask = coronal_mip > threshold
-        
-        # Post-process: Morphological operations to remove small noise
-        binary_mask = opening(binary_mask, disk(7))
-        
-        # Compute the Y-Histogram and detect peaks
-        y_hist = np.sum(binary_mask, axis=1)
-        y_axis = np.arange(len(y_hist))
-        peaks, properties = find_peaks(y_hist, height=np.max(y_hist) * 0.5)
-        if len(peaks) == 0:  
-            raise ValueError("No peaks detected in the Y-Histogram!")
-        highest_peak_idx = peaks[np.argmax(y_hist[peaks])]
-        highest_peak_value = y_hist[highest_peak_idx]
-        
-        peak_width = 48  # Define a region around the highest peak for fitting
-        fit_mask = (y_axis >= highest_peak_idx - peak_width) & (y_axis <= highest_peak_idx + peak_width)
-        
-        # Perform Gaussian fitting on the highest peak
-        p0 = [highest_peak_value, highest_peak_idx, 10]  # initial guess: amplitude, mean, std_dev
-        popt, _ = curve_fit(pe.gaussian, y_axis[fit_mask], y_hist[fit_mask], p0=p0)
-        a, mean_t, std_dev_t = popt
-        w = 3 * std_dev_t
-        
-        # Calculate slice range, adjust if more than one peak is detected
-        axial_start_index = abs(int(mean_t - 2.5 * w))
-        axial_end_index = abs(int(mean_t + 1.5 * w))
-        if len(peaks) >= 2:
-            sorted_peaks = peaks[np.argsort(y_hist[peaks])[::-1]]
-            Eb, Et = sorted_peaks[:2]
-            Eb, Et = min(Eb, Et), max(Eb, Et)
-            axial_start_index = abs(int(Eb - 2.5 * w))
-            axial_end_index = abs(int(Et + 1.5 * w))
-        
-        # Compute axial indices and plot binary mask (if needed for debugging)
-        axial_start, axial_end = pe.compute_axial_indices_and_plot(binary_mask, coronal_mip)
-        
-        # Process the axial view (MIP) and apply Gaussian blur
-        axial_mip = pe.process_cbct(cbct_array)
-        axial_mip_blurred = cv2.GaussianBlur(axial_mip, (3, 3), 1.0)
-        hist_axial_mip, bin_edges_axial = np.histogram(axial_mip_blurred[axial_mip_blurred > 0], bins=256)
-        bin_centers_axial = (bin_edges_axial[:-1] + bin_edges_axial[1:]) / 2
-        mean_axial, std_dev_axial, threshold_axial = pe.detect_and_fit_largest_valid_peak(hist_axial_mip, bin_centers_axial)
-        
-        # Create a binary mask for the axial view and process jaws/teeth
-        binary_mask_axial = (axial_mip_blurred > threshold_axial).astype(np.uint8)
-        smoothed_teeth_jaw_mask = pe.process_jaws_and_teeth(binary_mask_axial)
-        
-        # Extract the skeleton from the processed mask
-        skeleton = skeletonize(smoothed_teeth_jaw_mask).astype(np.uint8) * 255
-        
-        # Detect branch points and endpoints in the skeleton
-        kernel = np.ones((3, 3), dtype=np.uint8)
-        branch_points = np.zeros_like(skeleton)
-        end_points = np.zeros_like(skeleton)
-        for i in range(1, skeleton.shape[0] - 1):
-            for j in range(1, skeleton.shape[1] - 1):
-                if skeleton[i, j] == 255:
-                    neighbors = np.sum(skeleton[i - 1:i + 2, j - 1:j + 2] == 255)
-                    if neighbors > 3:
-                        branch_points[i, j] = 255
-                    elif neighbors == 2:
-                        end_points[i, j] = 255
-        # Remove branch points from the skeleton
-        skeleton[branch_points == 255] = 0
-
-        # Get the coordinates of the skeleton pixels and sort them by x-axis
-        skeleton_coords = np.column_stack(np.where(skeleton > 0))
-        skeleton_coords = skeleton_coords[np.argsort(skeleton_coords[:, 1])]
-
-        # Select insertion points for cubic B-spline fitting
-        num_insertion_points = 5  # adjust to control number of points on the B-spline curve
-        x_min, x_max = np.min(skeleton_coords[:, 1]), np.max(skeleton_coords[:, 1])
-        insertion_x = np.linspace(x_min, x_max, num_insertion_points).astype(int)
-        insertion_points = []
-        for x in insertion_x:
-            nearby_points = skeleton_coords[np.abs(skeleton_coords[:, 1] - x) <= 1]
-            if len(nearby_points) > 0:
-                avg_y = np.mean(nearby_points[:, 0])
-                insertion_points.append([avg_y, x])
-        insertion_points = np.array(insertion_points)
-
-        # Fit a B-spline curve to the insertion points
-        x, y = insertion_points[:, 1], insertion_points[:, 0]
-        tck, u = splprep([x, y], s=0, k=2)  # s=0 forces interpolation, k=2 for quadratic (adjust k=3 for cubic if desired)
-        u_fine = np.linspace(0, 1, 750)  # adjust for the desired panorama width
-        spline_x, spline_y = splev(u_fine, tck)
-
-        # Extract the panoramic view using the fitted B-spline curve
-        panoramic_view = pe.extract_panoramic_view(cbct_array, spline_x, spline_y)
-
-        # (Optional) Save the panoramic view as a JPEG image to serve later in the UI
-        output_filename = f"panorama_{uuid.uuid4()}.jpg"
-        output_file_path = os.path.join(STATIC_DIR, output_filename)
-        plt.imshow(panoramic_view, cmap="gray")
-        plt.title("Panoramic View of CBCT")
-        plt.axis("off")
-        plt.savefig(output_file_path, bbox_inches="tight", pad_inches=0)
-        plt.close()
+        # Read the volume, run the panorama pipeline and save the panoramic view in a worker process
+        result = await processing_pool.run(
+            process, temp_file_path, output_file_path, encode_options=encode_options(tiles_name),
+            **PIPELINE_PARAMS, **PROCESSING_OPTIONS,
+        )
 
         # Prepare response with image shape and the URL to the panoramic view
-        response_data = {
-            "imageShape": cbct_array.shape,  # (Depth, Height, Width)
-            "panoramicViewUrl": f"http://localhost:8000/static/{output_filename}"
-        }
+        response_data = panorama_result(key, result, output_filename, tiles_name)
+    except PoolBusyError as e:
+        raise server_busy() from e
     except Exception as e:
+        logger.exception("Image processing failed", extra={"upload": file.filename})
         raise HTTPException(status_code=500, detail="Image processing failed") from e
     finally:
         # Clean up the temporary uploaded file
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
 
-    return JSONResponse(content=response_data)
+    return JSONResponse(content={**response_data, **profile_urls(profile_name), "cached": False})
+
+
+@app.post("/upload-series")
+async def upload_series(request: Request):
+    """
+    Run the panorama pipeline on a DICOM series, uploaded as multipart files or as a single zip
+
+    Slices are sorted by ImagePositionPatient and decoded by a thread pool straight into one
+    preallocated memmap volume, which the worker process maps without any intermediate file.
+    """
+    if processing_pool.pending >= processing_pool.capacity:
+        raise server_busy()
+
+    form = await request.form(max_files=MAX_SERIES_FILES)
+    try:
+        uploads = [value for _, value in form.multi_items() if not isinstance(value, str)]
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        if len(uploads) == 1 and zipfile.is_zipfile(uploads[0].file):
+            sources = await asyncio.to_thread(zip_members, uploads[0].file, MAX_SERIES_FILES, MAX_SERIES_BYTES)
+        else:
+            sources = [upload.file for upload in uploads]
+        series = await asyncio.to_thread(read_series, sources, DECODE_THREADS)
+        volume, volume_path, content_digest = await asyncio.to_thread(
+            decode_series, series, VOLUME_BUFFER_DIR, UPLOAD_DIR, VOLUME_BUFFER_MAX_BYTES, DECODE_THREADS)
+    except SeriesTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e)) from e
+    except (DicomSeriesError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Could not read the uploaded series")
+        raise HTTPException(status_code=400, detail="Could not read the uploaded DICOM series") from e
+    finally:
+        await form.close()
+
+    series_info = {"sliceCount": len(series.slices), "seriesInstanceUID": series.series_uid,
+                   "spacing": list(series.spacing)}
+    try:
+        # The digest only covers the pixels, the spacing changes the arch curve sampling
+        key = cache_key(content_digest, extension=".dcm", spacing=series.spacing, **PIPELINE_PARAMS, **ENCODE_PARAMS)
+        cached = cached_result(key)
+        if cached is not None:
+            return JSONResponse(content={**cached, "series": series_info, "cached": True})
+
+        output_filename, tiles_name = new_panorama_output()
+        try:
+            result = await processing_pool.run(
+                pe.process_volume_memmap, volume_path, volume.shape, volume.dtype.str,
+                artifact_store.path(output_filename), encode_options=encode_options(tiles_name),
+                spacing=series.spacing, **PIPELINE_PARAMS, **PROCESSING_OPTIONS,
+            )
+        except PoolBusyError as e:
+            raise server_busy() from e
+        except Exception as e:
+            logger.exception("Image processing failed", extra={"seriesInstanceUID": series.series_uid})
+            raise HTTPException(status_code=500, detail="Image processing failed") from e
+        response_data = panorama_result(key, result, output_filename, tiles_name)
+    finally:
+        del volume
+        if os.path.exists(volume_path):
+            os.remove(volume_path)
+
+    return JSONResponse(content={**response_data, "series": series_info, "cached": False})
+
+
+def complete_job(job_id, temp_file_path, key, output_filename, tiles_name, profile_name, future):
+    """Record the outcome of a job once its worker finishes, and remove its upload"""
+    try:
+        result = panorama_result(key, future.result(), output_filename, tiles_name)
+        jobs.finish(job_id, {**result, **profile_urls(profile_name), "cached": False})
+    except BrokenProcessPool:
+        # The pool restarts its workers, the job itself may well succeed if submitted again
+        logger.exception("Worker process died", extra={"jobId": job_id})
+        jobs.fail(job_id, "The worker process died (e.g. out of memory), the job can be submitted again")
+    except Exception:
+        logger.exception("Image processing failed", extra={"jobId": job_id})
+        jobs.fail(job_id, "Image processing failed")
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
+def job_accepted(job):
+    return JSONResponse(status_code=202, content={
+        **job.to_dict(),
+        "statusUrl": f"/jobs/{job.id}",
+        "resultUrl": f"/jobs/{job.id}/result",
+    })
+
 
+def start_job(key, input_path, process, *inputs, profile_name=None, **volume_params):
+    """
+    Create a job for an upload saved at input_path, answered from the result cache when possible
 
-def create_dicom_directory() -> str:
+    process(*inputs, output_file_path, on_stage=..., encode_options=..., **volume_params, **PIPELINE_PARAMS,
+    **PROCESSING_OPTIONS) runs in the processing pool, and input_path is removed once the job is over.
+    Profiled jobs (profile_name set, see profiled()) always run.
+    """
+    job = jobs.create()
+    cached = None if profile_name else cached_result(key)
+    if cached is not None:
+        os.remove(input_path)
+        jobs.finish(job.id, {**cached, "cached": True})
+        return job_accepted(job)
+
+    output_filename, tiles_name = new_panorama_output()
+    output_file_path = artifact_store.path(output_filename)
+    try:
+        future = processing_pool.submit(
+            process, *inputs, output_file_path,
+            on_stage=functools.partial(report_progress, job.id), encode_options=encode_options(tiles_name),
+            **volume_params, **PIPELINE_PARAMS, **PROCESSING_OPTIONS,
+        )
+    except PoolBusyError as e:
+        jobs.discard(job.id)
+        os.remove(input_path)
+        raise server_busy() from e
+    future.add_done_callback(functools.partial(
+        complete_job, job.id, input_path, key, output_filename, tiles_name, profile_name))
+
+    return job_accepted(job)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...), profile: bool = False):
+    process, profile_name = profiled(pe.process_volume_file, profile)
+    temp_file_path, key = await save_upload(file)
+    return start_job(key, temp_file_path, process, temp_file_path, profile_name=profile_name)
+
+
+def check_stream_filename(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in (".mha", ".mhd", ".nrrd", ".nhdr"):
+        raise HTTPException(status_code=400, detail="Only MHA and NRRD volumes can be streamed")
+    return extension
+
+
+async def read_volume_stream(request: Request):
+    """Decode a raw MHA / NRRD request body into a memmap buffer, returning the reader and volume header"""
+    reader = StreamingVolumeReader(VOLUME_BUFFER_DIR, spill_dir=UPLOAD_DIR, spill_bytes=VOLUME_BUFFER_MAX_BYTES)
+    try:
+        async for chunk in request.stream():
+            reader.feed(chunk)
+        volume = reader.finish()
+    except VolumeFormatError as e:
+        reader.discard()
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except Exception as e:
+        reader.discard()
+        raise HTTPException(status_code=500, detail="Could not read the uploaded volume") from e
+    return reader, volume
+
+
+@app.post("/jobs/stream", status_code=202)
+async def create_job_from_stream(request: Request, filename: str, profile: bool = False):
+    """
+    Start a job from a raw MHA / NRRD request body (not multipart)
+
+    The volume is decoded while it arrives, straight into a memmap buffer the worker
+    opens without copying, so there is no temporary upload file to write and read back.
+    """
+    extension = check_stream_filename(filename)
+    process, profile_name = profiled(pe.process_volume_memmap, profile)
+    if processing_pool.pending >= processing_pool.capacity:
+        raise server_busy()
+
+    reader, volume = await read_volume_stream(request)
+    key = cache_key(reader.hexdigest, extension=extension, **PIPELINE_PARAMS, **ENCODE_PARAMS)
+    return start_job(key, reader.path, process, reader.path, volume.shape, volume.dtype.str,
+                     profile_name=profile_name, spacing=reader.header.spacing)
+
+
+def get_job_or_404(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return JSONResponse(content=get_job_or_404(job_id).to_dict())
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}, poll /jobs/{job_id} until it is done")
+    return JSONResponse(content=job.result)
+
+
+# Bounds of the session parameters, and of the samples (panoramic columns x thickness x slices) one
+# panorama or cross-section request may resample, PANORAMA_MAX_SAMPLES: beyond, the worker would
+# allocate sampling grids of tens of GB
+MAX_THICKNESS = 1024
+MAX_STRETCH_FACTOR = 8.0
+MAX_SPLINE_POINTS = 8192
+MIN_SAMPLE_SPACING = 0.01  # mm
+MAX_RESAMPLE_SAMPLES = int(os.environ.get("PANORAMA_MAX_SAMPLES", 1 << 31))
+
+
+class PanoramaUpdate(BaseModel):
+    """New panorama parameters of a session, unset fields keep their current value"""
+    thickness: Optional[int] = Field(None, ge=1, le=MAX_THICKNESS)
+    stretchFactor: Optional[float] = Field(None, ge=0.1, le=MAX_STRETCH_FACTOR)
+    interpolation: Optional[Literal[pe.PANORAMIC_INTERPOLATIONS]] = None
+    reduction: Optional[Literal[pe.PANORAMIC_REDUCTIONS]] = None
+    percentile: Optional[float] = Field(None, ge=0, le=100)
+    numSplinePoints: Optional[int] = Field(None, ge=2, le=MAX_SPLINE_POINTS)
+    sampleSpacing: Optional[float] = Field(None, ge=MIN_SAMPLE_SPACING)  # mm between arch curve samples
+    controlPoints: Optional[List[List[float]]] = Field(None, min_length=3)  # [[x, y], ...] on the axial MIP
+
+
+# Session parameters as given to pe.render_panorama_memmap, by PanoramaUpdate field
+SESSION_PARAMS = {
+    "thickness": "thickness",
+    "stretchFactor": "stretch_factor",
+    "interpolation": "interpolation",
+    "reduction": "reduction",
+    "percentile": "percentile",
+    "numSplinePoints": "num_spline_points",
+    "sampleSpacing": "sample_spacing",
+}
+
+
+def session_response(session, result, urls):
+    return {
+        **result,
+        **urls,
+        "sessionId": session.id,
+        "controlPoints": session.control_points,
+        "params": {field: session.params[name] for field, name in SESSION_PARAMS.items()},
+    }
+
+
+def check_resample_size(session, params, control_points, thickness, step=1):
+    """
+    422 when resampling the session volume along the control points would give fewer than two
+    panoramic columns or exceed MAX_RESAMPLE_SAMPLES
+    """
+    if params["num_spline_points"] is not None:
+        num_points = params["num_spline_points"]
+    else:
+        # The polyline through the control points is about as long as the spline through them
+        length = arch_curve.arch_length([point[0] for point in control_points],
+                                        [point[1] for point in control_points], params["spacing"])
+        sample_spacing = params["sample_spacing"] or min(arch_curve.in_plane_spacing(params["spacing"]))
+        num_points = max(2, math.floor(length / sample_spacing) + 1)
+    if int(num_points * params["stretch_factor"]) < 2:
+        raise HTTPException(status_code=422, detail="The panorama would be less than two columns wide: "
+                                                    "raise the stretch factor or the number of arch curve samples")
+    samples = num_points * params["stretch_factor"] / step * thickness * session.shape[0]
+    if samples > MAX_RESAMPLE_SAMPLES:
+        raise HTTPException(status_code=422, detail=f"About {samples:.3g} samples to resample, at most "
+                                                    f"{MAX_RESAMPLE_SAMPLES} are allowed: lower the thickness "
+                                                    f"or the number of arch curve samples")
+
+
+def get_session_or_404(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+
+@app.post("/sessions", status_code=201)
+async def create_session(request: Request, filename: str):
+    """
+    Run the whole pipeline on a raw MHA / NRRD request body, keeping the decoded volume
+    and the arch control points so PUT /sessions/{id}/panorama only re-runs the resampling
+    """
+    check_stream_filename(filename)
+    if processing_pool.pending >= processing_pool.capacity:
+        raise server_busy()
+
+    reader, volume = await read_volume_stream(request)
+    session = sessions.create(reader.path, volume.shape, volume.dtype.str, volume.nbytes, {
+        "thickness": PIPELINE_PARAMS["thickness"],
+        "stretch_factor": PIPELINE_PARAMS["stretch_factor"],
+        "interpolation": "nearest",
+        "reduction": "max",
+        "percentile": 95.0,
+        "num_spline_points": PIPELINE_PARAMS["num_spline_points"],
+        "sample_spacing": PIPELINE_PARAMS["sample_spacing"],
+        "spacing": reader.header.spacing,
+    })
+
+    output_filename, tiles_name = new_panorama_output()
+    try:
+        result = await processing_pool.run(
+            pe.process_volume_memmap, reader.path, volume.shape, volume.dtype.str,
+            artifact_store.path(output_filename), encode_options=encode_options(tiles_name),
+            spacing=reader.header.spacing, **PIPELINE_PARAMS, **PROCESSING_OPTIONS,
+        )
+    except PoolBusyError as e:
+        sessions.remove(session.id)
+        raise server_busy() from e
+    except Exception as e:
+        sessions.remove(session.id)
+        logger.exception("Image processing failed", extra={"sessionId": session.id})
+        raise HTTPException(status_code=500, detail="Image processing failed") from e
+
+    record_stage_metrics(result)
+    urls, artifacts = panorama_artifacts(output_filename, tiles_name)
+    if sessions.set_rendering(session.id, session.params, result["archControlPoints"], artifacts) is None:
+        raise HTTPException(status_code=410, detail="Session expired while processing")
+    return JSONResponse(status_code=201, content=session_response(session, result, urls))
+
+
+@app.put("/sessions/{session_id}/panorama")
+async def update_session_panorama(session_id: str, update: PanoramaUpdate):
+    """Re-render the panorama of a session with new parameters and / or arch control points"""
+    session = get_session_or_404(session_id)
+    params = {**session.params}
+    for field, name in SESSION_PARAMS.items():
+        value = getattr(update, field)
+        if value is not None:
+            params[name] = value
+    control_points = update.controlPoints if update.controlPoints is not None else session.control_points
+    if any(len(point) != 2 or not all(math.isfinite(value) for value in point) for point in control_points):
+        raise HTTPException(status_code=422, detail="Control points must be finite [x, y] pairs")
+    check_resample_size(session, params, control_points, params["thickness"])
+
+    output_filename, tiles_name = new_panorama_output()
+    try:
+        result = await processing_pool.run(
+            pe.render_panorama_memmap, session.volume_path, session.shape, session.dtype,
+            artifact_store.path(output_filename), control_points,
+            encode_options=encode_options(tiles_name), **params, **PROCESSING_OPTIONS,
+        )
+    except PoolBusyError as e:
+        raise server_busy() from e
+    except arch_curve.ArchCurveError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    except Exception as e:
+        logger.exception("Panorama rendering failed", extra={"sessionId": session.id})
+        raise HTTPException(status_code=500, detail="Panorama rendering failed") from e
+
+    record_stage_metrics(result)
+    urls, artifacts = panorama_artifacts(output_filename, tiles_name)
+    if sessions.set_rendering(session.id, params, control_points, artifacts) is None:
+        raise HTTPException(status_code=404, detail="Session expired while rendering")
+    return JSONResponse(content=session_response(session, result, urls))
+
+
+class CrossSectionsRequest(BaseModel):
+    """Cross-sections along the current arch curve of a session, every step-th panoramic column"""
+    step: int = Field(10, ge=1)
+    thickness: Optional[int] = Field(None, ge=1, le=MAX_THICKNESS)  # defaults to the session's panorama thickness
+    interpolation: Optional[Literal[pe.PANORAMIC_INTERPOLATIONS]] = None
+    format: Literal["strip", "npy"] = "strip"
+
+
+@app.post("/sessions/{session_id}/cross-sections")
+async def create_session_cross_sections(session_id: str, request: CrossSectionsRequest):
+    """
+    Render the cross-sections perpendicular to the arch in one pass over the session volume
+
+    They come back as a single image strip (sections side by side, in the order of their
+    panoramic columns) or a stacked (count, depth, thickness) float32 .npy array.
+    """
+    session = get_session_or_404(session_id)
+    params = session.params
+    check_resample_size(session, params, session.control_points, request.thickness or params["thickness"],
+                        request.step)
+    name = artifact_store.new_name("cross_sections", ".npy" if request.format == "npy" else IMAGE_FORMAT)
+    try:
+        result = await processing_pool.run(
+            pe.render_cross_sections_memmap, session.volume_path, session.shape, session.dtype,
+            artifact_store.path(name), session.control_points, step=request.step,
+            num_spline_points=params["num_spline_points"], sample_spacing=params["sample_spacing"],
+            spacing=params["spacing"], thickness=request.thickness or params["thickness"],
+            stretch_factor=params["stretch_factor"], interpolation=request.interpolation or params["interpolation"],
+            encode_options=None if request.format == "npy" else {"bit_depth": IMAGE_BIT_DEPTH},
+            **PROCESSING_OPTIONS,
+        )
+    except PoolBusyError as e:
+        raise server_busy() from e
+    except arch_curve.ArchCurveError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    except Exception as e:
+        logger.exception("Cross-section rendering failed", extra={"sessionId": session.id})
+        raise HTTPException(status_code=500, detail="Cross-section rendering failed") from e
+
+    record_stage_metrics(result)
+    if sessions.set_cross_sections(session.id, [name]) is None:
+        raise HTTPException(status_code=404, detail="Session expired while rendering")
+    return JSONResponse(content={**result, "crossSectionsUrl": panorama_url(name), "sessionId": session.id})
+
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    get_session_or_404(session_id)
+    sessions.remove(session_id)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profiles/{name}")
+async def get_profile(name: str):
+    """cProfile stats (.prof) or text report (.prof.txt) of a profiled request"""
+    path = os.path.join(PROFILE_DIR or "", os.path.basename(name))
+    if not PROFILE_DIR or not name.startswith("profile_") or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path)
+
+
+def create_dicom_directory() -> tuple[str, str]:
     """Create a unique directory for DICOM files"""
-    dicom_dir_name = f"dicom_{uuid.uuid4()}"
-    dicom_dir_path = os.path.join(STATIC_DIR, dicom_dir_name)
+    dicom_dir_name = artifact_store.new_name("dicom")
+    dicom_dir_path = artifact_store.path(dicom_dir_name)
     os.makedirs(dicom_dir_path, exist_ok=True)
     return dicom_dir_name, dicom_dir_path
 
-# # --- NEW Endpoint for 3D Volume Upload ---
-# # This endpoint handles uploading a 3D medical volume file directly.
-# # --- Modified Endpoint for MHA to DICOM Conversion ---
-# @app.post("/upload-volume")
-# async def upload_volume(file: UploadFile = File(...)):
-#     try:
-#         # Validate file type
-#         if not file.filename.lower().endswith(('.mha', '.mhd')):
-#             raise HTTPException(400, "Only MHA/MHD files are supported")
-
-#         # Create temporary file path
-#         temp_file_name = f"{uuid.uuid4()}_{file.filename}"
-#         temp_file_path = os.path.join(UPLOAD_DIR, temp_file_name)
-        
-#         # Create DICOM directory
-#         dicom_dir_name, dicom_dir_path = create_dicom_directory()
-        
-#         # Save uploaded file
-#         with open(temp_file_path, "wb") as buffer:
-#             shutil.copyfileobj(file.file, buffer)
-        
-#         try:
-#             # Read MHA file
-#             image = sitk.ReadImage(temp_file_path)
-#             array = sitk.GetArrayFromImage(image)
-            
-#             # Get metadata
-#             spacing = image.GetSpacing()  # (z, y, x)
-#             origin = image.GetOrigin()    # (x, y, z)
-#             direction = image.GetDirection()
-            
-#             # Generate consistent UIDs
-#             study_uid = pydicom.uid.generate_uid()
-#             series_uid = pydicom.uid.generate_uid()
-            
-#             # Create DICOM files for each slice
-#             dicom_files: list[str] = []
-#             direction_matrix = np.array(direction).reshape(3, 3)
-            
-#             for z in range(array.shape[0]):
-#                 # Create DICOM dataset
-#                 ds = pydicom.Dataset()
-                
-#                 # Patient/Study/Series info
-#                 ds.PatientName = "Anonymous"
-#                 ds.PatientID = "Unknown"
-#                 ds.StudyInstanceUID = study_uid
-#                 ds.SeriesInstanceUID = series_uid
-#                 ds.SOPInstanceUID = pydicom.uid.generate_uid()
-#                 ds.SOPClassUID = "1.2.840.10008.5.1.4.1.1.2"  # CT Image Storage
-#                 ds.Modality = "CT"
-                
-#                 # Image geometry
-#                 ds.PixelSpacing = [str(spacing[2]), str(spacing[1])]  # x,y spacing
-#                 ds.SliceThickness = str(spacing[0])
-#                 ds.ImagePositionPatient = [
-#                     str(origin[0] + z * direction_matrix[0][2] * spacing[0]),
-#                     str(origin[1] + z * direction_matrix[1][2] * spacing[0]),
-#                     str(origin[2] + z * direction_matrix[2][2] * spacing[0])
-#                 ]
-#                 ds.ImageOrientationPatient = [
-#                     str(direction_matrix[0][0]), str(direction_matrix[0][1]),
-#                     str(direction_matrix[1][0]), str(direction_matrix[1][1]),
-#                     str(direction_matrix[2][0]), str(direction_matrix[2][1])
-#                 ]
-                
-#                 # Image parameters
-#                 ds.Rows = array.shape[2]
-#                 ds.Columns = array.shape[1]
-#                 ds.SamplesPerPixel = 1
-#                 ds.PhotometricInterpretation = "MONOCHROME2"
-#                 ds.BitsAllocated = 16
-#                 ds.BitsStored = 16
-#                 ds.HighBit = 15
-#                 ds.PixelRepresentation = 0
-                
-#                 # Pixel data
-#                 slice_data = array[z].astype(np.float32)
-#                 if slice_data.max() > 0:
-#                     slice_data = ((slice_data - slice_data.min()) / 
-#                                 (slice_data.max() - slice_data.min()) * 65535)
-#                 pixel_data = slice_data.astype(np.uint16).tobytes()
-#                 ds.PixelData = pixel_data
-                
-#                 # Metadata
-#                 ds.ContentDate = datetime.datetime.now().strftime('%Y%m%d')
-#                 ds.ContentTime = datetime.datetime.now().strftime('%H%M%S.%f')
-#                 ds.StudyDate = ds.ContentDate
-#                 ds.StudyTime = ds.ContentTime
-#                 ds.SeriesDate = ds.ContentDate
-#                 ds.SeriesTime = ds.ContentTime
-                
-#                 # File metadata
-#                 ds.file_meta = pydicom.Dataset()
-#                 ds.file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
-#                 ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
-#                 ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
-                
-#                 # Save DICOM file
-#                 filename = f"slice_{z:04d}.dcm"
-#                 file_path = os.path.join(dicom_dir_path, filename)
-#                 ds.save_as(file_path, write_like_original=False)
-#                 dicom_files.append(filename)
-            
-#             return JSONResponse(content={
-#                 "dicomBaseUrl": f"/static/{dicom_dir_name}/",
-#                 "seriesInstanceUID": series_uid,
-#                 "studyInstanceUID": study_uid,
-#                 "sliceCount": len(dicom_files),
-#                 "dimensions": {
-#                     "x": array.shape[2],
-#                     "y": array.shape[1],
-#                     "z": array.shape[0]
-#                 }
-#             })
-            
-#         except Exception as e:
-#             raise HTTPException(500, f"DICOM conversion failed: {str(e)}")
-            
-#         finally:
-#             if os.path.exists(temp_file_path):
-#                 os.remove(temp_file_path)
-                
-#     except Exception as e:
-#         raise HTTPException(500, f"Processing failed: {str(e)}")
 
+def read_export_volume(temp_file_path):
+    try:
+        return read_volume(temp_file_path)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Could not read the uploaded volume") from e
+
+
+@app.post("/upload-volume")
+async def upload_volume(file: UploadFile = File(...), format: Literal["series", "multiframe", "zip"] = "series"):
+    """
+    Convert an MHA / NRRD volume to DICOM for the viewer
+
+    format=series writes one file per slice under STATIC_DIR, format=multiframe a single
+    multi-frame file, and format=zip streams a zip of the slice files in the response.
+    """
+    if os.path.splitext(file.filename or "")[1].lower() not in (".mha", ".nrrd"):
+        raise HTTPException(status_code=400, detail="Only MHA and NRRD volumes are supported")
+
+    temp_file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{os.path.basename(file.filename or '')}")
+    try:
+        with open(temp_file_path, "wb") as buffer:
+            await asyncio.to_thread(shutil.copyfileobj, file.file, buffer, 1 << 20)
+        image, volume, geometry = await asyncio.to_thread(read_export_volume, temp_file_path)
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+    try:
+        exporter = await asyncio.to_thread(DicomExporter, volume, geometry, owner=image)
+        if format == "zip":
+            name = os.path.splitext(os.path.basename(file.filename))[0]
+            return StreamingResponse(exporter.iter_zip(), media_type="application/zip",
+                                     headers={"Content-Disposition": f'attachment; filename="{name}_dicom.zip"'})
+        content = {
+            "seriesInstanceUID": exporter.series_uid,
+            "studyInstanceUID": exporter.study_uid,
+            "sliceCount": exporter.depth,
+            "dimensions": {"x": exporter.columns, "y": exporter.rows, "z": exporter.depth},
+        }
+        if format == "multiframe":
+            dicom_name = artifact_store.new_name("dicom", ".dcm")
+            await asyncio.to_thread(exporter.write_multiframe, artifact_store.path(dicom_name))
+            return JSONResponse(content={**content, "dicomUrl": panorama_url(dicom_name)})
+        dicom_dir_name, dicom_dir_path = create_dicom_directory()
+        files = await asyncio.to_thread(exporter.write_series, dicom_dir_path, DECODE_THREADS)
+        return JSONResponse(content={**content, "dicomBaseUrl": panorama_url(dicom_dir_name) + "/", "files": files})
+    except Exception as e:
+        logger.exception("DICOM conversion failed")
+        raise HTTPException(status_code=500, detail="DICOM conversion failed") from e
 
 
 # Run the FastAPI app with uvicorn when this file is executed directly
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="localhost", port=8000, reload=True)
+    # Auto-reload is for development (PANORAMA_RELOAD=1): it restarts the server and its warm workers on every change
+    uvicorn.run("main:app", host="localhost", port=8000, reload=os.environ.get("PANORAMA_RELOAD", "0") == "1")
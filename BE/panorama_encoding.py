@@ -0,0 +1,124 @@
+#panorama_encoding.py
+import json
+import os
+
+import cv2
+import numpy as np
+
+# Formats written by encode_panorama, by file extension
+IMAGE_FORMATS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def window_level(image, window=None, level=None):
+    """
+    Map image intensities to [0, 1] through a window of width window centered on level
+
+    Without window/level the full min..max range is used, like matplotlib's imshow.
+    """
+    image = np.asarray(image, dtype=np.float64)
+    low, high = float(np.min(image)), float(np.max(image))
+    if level is None:
+        level = (low + high) / 2
+    if window is None:
+        window = high - low
+    if window <= 0:
+        return np.zeros_like(image)
+    return np.clip((image - (level - window / 2)) / window, 0, 1)
+
+
+def to_display_image(image, window=None, level=None, bit_depth=8):
+    """Window-level an image into uint8 (bit_depth=8) or uint16 (bit_depth=16) gray levels"""
+    if bit_depth not in (8, 16):
+        raise ValueError("bit_depth must be 8 or 16")
+    max_value = 255 if bit_depth == 8 else 65535
+    scaled = window_level(image, window, level) * max_value
+    return np.rint(scaled).astype(np.uint8 if bit_depth == 8 else np.uint16)
+
+
+def _write_params(extension, quality):
+    if extension in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if extension == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return [cv2.IMWRITE_PNG_COMPRESSION, 1]  # favor speed, PNG is lossless anyway
+
+
+def write_image(display_image, output_path, quality=95):
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format '{extension}', expected one of {IMAGE_FORMATS}")
+    if display_image.dtype == np.uint16 and extension != ".png":
+        raise ValueError("16-bit images can only be written as PNG")
+    if not cv2.imwrite(output_path, display_image, _write_params(extension, quality)):
+        raise IOError(f"Could not write {output_path}")
+
+
+def build_tile_pyramid(display_image, tiles_dir, tile_size=256, extension=".jpg", quality=90):
+    """
+    Write a zoom pyramid of tiles the front-end can load progressively
+
+    Level 0 is the native resolution and every next level halves it, down to a level
+    that fits in a single tile. Tiles are written as <level>/<column>_<row><extension>,
+    and the description of the pyramid is returned and saved as pyramid.json.
+    """
+    os.makedirs(tiles_dir, exist_ok=True)
+    levels = []
+    image = display_image
+    while True:
+        height, width = image.shape[:2]
+        level_dir = os.path.join(tiles_dir, str(len(levels)))
+        os.makedirs(level_dir, exist_ok=True)
+        for row, y in enumerate(range(0, height, tile_size)):
+            for column, x in enumerate(range(0, width, tile_size)):
+                tile = image[y:y + tile_size, x:x + tile_size]
+                write_image(tile, os.path.join(level_dir, f"{column}_{row}{extension}"), quality)
+        levels.append({"width": width, "height": height,
+                       "columns": -(-width // tile_size), "rows": -(-height // tile_size)})
+        if width <= tile_size and height <= tile_size:
+            break
+        image = cv2.resize(image, (max(1, width // 2), max(1, height // 2)), interpolation=cv2.INTER_AREA)
+
+    pyramid = {"tileSize": tile_size, "format": extension.lstrip("."), "levels": levels}
+    with open(os.path.join(tiles_dir, "pyramid.json"), "w") as manifest:
+        json.dump(pyramid, manifest)
+    return pyramid
+
+
+def encode_panorama(panoramic_view, output_path, window=None, level=None, bit_depth=8, quality=95,
+                    tiles_dir=None, tile_size=256):
+    """
+    Write the panorama at its native resolution (one pixel per sample), optionally with a tile pyramid
+
+    The format follows the extension of output_path (JPEG, PNG or WebP); bit_depth=16
+    keeps more gray levels for measurements and needs a PNG. Returns a description of
+    what was written.
+    """
+    display_image = to_display_image(panoramic_view, window, level, bit_depth)
+    write_image(display_image, output_path, quality)
+
+    height, width = display_image.shape
+    encoded = {"width": width, "height": height, "bitDepth": bit_depth}
+    if tiles_dir is not None:
+        # Tiles are for display, always 8-bit JPEG
+        tiles_image = display_image if bit_depth == 8 else (display_image >> 8).astype(np.uint8)
+        encoded["pyramid"] = build_tile_pyramid(tiles_image, tiles_dir, tile_size)
+    return encoded
+
+
+def encode_cross_sections(sections, output_path, window=None, level=None, bit_depth=8, quality=95):
+    """
+    Write a stack of (count, height, width) cross-sections in a single file
+
+    A .npy output keeps the raw float32 stack; an image output is a horizontal strip of
+    the sections, window-leveled together so their gray levels compare. Returns a
+    description of what was written.
+    """
+    count, height, width = sections.shape
+    encoded = {"count": count, "width": width, "height": height}
+    if os.path.splitext(output_path)[1].lower() == ".npy":
+        np.save(output_path, sections.astype(np.float32, copy=False))
+        return {**encoded, "format": "npy", "dtype": "float32"}
+
+    strip = sections.transpose(1, 0, 2).reshape(height, count * width)
+    write_image(to_display_image(strip, window, level, bit_depth), output_path, quality)
+    return {**encoded, "format": "strip", "bitDepth": bit_depth}
@@ -1,27 +1,81 @@
-import SimpleITK as sitk
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
 import numpy as np
-import matplotlib.pyplot as plt
-from tkinter import Tk, filedialog
-from skimage.filters import threshold_otsu
-from skimage.filters import threshold_otsu, threshold_local
-from scipy.ndimage import binary_closing
 import cv2
-from scipy.signal import find_peaks
-from scipy.optimize import curve_fit
-from skimage.morphology import opening, disk
-from scipy.ndimage import gaussian_filter1d
-from skimage import measure
-from skimage.morphology import skeletonize, remove_small_objects
-from scipy.interpolate import splprep, splev
-from scipy.ndimage import distance_transform_edt
-
-def generate_coronal_mip(cbct_array):
-    coronal_mip = np.max(cbct_array, axis=1)  # Maximum intensity projection along coronal axis
-    return coronal_mip
 
-# Gaussian function
-def gaussian(x, a, mean, std_dev):
-    return a * np.exp( -((x - mean) ** 2) / (2 * std_dev ** 2))
+# SimpleITK, scipy and skimage take seconds to import: they are imported by the functions
+# using them, so importing this module (and the server) stays fast; see warm_up()
+import arch_curve
+import histogram_analysis
+import panorama_encoding
+import profiling
+import volume_ingest
+
+logger = logging.getLogger(__name__)
+
+# Threaded volume passes (MIPs and resampling) split the volume into slabs of axial slices
+# processed by a pool of threads, NumPy releasing the GIL in its kernels. Slabs of at most
+# SLAB_CACHE_BYTES keep the working set of a thread cache-sized, and there are at least
+# SLABS_PER_THREAD slabs per thread so the threads stay busy until the end of the pass
+SLAB_CACHE_BYTES = int(os.environ.get("PANORAMA_SLAB_CACHE_BYTES", 4 << 20))
+SLABS_PER_THREAD = 4
+
+
+def _slice_bytes(cbct_array):
+    return max(1, int(np.prod(cbct_array.shape[1:])) * cbct_array.dtype.itemsize)
+
+
+# Number of axial slices per slab so that a slab stays within max_slab_bytes (all slices if None)
+def slab_depth(cbct_array, max_slab_bytes=None):
+    if max_slab_bytes is None:
+        return max(1, len(cbct_array))
+    return max(1, max_slab_bytes // _slice_bytes(cbct_array))
+
+
+# Same for the slabs of a pass over depth slices run by threads: cache-sized, with the slabs of
+# all the threads together within max_slab_bytes
+def thread_slab_depth(cbct_array, threads, max_slab_bytes=None, depth=None):
+    if threads <= 1:
+        return slab_depth(cbct_array, max_slab_bytes)
+    depth = len(cbct_array) if depth is None else depth
+    slab = max(1, SLAB_CACHE_BYTES // _slice_bytes(cbct_array))
+    if max_slab_bytes is not None:
+        slab = min(slab, slab_depth(cbct_array, max_slab_bytes // threads))
+    return max(1, min(slab, -(-depth // (threads * SLABS_PER_THREAD))))
+
+
+def map_slabs(fn, depth, slab, threads=1):
+    """
+    [fn(z0, z1) for every slab [z0, z1) of slab slices of range(depth)], in slab order
+
+    With threads > 1 the slabs are processed by that many threads: fn must only write
+    the output of its own slab, so the result is the same as the serial one.
+    """
+    bounds = [(z0, min(z0 + slab, depth)) for z0 in range(0, depth, slab)]
+    if threads <= 1 or len(bounds) <= 1:
+        return [fn(z0, z1) for z0, z1 in bounds]
+    with ThreadPoolExecutor(min(threads, len(bounds)), thread_name_prefix="slab") as executor:
+        return list(executor.map(lambda slab_bounds: fn(*slab_bounds), bounds))
+
+
+def generate_coronal_mip(cbct_array, max_slab_bytes=None, threads=1):
+    if max_slab_bytes is None and threads <= 1:
+        return np.max(cbct_array, axis=1)  # Maximum intensity projection along coronal axis
+
+    # Slab by slab: out-of-core (e.g. over a np.memmap larger than RAM) and/or on threads
+    depth, height, width = cbct_array.shape
+    coronal_mip = np.empty((depth, width), dtype=cbct_array.dtype)
+
+    def reduce(z0, z1):
+        coronal_mip[z0:z1] = np.max(cbct_array[z0:z1], axis=1)
+
+    map_slabs(reduce, depth, thread_slab_depth(cbct_array, threads, max_slab_bytes), threads)
+    return coronal_mip
 
 # Preprocess the histogram to exclude spikes
 def preprocess_histogram(hist, bin_centers, spike_threshold=0.05):
@@ -31,39 +85,13 @@ def preprocess_histogram(hist, bin_centers, spike_threshold=0.05):
     filtered_hist = hist * valid_mask
     return filtered_hist, valid_mask
 
-# Detect and Fit Gaussian to Largest Valid Peak
+# Detect and Fit Gaussian to Largest Valid Peak (see histogram_analysis.fit_peak_threshold)
 def detect_and_fit_largest_valid_peak(hist, bin_centers, peak_width=20, intensity_cutoff=0.95):
-    # Step 1: Filter out high-intensity spikes
-    valid_intensity_mask = bin_centers < intensity_cutoff * np.max(bin_centers)
-    filtered_hist = hist * valid_intensity_mask
-
-    # Step 2: Detect peaks in the filtered histogram
-    peaks, _ = find_peaks(filtered_hist, height=np.mean(filtered_hist) * 1.5)  # Detect meaningful peaks
-    if len(peaks) == 0:
-        raise ValueError("No valid peaks detected after filtering the histogram!")
-
-    # Step 3: Identify the peak with the highest gray value
-    largest_gray_value_peak = peaks[np.argmax(bin_centers[peaks])]
-
-    # Step 4: Define the range for Gaussian fitting
-    peak_center = bin_centers[largest_gray_value_peak]
-    fit_mask = (bin_centers >= peak_center - peak_width) & (bin_centers <= peak_center + peak_width)
-
-    try:
-        # Step 5: Perform Gaussian fitting
-        p0 = [hist[largest_gray_value_peak], peak_center, 10]  # Initial guess
-        popt, _ = curve_fit(gaussian, bin_centers[fit_mask], hist[fit_mask], p0=p0)
-        a, mean, std_dev = popt
-
-        # Step 6: Calculate the threshold
-        threshold = mean + 1.98 * std_dev
-
-        return mean, std_dev, threshold
-    except RuntimeError:
-        print("Gaussian fitting failed. Falling back to alternative thresholding...")
-        # Example fallback
-        threshold = np.percentile(bin_centers, 95)
-        return None, None, threshold
+    fit = histogram_analysis.fit_peak_threshold(hist, bin_centers, peak_width, intensity_cutoff)
+    if fit.method == "percentile":
+        logger.warning("Gaussian fit of the intensity histogram failed, falling back to the 95th percentile",
+                       extra={"peakCenter": fit.peak})
+    return fit.mean, fit.std_dev, fit.threshold
 
 def compute_axial_indices_and_plot(binary_mask, coronal_mip):
     # Step 1: Compute the Y-Histogram
@@ -71,22 +99,20 @@ def compute_axial_indices_and_plot(binary_mask, coronal_mip):
     y_axis = np.arange(len(y_hist))  # Y-axis positions
 
     # Step 2: Detect Peaks in Y-Histogram
-    peaks, properties = find_peaks(y_hist, height=np.max(y_hist) * 0.5)  # Peaks > 50% max height
+    peaks = histogram_analysis.local_maxima(y_hist, height=np.max(y_hist) * 0.5)  # Peaks > 50% max height
     if len(peaks) == 0:
         raise ValueError("No peaks detected in the Y-Histogram!")
 
     # Identify the highest peak
     highest_peak_idx = peaks[np.argmax(y_hist[peaks])]
-    highest_peak_value = y_hist[highest_peak_idx]
 
     # Step 3: Fit Gaussian to the Highest Peak
     peak_width = 50  # Region around the highest peak for fitting
     fit_mask = (y_axis >= highest_peak_idx - peak_width) & (y_axis <= highest_peak_idx + peak_width)
-
-    # Perform Gaussian fitting
-    p0 = [highest_peak_value, highest_peak_idx, 10]  # Initial guess: amplitude, mean, std_dev
-    popt, _ = curve_fit(gaussian, y_axis[fit_mask], y_hist[fit_mask], p0=p0)
-    a, mean_t, std_dev_t = popt
+    fit = histogram_analysis.fit_gaussian(y_axis[fit_mask], y_hist[fit_mask])
+    if fit is None:
+        raise ValueError("Gaussian fit of the Y-Histogram failed!")
+    mean_t, std_dev_t = fit.mean, fit.std_dev
 
     # Compute the width (w)
     w = 3 * std_dev_t
@@ -100,8 +126,7 @@ def compute_axial_indices_and_plot(binary_mask, coronal_mip):
  
         # Ensure Eb is the lower peak and Et is the upper peak
         Eb, Et = min(Eb, Et), max(Eb, Et)
-        print("Eb:",Eb)
-        print("Et:",Et)
+        logger.debug("Jaw peaks of the y-histogram", extra={"Eb": int(Eb), "Et": int(Et)})
         # Compute slice range
         axial_start_index = abs(int(Eb - 2.5 * w ))
         axial_end_index = abs(int(Et + 1.5 * w ))
@@ -112,47 +137,46 @@ def compute_axial_indices_and_plot(binary_mask, coronal_mip):
     return axial_start_index, axial_end_index
 
 
-def generate_axial_mip(cbct_array, lower_bound, upper_bound):
+def generate_axial_mip(cbct_array, lower_bound, upper_bound, max_slab_bytes=None, threads=1):
     axial_range = cbct_array[lower_bound:upper_bound]
-    axial_mip = np.max(axial_range, axis=0)  # Maximum intensity projection along axial view
-    return axial_mip
+    if max_slab_bytes is None and threads <= 1:
+        return np.max(axial_range, axis=0)  # Maximum intensity projection along axial view
+
+    # Running maximum over slabs (out-of-core), each thread over its share of the range, then
+    # the maximum of the threads' MIPs (the maximum is exact, so in any order)
+    threads = max(1, min(threads, len(axial_range)))
+    slab = thread_slab_depth(cbct_array, threads, max_slab_bytes, depth=len(axial_range))
+
+    def running_max(z0, z1):
+        mip = np.max(axial_range[z0:min(z0 + slab, z1)], axis=0)
+        for z in range(z0 + slab, z1, slab):
+            np.maximum(mip, np.max(axial_range[z:min(z + slab, z1)], axis=0), out=mip)
+        return mip
+
+    mips = map_slabs(running_max, len(axial_range), -(-len(axial_range) // threads), threads)
+    axial_mip = mips[0]
+    for mip in mips[1:]:
+        np.maximum(axial_mip, mip, out=axial_mip)
+    return np.asarray(axial_mip)
 
 # Complete Pipeline
 def process_cbct(cbct_array):
-    # Step 1: Coronal MIP
-    coronal_mip = generate_coronal_mip(cbct_array)
-    #compute histogram
-    hist, bin_edges = np.histogram(coronal_mip[coronal_mip > 0], bins=256)
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-
-    # Detect and Fit Gaussian for Largest Valid Peak
-    # Apply updated method to detect and fit the peak
-    mean, std_dev, threshold = detect_and_fit_largest_valid_peak(hist, bin_centers)
-    print(f"Mean (μ): {mean}")
-    print(f"Standard Deviation (σ): {std_dev}")
-    print(f"Threshold (T): {threshold}")
-
-    # Create the binary mask by thresholding the image
-    binary_mask = coronal_mip > threshold
-    print(threshold)
-    # Post-processing: Morphological operations to remove small noise
-    binary_mask = opening(binary_mask, disk(7))  # Remove small noise with morphological operations
-
-    plt.imshow(binary_mask, cmap = 'gray')
-    
-    # Step 4: Slice Bounds
-    axial_start, axial_end = compute_axial_indices_and_plot(binary_mask, coronal_mip)
-    print(f"Axial Start Index: {axial_start}")
-    print(f"Axial End Index: {axial_end}")
-    
-    # Step 4: Axial MIP
-    axial_mip = generate_axial_mip(cbct_array, axial_start, axial_end)
+    pipeline = PanoramaPipeline(cbct_array)
+    axial_mip = pipeline.axial_mip()
+
+    axial_start, axial_end = pipeline.axial_bounds()
+    logger.info("Coronal analysis done", extra={
+        "coronalThreshold": float(pipeline.coronal_threshold()),
+        "axialBounds": [int(axial_start), int(axial_end)],
+    })
 
     return axial_mip
 
-def process_jaws_and_teeth(binary_mask_axial):
+def process_jaws_and_teeth(binary_mask_axial, kernel_size=27):
+    from scipy.ndimage import gaussian_filter1d
+
     # Step 1: Morphological Operations to clean the binary mask
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (27, 27))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
     cleaned_mask = cv2.morphologyEx(binary_mask_axial, cv2.MORPH_OPEN, kernel)
     cleaned_mask = cv2.morphologyEx(cleaned_mask, cv2.MORPH_OPEN, kernel)
 
@@ -187,16 +211,50 @@ def process_jaws_and_teeth(binary_mask_axial):
 
     return smoothed_mask
 
-# play in thickness for better resolution of teeth also you can play in the stretch factor
-def extract_panoramic_view(cbct_data, curve_x, curve_y, thickness=100, stretch_factor=1.5):
+# Detect branch points and endpoints of a skeleton (0/255) and remove the branch points
+def analyze_skeleton(skeleton):
+    on = (skeleton == 255).astype(np.uint8)
+
+    # Count the skeleton pixels in every 3x3 neighborhood (center included) in one pass
+    neighbors = cv2.filter2D(on, -1, np.ones((3, 3), dtype=np.float32), borderType=cv2.BORDER_CONSTANT)
+
+    # Only interior pixels are classified, border pixels are never branch points or endpoints
+    interior = np.zeros_like(on, dtype=bool)
+    interior[1:-1, 1:-1] = True
+    on_interior = (on == 1) & interior
+
+    branch_points = np.where(on_interior & (neighbors > 3), 255, 0).astype(skeleton.dtype)
+    end_points = np.where(on_interior & (neighbors == 2), 255, 0).astype(skeleton.dtype)
+
+    # Remove branch points from the skeleton
+    pruned_skeleton = skeleton.copy()
+    pruned_skeleton[branch_points == 255] = 0
+
+    return pruned_skeleton, branch_points, end_points
+
+# Sampling grid of the panoramic curve: the stretched curve, its unit normals and the
+# offsets sampled along each normal (num_points x thickness samples per slice)
+class PanoramicGrid(NamedTuple):
+    curve_x: np.ndarray   # (num_points,)
+    curve_y: np.ndarray   # (num_points,)
+    normal_x: np.ndarray  # (num_points,)
+    normal_y: np.ndarray  # (num_points,)
+    offsets: np.ndarray   # (thickness,)
+
+
+PANORAMIC_INTERPOLATIONS = ("nearest", "trilinear")
+PANORAMIC_REDUCTIONS = ("max", "mean", "percentile")
+
+
+def build_panoramic_grid(curve_x, curve_y, thickness=100, stretch_factor=1.5):
     """
-    Extract panoramic view with proper stretching and sampling
+    Build the sampling grid of curve normals once, to be reused for every slice
     """
-    depth, height, width = cbct_data.shape
-
     # Increase number of sampling points horizontally by stretch factor
     num_points = int(len(curve_x) * stretch_factor)
-    panoramic = np.zeros((depth, num_points))
+    if num_points < 2:
+        raise arch_curve.ArchCurveError(f"{len(curve_x)} curve samples stretched by {stretch_factor} "
+                                        f"give fewer than two panoramic columns")
 
     # Resample curve points to match new resolution
     t = np.linspace(0, 1, len(curve_x))
@@ -208,31 +266,633 @@ def extract_panoramic_view(cbct_data, curve_x, curve_y, thickness=100, stretch_f
     dx = np.gradient(curve_x_stretched)
     dy = np.gradient(curve_y_stretched)
 
-    for z in range(depth):
-        slice_data = cbct_data[z]
+    # Calculate perpendicular direction (left as is where the curve is degenerate)
+    normal_x = -dy
+    normal_y = dx
+    norm = np.sqrt(normal_x**2 + normal_y**2)
+    norm[norm == 0] = 1
+    normal_x = normal_x / norm
+    normal_y = normal_y / norm
+
+    # Sample along perpendicular line, same offsets as the original per-voxel loop
+    offsets = np.arange(-thickness // 2, thickness // 2)
+
+    return PanoramicGrid(curve_x_stretched, curve_y_stretched, normal_x, normal_y, offsets)
+
+
+def _panoramic_sample_plan(grid, height, width, interpolation):
+    # Flat in-slice indices, weights and validity of every sample, computed once for all slices
+    if interpolation == "nearest":
+        # Truncate exactly like the original loop: int(int(x) + normal_x * t)
+        x0 = np.trunc(grid.curve_x)[:, None]
+        y0 = np.trunc(grid.curve_y)[:, None]
+        sample_x = np.trunc(x0 + grid.normal_x[:, None] * grid.offsets[None, :]).astype(np.int64)
+        sample_y = np.trunc(y0 + grid.normal_y[:, None] * grid.offsets[None, :]).astype(np.int64)
+        valid = (sample_x >= 0) & (sample_x < width) & (sample_y >= 0) & (sample_y < height)
+        index = np.where(valid, sample_y * width + sample_x, 0)
+        return [index], [None], valid
+
+    if interpolation == "trilinear":
+        # Slices are sampled on their own plane, so trilinear reduces to bilinear in y/x
+        sample_x = grid.curve_x[:, None] + grid.normal_x[:, None] * grid.offsets[None, :]
+        sample_y = grid.curve_y[:, None] + grid.normal_y[:, None] * grid.offsets[None, :]
+        valid = (sample_x >= 0) & (sample_x <= width - 1) & (sample_y >= 0) & (sample_y <= height - 1)
+        sample_x = np.clip(sample_x, 0, width - 1)
+        sample_y = np.clip(sample_y, 0, height - 1)
+        ix = np.minimum(np.floor(sample_x).astype(np.int64), max(width - 2, 0))
+        iy = np.minimum(np.floor(sample_y).astype(np.int64), max(height - 2, 0))
+        fx = sample_x - ix
+        fy = sample_y - iy
+        ix1 = np.minimum(ix + 1, width - 1)
+        iy1 = np.minimum(iy + 1, height - 1)
+        indices = [iy * width + ix, iy * width + ix1, iy1 * width + ix, iy1 * width + ix1]
+        weights = [(1 - fy) * (1 - fx), (1 - fy) * fx, fy * (1 - fx), fy * fx]
+        return indices, weights, valid
+
+    raise ValueError(f"Unknown interpolation '{interpolation}', expected one of {PANORAMIC_INTERPOLATIONS}")
+
+
+def _reduce_panoramic_samples(samples, valid, counts, reduction, percentile):
+    # samples: (slices, num_points, thickness), valid: (num_points, thickness)
+    if reduction == "max":
+        fill = np.finfo(samples.dtype).min if samples.dtype.kind == "f" else np.iinfo(samples.dtype).min
+        reduced = np.where(valid, samples, fill).max(axis=-1).astype(np.float64)
+    elif reduction == "mean":
+        reduced = np.where(valid, samples, 0).sum(axis=-1, dtype=np.float64) / np.maximum(counts, 1)
+    elif reduction == "percentile":
+        # Sort invalid samples to the front, then interpolate the percentile among the valid tail
+        ordered = np.where(valid, samples.astype(np.float64), -np.inf)
+        ordered.sort(axis=-1)
+        thickness = ordered.shape[-1]
+        position = (thickness - counts) + (counts - 1) * (percentile / 100.0)
+        position = np.clip(position, 0, thickness - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, thickness - 1)
+        fraction = position - lower
+        lower_values = np.take_along_axis(ordered, np.broadcast_to(lower[..., None], ordered.shape[:-1] + (1,)), axis=-1)[..., 0]
+        upper_values = np.take_along_axis(ordered, np.broadcast_to(upper[..., None], ordered.shape[:-1] + (1,)), axis=-1)[..., 0]
+        reduced = lower_values + (upper_values - lower_values) * fraction
+    else:
+        raise ValueError(f"Unknown reduction '{reduction}', expected one of {PANORAMIC_REDUCTIONS}")
+
+    # Columns without a single in-bounds sample stay 0, like the original loop
+    return np.where(counts > 0, reduced, 0.0)
+
+
+def _panoramic_sampler(cbct_data, grid, interpolation):
+    # Validity of the grid samples, and gather(z0, z1) returning the (slices, num_points, thickness)
+    # samples of the slices z0 .. z1 - 1. np.take lays them out C-contiguous (flat[:, index] puts the
+    # slices last), several times faster for small slabs, and the reductions along the normals then
+    # run on a contiguous axis, so they do not depend on the number of slices per slab
+    depth, height, width = cbct_data.shape
+    indices, weights, valid = _panoramic_sample_plan(grid, height, width, interpolation)
+
+    def gather(z0, z1):
+        flat = np.asarray(cbct_data[z0:z1]).reshape(-1, height * width)
+        if weights[0] is None:
+            return np.take(flat, indices[0], axis=1)
+        return sum(np.take(flat, index, axis=1) * weight for index, weight in zip(indices, weights))
+
+    return valid, gather
+
+
+def _panoramic_slab_depth(cbct_data, valid, max_chunk_samples, max_slab_bytes, threads):
+    # Slices per slab so the samples gathered by all the threads stay within max_chunk_samples
+    # (and the slabs they read within max_slab_bytes); cache-sized slabs are faster also on one thread
+    slab = max(1, max_chunk_samples // threads // valid.size)
+    slab = min(slab, max(1, SLAB_CACHE_BYTES // _slice_bytes(cbct_data)))
+    return min(slab, thread_slab_depth(cbct_data, threads, max_slab_bytes))
+
+
+def resample_panoramic_view(cbct_data, grid, interpolation="nearest", reduction="max", percentile=95.0,
+                            max_chunk_samples=1 << 24, max_slab_bytes=None, threads=1):
+    """
+    Gather every slice along the sampling grid in batched NumPy passes and reduce along the normals
+    (slab by slab, on threads if threads > 1)
+    """
+    valid, gather = _panoramic_sampler(cbct_data, grid, interpolation)
+    counts = valid.sum(axis=1)
+
+    panoramic = np.zeros((cbct_data.shape[0], len(grid.curve_x)))
+    if valid.size == 0:
+        return panoramic
+
+    def resample(z0, z1):
+        panoramic[z0:z1] = _reduce_panoramic_samples(gather(z0, z1), valid, counts, reduction, percentile)
+
+    map_slabs(resample, cbct_data.shape[0],
+              _panoramic_slab_depth(cbct_data, valid, max_chunk_samples, max_slab_bytes, threads), threads)
+    return panoramic
+
+
+def resample_cross_sections(cbct_data, grid, interpolation="nearest", max_chunk_samples=1 << 24,
+                            max_slab_bytes=None, threads=1):
+    """
+    Cross-sections of the volume along every normal of the sampling grid, in one pass over the volume
+
+    Returns a (num_points, depth, thickness) array: section i is the plane spanned by the z
+    axis and the normal at grid point i, out-of-volume samples are 0.
+    """
+    valid, gather = _panoramic_sampler(cbct_data, grid, interpolation)
+
+    sections = np.zeros((len(grid.curve_x), cbct_data.shape[0], len(grid.offsets)), dtype=np.float32)
+    if valid.size == 0:
+        return sections
+
+    def resample(z0, z1):
+        sections[:, z0:z1] = np.where(valid, gather(z0, z1), 0).transpose(1, 0, 2)
+
+    map_slabs(resample, cbct_data.shape[0],
+              _panoramic_slab_depth(cbct_data, valid, max_chunk_samples, max_slab_bytes, threads), threads)
+    return sections
+
+
+# play in thickness for better resolution of teeth also you can play in the stretch factor
+def extract_panoramic_view(cbct_data, curve_x, curve_y, thickness=100, stretch_factor=1.5,
+                           interpolation="nearest", reduction="max", percentile=95.0, max_slab_bytes=None,
+                           threads=1):
+    """
+    Extract panoramic view with proper stretching and sampling
+    """
+    grid = build_panoramic_grid(curve_x, curve_y, thickness, stretch_factor)
+    # reduction: "max" for maximum intensity projection, "mean" or "percentile" for a robust MIP
+    return resample_panoramic_view(cbct_data, grid, interpolation, reduction, percentile,
+                                   max_slab_bytes=max_slab_bytes, threads=threads)
+
 
-        for i in range(num_points):
-            x, y = int(curve_x_stretched[i]), int(curve_y_stretched[i])
+# Cross-sections perpendicular to the arch at every step-th column of the panoramic view
+def extract_cross_sections(cbct_data, curve_x, curve_y, step=10, thickness=100, stretch_factor=1.5,
+                           interpolation="nearest", max_slab_bytes=None, threads=1):
+    """
+    Extract the cross-sections at panoramic columns 0, step, 2 * step, ... on the same grid as
+    extract_panoramic_view, returning the (count, depth, thickness) sections, their columns and
+    their (x, y) positions on the axial plane
+    """
+    grid = build_panoramic_grid(curve_x, curve_y, thickness, stretch_factor)
+    columns = np.arange(0, len(grid.curve_x), step)
+    section_grid = PanoramicGrid(grid.curve_x[columns], grid.curve_y[columns],
+                                 grid.normal_x[columns], grid.normal_y[columns], grid.offsets)
+    sections = resample_cross_sections(cbct_data, section_grid, interpolation, max_slab_bytes=max_slab_bytes,
+                                       threads=threads)
+    return sections, columns, np.column_stack([section_grid.curve_x, section_grid.curve_y])
+
+
+# Insertion points (y, x) of the arch curve, averaged along the skeleton at evenly spaced x positions
+def arch_insertion_points(skeleton, num_insertion_points=None, spacing=None):
+    # Insertion points (y, x) for the B-spline fitting, averaged along the skeleton at evenly spaced
+    # x positions; as many as the arch needs (see arch_curve.adaptive_insertion_points) unless given
+    index = arch_curve.SkeletonIndex(skeleton)
+    if num_insertion_points is None:
+        return arch_curve.adaptive_insertion_points(index, spacing)
+    return index.insertion_points(num_insertion_points)
+
+
+# Fit a B-spline curve to the insertion points and sample it evenly along its length: every
+# sample_spacing mm (the in-plane voxel size by default), or num_samples samples if given
+def fit_arch_spline(insertion_points, num_samples=None, spacing=None, sample_spacing=None):
+    return arch_curve.sample_arch_spline(insertion_points, spacing, sample_spacing, num_samples)
+
+
+# Fit the dental arch curve through insertion points averaged along the skeleton
+def fit_arch_curve(skeleton, num_insertion_points=None, num_samples=None, spacing=None, sample_spacing=None):
+    return fit_arch_spline(arch_insertion_points(skeleton, num_insertion_points, spacing), num_samples, spacing,
+                           sample_spacing)
+
+
+# Downsample a binary mask by an integer factor (a coarse pixel is set when most of its block is)
+def downsample_mask(mask, factor):
+    height, width = mask.shape
+    coarse = cv2.resize((mask > 0).astype(np.uint8) * 255, (max(1, width // factor), max(1, height // factor)),
+                        interpolation=cv2.INTER_AREA)
+    return (coarse > 127).astype(np.uint8)
+
+
+def upsample_mask(mask, shape):
+    return cv2.resize(mask.astype(np.uint8), (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+
+
+# Map (y, x) points of a coarse image back to the pixel grid of the full resolution image
+def upscale_points(points, coarse_shape, full_shape):
+    scale = np.array([full_shape[0] / coarse_shape[0], full_shape[1] / coarse_shape[1]])
+    return (points + 0.5) * scale - 0.5
+
+
+# Move each insertion point (y, x) to the middle of the mask run crossing it along the curve normal,
+# searching at most band pixels away: refines a coarse arch curve on the full resolution mask
+def refine_insertion_points(insertion_points, mask, band):
+    height, width = mask.shape
+    tangent = np.gradient(insertion_points, axis=0)
+    normal = np.column_stack([tangent[:, 1], -tangent[:, 0]])
+    norm = np.linalg.norm(normal, axis=1, keepdims=True)
+    normal = normal / np.where(norm == 0, 1, norm)
+
+    offsets = np.arange(-band, band + 1)
+    samples = insertion_points[:, None, :] + normal[:, None, :] * offsets[None, :, None]
+    rows = np.clip(np.rint(samples[..., 0]).astype(int), 0, height - 1)
+    cols = np.clip(np.rint(samples[..., 1]).astype(int), 0, width - 1)
+    inside = mask[rows, cols] > 0
+
+    refined = insertion_points.copy()
+    for i, run in enumerate(inside):
+        if not run.any():
+            continue
+        # Start from the in-mask offset closest to the coarse point, then grow the run both ways
+        center = np.flatnonzero(run)[np.argmin(np.abs(offsets[run]))]
+        low = center
+        while low > 0 and run[low - 1]:
+            low -= 1
+        high = center
+        while high < len(run) - 1 and run[high + 1]:
+            high += 1
+        refined[i] += normal[i] * (offsets[low] + offsets[high]) / 2
+    return refined
+
+
+# Dtypes cv2.GaussianBlur filters
+CV_FILTER_DTYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+# Histogram of the non-zero pixels and the threshold fitted on its largest valid peak
+# (a histogram_analysis.ThresholdFit, with the fit diagnostics)
+def fit_mip_threshold(mip):
+    hist, bin_centers = histogram_analysis.histogram(mip[mip > 0], bins=256)
+    fit = histogram_analysis.fit_peak_threshold(hist, bin_centers)
+    if fit.method == "percentile":
+        logger.warning("Gaussian fit of the intensity histogram failed, falling back to the 95th percentile",
+                       extra={"peakCenter": fit.peak})
+    return fit
+
+
+class PanoramaPipeline:
+    """
+    Panorama extraction where every intermediate is computed once, cached and timed
+
+    Stages are computed on first access and pull in the stages they depend on, so
+    e.g. pipeline.panoramic_view() runs the whole chain while pipeline.axial_bounds()
+    stops after the coronal analysis. Per-stage durations (seconds) are in .timings
+    and the peak resident memory (bytes) reached during each stage in .peak_memory,
+    and on_stage(name), if given, is called when a stage starts computing.
+
+    With max_slab_bytes set, the volume passes (MIPs and resampling) read it slab by
+    slab within that budget, so cbct_array can be a np.memmap larger than RAM; the
+    output is the same as the in-memory path. With threads > 1, these passes run slab by
+    slab on that many threads (see map_slabs), with the same output as with one thread.
+
+    With downsample > 1 (coarse-to-fine), the morphology that only needs the rough
+    arch shape (coronal opening, jaw/teeth openings, skeleton) runs on MIP masks
+    downsampled by that factor, with structuring elements scaled to match; the arch
+    insertion points are then refined on the full resolution axial mask near the curve.
+    When the features vanish at that factor (small volumes) and the slice bounds or the
+    insertion points cannot be found, the coarse stages are rerun at full resolution.
+
+    spacing is the (x, y, z) voxel size in mm (1 mm if unknown): the number of insertion
+    points follows the shape of the arch (unless num_insertion_points is given) and the
+    arch curve is sampled every sample_spacing mm, the in-plane voxel size by default
+    (unless num_spline_points is given), so the panorama width follows the arch length.
+    """
 
-            # Calculate perpendicular direction
-            normal_x = -dy[i]
-            normal_y = dx[i]
-            norm = np.sqrt(normal_x**2 + normal_y**2)
-            if norm != 0:
-                normal_x /= norm
-                normal_y /= norm
+    def __init__(self, cbct_array, thickness=100, stretch_factor=1.5, num_insertion_points=None,
+                 num_spline_points=None, interpolation="nearest", reduction="max", on_stage=None,
+                 max_slab_bytes=None, downsample=1, spacing=None, sample_spacing=None, threads=1):
+        self.cbct_array = cbct_array
+        self.thickness = thickness
+        self.stretch_factor = stretch_factor
+        self.num_insertion_points = num_insertion_points
+        self.num_spline_points = num_spline_points
+        self.spacing = spacing
+        self.sample_spacing = sample_spacing
+        self.interpolation = interpolation
+        self.reduction = reduction
+        self.results = {}
+        self.timings = {}
+        self.peak_memory = {}
+        self.on_stage = on_stage
+        self.max_slab_bytes = max_slab_bytes
+        self.threads = max(1, int(threads))
+        self.downsample = max(1, int(downsample))
+
+    def _stage(self, name, compute):
+        if name not in self.results:
+            if self.on_stage is not None:
+                self.on_stage(name)
+            self.results[name] = profiling.measure(name, compute, self.timings, self.peak_memory)
+        return self.results[name]
+
+    def _coarse_to_fine(self, coarse_stages, compute):
+        """compute(), rerun at full resolution (without the coarse_stages results) if it fails on coarse masks"""
+        try:
+            return compute()
+        except ValueError as e:
+            if self.downsample == 1:
+                raise
+            logger.warning("Coarse-to-fine arch detection failed, retrying at full resolution",
+                           extra={"downsample": self.downsample, "error": str(e)})
+            self.downsample = 1
+            for name in coarse_stages:
+                self.results.pop(name, None)
+            return compute()
 
-            # Sample along perpendicular line with more points
-            samples = []
-            for t in range(-thickness // 2, thickness // 2):
-                sample_x = int(x + normal_x * t)
-                sample_y = int(y + normal_y * t)
+    # Step 1: Coronal MIP
+    def coronal_mip(self):
+        return self._stage("coronal_mip", lambda: generate_coronal_mip(self.cbct_array, self.max_slab_bytes, self.threads))
+
+    # Step 2: Threshold from the Gaussian fitted on the coronal MIP histogram
+    def coronal_threshold(self):
+        coronal_mip = self.coronal_mip()
+        return self._stage("coronal_threshold", lambda: fit_mip_threshold(coronal_mip)).threshold
+
+    # Step 3: Binary mask, with small noise removed by a morphological opening
+    def coronal_mask(self):
+        coronal_mip, threshold = self.coronal_mip(), self.coronal_threshold()
+
+        def compute():
+            from skimage.morphology import disk, opening
+
+            if self.downsample == 1:
+                return opening(coronal_mip > threshold, disk(7))
+            coarse = downsample_mask(coronal_mip > threshold, self.downsample)
+            coarse = opening(coarse, disk(max(1, round(7 / self.downsample))))
+            return upsample_mask(coarse, coronal_mip.shape) > 0
+
+        return self._stage("coronal_mask", compute)
+
+    # Step 4: Slice bounds from the Y-histogram of the coronal mask
+    def axial_bounds(self):
+        def compute():
+            coronal_mip, binary_mask = self.coronal_mip(), self.coronal_mask()
+            return self._stage("axial_bounds", lambda: compute_axial_indices_and_plot(binary_mask, coronal_mip))
+
+        return self._coarse_to_fine(("coronal_mask",), compute)
+
+    # Step 5: Axial MIP between the slice bounds
+    def axial_mip(self):
+        axial_start, axial_end = self.axial_bounds()
+        return self._stage("axial_mip", lambda: generate_axial_mip(
+            self.cbct_array, axial_start, axial_end, self.max_slab_bytes, self.threads))
+
+    # Step 6: Blurred axial MIP and its threshold
+    def axial_threshold(self):
+        axial_mip = self.axial_mip()
+
+        def compute():
+            # Volumes of a dtype OpenCV cannot filter (e.g. int32) are blurred as float32
+            mip = axial_mip if axial_mip.dtype in CV_FILTER_DTYPES else axial_mip.astype(np.float32)
+            axial_mip_blurred = cv2.GaussianBlur(mip, (3, 3), 1.0)
+            return axial_mip_blurred, fit_mip_threshold(axial_mip_blurred)
+
+        axial_mip_blurred, fit = self._stage("axial_threshold", compute)
+        return axial_mip_blurred, fit.threshold
+
+    # Diagnostics of the threshold fits of the stages computed so far
+    def threshold_fits(self):
+        fits = {"coronal": self.results.get("coronal_threshold"),
+                "axial": self.results.get("axial_threshold", (None, None))[1]}
+        return {name: fit.diagnostics() for name, fit in fits.items() if fit is not None}
+
+    # Step 7: Binary mask of the jaws and teeth (downsampled in coarse-to-fine mode)
+    def jaw_mask(self):
+        axial_mip_blurred, threshold_axial = self.axial_threshold()
+
+        def compute():
+            binary_mask_axial = (axial_mip_blurred > threshold_axial).astype(np.uint8)
+            if self.downsample == 1:
+                return process_jaws_and_teeth(binary_mask_axial)
+            kernel_size = max(3, round(27 / self.downsample) | 1)  # odd, scaled with the image
+            return process_jaws_and_teeth(downsample_mask(binary_mask_axial, self.downsample), kernel_size)
+
+        return self._stage("jaw_mask", compute)
+
+    # Step 8: Skeleton of the jaw mask with branch points removed
+    def skeleton(self):
+        jaw_mask = self.jaw_mask()
+
+        def compute():
+            from skimage.morphology import skeletonize
+
+            skeleton = skeletonize(jaw_mask).astype(np.uint8) * 255
+            return analyze_skeleton(skeleton)[0]
+
+        return self._stage("skeleton", compute)
+
+    # Step 9: Insertion points (y, x) of the arch curve, taken on the skeleton
+    def arch_points(self):
+        def compute():
+            skeleton = self.skeleton()
+            axial_mip_blurred, threshold_axial = self.axial_threshold()
+            # Pixels of the skeleton are downsample times the voxel size (1 mm if unknown)
+            spacing = [value * self.downsample for value in (self.spacing or (1.0, 1.0, 1.0))]
+            insertion_points = arch_insertion_points(skeleton, self.num_insertion_points, spacing)
+            if self.downsample > 1:
+                # Back to full resolution, then refine near the curve on the full resolution mask
+                insertion_points = upscale_points(insertion_points, skeleton.shape, axial_mip_blurred.shape)
+                insertion_points = refine_insertion_points(
+                    insertion_points, axial_mip_blurred > threshold_axial, band=2 * self.downsample)
+            return insertion_points
+
+        return self._coarse_to_fine(("jaw_mask", "skeleton"),
+                                    lambda: self._stage("arch_points", compute))
+
+    # Step 10: Arch curve fitted on the insertion points
+    def arch_curve(self):
+        insertion_points = self.arch_points()
+        return self._stage("arch_curve", lambda: fit_arch_spline(
+            insertion_points, self.num_spline_points, self.spacing, self.sample_spacing))
+
+    # Step 11: Panoramic view along the arch curve
+    def panoramic_view(self):
+        spline_x, spline_y = self.arch_curve()
+        return self._stage("panoramic_view", lambda: extract_panoramic_view(
+            self.cbct_array, spline_x, spline_y, self.thickness, self.stretch_factor,
+            interpolation=self.interpolation, reduction=self.reduction, max_slab_bytes=self.max_slab_bytes,
+            threads=self.threads))
+
+
+# Save the panoramic view as a JPEG image to serve later in the UI
+# (native resolution, format from the extension, see panorama_encoding.encode_panorama for the options)
+def save_panoramic_view(panoramic_view, output_file_path, **encode_options):
+    return panorama_encoding.encode_panorama(panoramic_view, output_file_path, **encode_options)
+
+
+# Stages reported by process_volume_file, in the order they run
+PIPELINE_STAGES = ("read", "coronal_mip", "coronal_threshold", "coronal_mask", "axial_bounds", "axial_mip",
+                   "axial_threshold", "jaw_mask", "skeleton", "arch_points", "arch_curve", "panoramic_view", "encode")
+
+
+# Run the whole pipeline on a volume array and save the panorama
+def process_volume_array(cbct_array, output_file_path, on_stage=None, read_time=0.0, encode_options=None,
+                         read_peak_memory=None, **pipeline_params):
+    report = on_stage or (lambda name: None)
+
+    pipeline = PanoramaPipeline(cbct_array, on_stage=on_stage, **pipeline_params)
+    panoramic_view = pipeline.panoramic_view()
+
+    report("encode")
+    timings, peak_memory = {"read": read_time, **pipeline.timings}, {"read": read_peak_memory, **pipeline.peak_memory}
+    encoded = profiling.measure("encode", lambda: save_panoramic_view(
+        panoramic_view, output_file_path, **(encode_options or {})), timings, peak_memory)
+
+    axial_start, axial_end = pipeline.axial_bounds()
+    logger.info("Panorama extracted", extra={
+        "imageShape": list(cbct_array.shape),
+        "totalSeconds": round(sum(timings.values()), 4),
+        "stageTimings": timings,
+        "stagePeakMemory": peak_memory,
+    })
+    return {
+        "imageShape": cbct_array.shape,  # (Depth, Height, Width)
+        "axialBounds": [int(axial_start), int(axial_end)],
+        "coronalThreshold": float(pipeline.coronal_threshold()),
+        "axialThreshold": float(pipeline.axial_threshold()[1]),
+        "thresholdFits": pipeline.threshold_fits(),  # method, Gaussian and residual of each threshold
+        "archControlPoints": pipeline.arch_points()[:, ::-1].tolist(),  # [[x, y], ...] on the axial MIP
+        "archLength": arch_curve.arch_length(*pipeline.arch_curve(), spacing=pipeline.spacing),  # mm
+        "panorama": encoded,  # native size, bit depth and tile pyramid of the saved image
+        "stageTimings": timings,
+        "stagePeakMemory": peak_memory,  # peak resident bytes of the worker during each stage
+    }
+
+
+def _read_dicom_image(series_dir):
+    import SimpleITK as sitk
+
+    reader = sitk.ImageSeriesReader()
+    file_names = reader.GetGDCMSeriesFileNames(series_dir)
+    if not file_names:
+        raise ValueError(f"No DICOM series found in {series_dir}")
+    reader.SetFileNames(file_names)
+    return reader.Execute()
+
+
+# Read a DICOM series (the first one found in series_dir) into a (Depth, Height, Width) array
+def read_dicom_series(series_dir):
+    import SimpleITK as sitk
+
+    return sitk.GetArrayFromImage(_read_dicom_image(series_dir))
+
+
+# Read a volume file (or a directory holding a DICOM series), run the whole pipeline and save
+# the panorama (runs in the worker processes); decoded buffers spill to spill_dir, next to the
+# volume by default. The voxel spacing comes from the file unless given in pipeline_params.
+def process_volume_file(volume_path, output_file_path, on_stage=None, spill_dir=None, **pipeline_params):
+    if on_stage is not None:
+        on_stage("read")
+
+    def read():
+        import SimpleITK as sitk
+
+        if os.path.isdir(volume_path):
+            image = _read_dicom_image(volume_path)
+            return sitk.GetArrayFromImage(image), None, image.GetSpacing()
+        try:
+            # MHA / NRRD are memory-mapped (or decoded slab-friendly) instead of copied by SimpleITK
+            header, _ = volume_ingest.read_header(volume_path)
+            cbct_array, buffer_path = volume_ingest.open_volume(
+                volume_path, spill_dir=spill_dir or os.path.dirname(volume_path) or ".",
+                spill_bytes=pipeline_params.get("max_slab_bytes"))
+            return cbct_array, buffer_path, header.spacing
+        except volume_ingest.VolumeFormatError:
+            cbct_image = sitk.ReadImage(volume_path)
+            return sitk.GetArrayFromImage(cbct_image), None, cbct_image.GetSpacing()
+
+    timings, peak_memory = {}, {}
+    cbct_array, buffer_path, spacing = profiling.measure("read", read, timings, peak_memory)
+    if pipeline_params.get("spacing") is None:
+        pipeline_params["spacing"] = spacing
+
+    try:
+        return process_volume_array(cbct_array, output_file_path, on_stage, timings["read"],
+                                    read_peak_memory=peak_memory["read"], **pipeline_params)
+    finally:
+        del cbct_array
+        if buffer_path is not None and os.path.exists(buffer_path):
+            os.remove(buffer_path)
+
+
+# Same for a volume already decoded into a raw memmap file (e.g. by volume_ingest), without copying it
+def process_volume_memmap(buffer_path, shape, dtype, output_file_path, on_stage=None, **pipeline_params):
+    if on_stage is not None:
+        on_stage("read")
+    timings, peak_memory = {}, {}
+    cbct_array = profiling.measure("read", lambda: np.memmap(buffer_path, dtype=dtype, mode="r", shape=tuple(shape)),
+                                   timings, peak_memory)
+
+    return process_volume_array(cbct_array, output_file_path, on_stage, timings["read"],
+                                read_peak_memory=peak_memory["read"], **pipeline_params)
+
+
+# Re-render the panorama of a volume already decoded into a memmap file, along a spline through
+# the given [[x, y], ...] control points: only the resampling and encoding stages run
+def render_panorama_memmap(buffer_path, shape, dtype, output_file_path, control_points, num_spline_points=None,
+                           thickness=100, stretch_factor=1.5, interpolation="nearest", reduction="max",
+                           percentile=95.0, encode_options=None, max_slab_bytes=None, spacing=None,
+                           sample_spacing=None, threads=1):
+    cbct_array = np.memmap(buffer_path, dtype=dtype, mode="r", shape=tuple(shape))
+
+    timings, peak_memory = {}, {}
+    insertion_points = np.asarray(control_points, dtype=np.float64)[:, ::-1]
+    spline_x, spline_y = profiling.measure(
+        "arch_curve", lambda: fit_arch_spline(insertion_points, num_spline_points, spacing, sample_spacing),
+        timings, peak_memory)
+    panoramic_view = profiling.measure("panoramic_view", lambda: extract_panoramic_view(
+        cbct_array, spline_x, spline_y, thickness, stretch_factor, interpolation, reduction, percentile,
+        max_slab_bytes, threads), timings, peak_memory)
+    encoded = profiling.measure("encode", lambda: save_panoramic_view(
+        panoramic_view, output_file_path, **(encode_options or {})), timings, peak_memory)
+
+    return {"panorama": encoded, "stageTimings": timings, "stagePeakMemory": peak_memory}
+
+
+# Cross-sections of a volume already decoded into a memmap file, along a spline through the
+# given [[x, y], ...] control points, saved as an image strip or a stacked .npy array
+def render_cross_sections_memmap(buffer_path, shape, dtype, output_file_path, control_points, step=10,
+                                 num_spline_points=None, thickness=100, stretch_factor=1.5, interpolation="nearest",
+                                 encode_options=None, max_slab_bytes=None, spacing=None, sample_spacing=None,
+                                 threads=1):
+    cbct_array = np.memmap(buffer_path, dtype=dtype, mode="r", shape=tuple(shape))
+
+    timings, peak_memory = {}, {}
+    insertion_points = np.asarray(control_points, dtype=np.float64)[:, ::-1]
+    spline_x, spline_y = profiling.measure(
+        "arch_curve", lambda: fit_arch_spline(insertion_points, num_spline_points, spacing, sample_spacing),
+        timings, peak_memory)
+    sections, columns, positions = profiling.measure("cross_sections", lambda: extract_cross_sections(
+        cbct_array, spline_x, spline_y, step, thickness, stretch_factor, interpolation, max_slab_bytes, threads),
+        timings, peak_memory)
+    encoded = profiling.measure("encode", lambda: panorama_encoding.encode_cross_sections(
+        sections, output_file_path, **(encode_options or {})), timings, peak_memory)
+
+    return {
+        "crossSections": {**encoded, "columns": columns.tolist(), "positions": positions.tolist()},
+        "stageTimings": timings,
+        "stagePeakMemory": peak_memory,
+    }
+
+
+# Small synthetic CBCT the pipeline can process: noisy soft tissue and a U-shaped bony arch
+def synthetic_volume(shape=(64, 192, 192), seed=0):
+    depth, height, width = shape
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(1000, 40, shape).astype(np.int16)
+    y, x = np.mgrid[:height, :width]
+    ring = np.hypot((y - 0.35 * height) / (0.35 * height), (x - width / 2) / (0.3 * width))
+    arch = (np.abs(ring - 1) * 0.3 * min(height, width) < 0.075 * min(height, width)) & (y > 0.35 * height)
+    slab = slice(int(depth * 0.35), int(depth * 0.65))
+    volume[slab][:, arch] = rng.uniform(1800, 3500, (slab.stop - slab.start, int(arch.sum())))
+    return volume
+
+
+def warm_up():
+    """
+    Run the whole pipeline once on a small synthetic volume, so a process pays the lazy
+    imports and first-call costs before its first real request (see the worker pool)
+    """
+    start = time.perf_counter()
+    PanoramaPipeline(synthetic_volume()).panoramic_view()
+    return time.perf_counter() - start
 
-                if (0 <= sample_x < width and 0 <= sample_y < height):
-                    samples.append(slice_data[sample_y, sample_x])
 
-            if samples:
-                # Use maximum intensity projection
-                panoramic[z, i] = np.max(samples) # play in this for taking mean or max projection
+if __name__ == "__main__":
+    # Headless mode, e.g. python -m panorama_extraction batch <dir> (see batch.py)
+    import batch
 
-    return panoramic
\ No newline at end of file
+    sys.exit(batch.main())
@@ -0,0 +1,87 @@
+#profiling.py
+import cProfile
+import io
+import json
+import logging
+import pstats
+import resource
+import sys
+import time
+
+# Attributes every LogRecord has, anything else was passed with extra= and is a structured field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the fields passed with extra="""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level="INFO", json_format=True):
+    """Log to stderr, as JSON lines or as plain text"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its own peak RSS, elsewhere the peak is the process lifetime one
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, since the last reset_peak_rss()"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(name, compute, timings, peak_memory):
+    """Run compute(), recording its duration in timings[name] and the peak RSS it reached in peak_memory[name]"""
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = compute()
+    timings[name] = time.perf_counter() - start
+    peak_memory[name] = peak_rss()
+    return result
+
+
+def run_profiled(profile_path, fn, *args, **kwargs):
+    """
+    Call fn under cProfile, saving the stats to profile_path (load them with pstats or snakeviz)
+    and a text report of the top functions by cumulative time next to it, as profile_path + ".txt"
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(50)
+        with open(profile_path + ".txt", "w") as report_file:
+            report_file.write(report.getvalue())
@@ -0,0 +1,81 @@
+#result_cache.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def copy_and_hash(source, destination, chunk_size=HASH_CHUNK_SIZE):
+    """Copy a file object chunk by chunk while hashing it, returns the sha256 hex digest"""
+    digest = hashlib.sha256()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        destination.write(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_digest, **params):
+    """Key of a result: the content hash plus every parameter that changes the output"""
+    return f"{content_digest}:{json.dumps(params, sort_keys=True)}"
+
+
+class ResultCache:
+    """
+    LRU cache of pipeline results keyed on the uploaded content and the pipeline parameters
+
+    Each entry owns the artifacts it lists (e.g. the panorama and its tile directory, names
+    in artifact_store); they are deleted when the entry is evicted, so the cache bounds
+    both the number of entries and the space of their artifacts.
+    """
+
+    def __init__(self, artifact_store, max_entries=256, max_bytes=1 << 30):
+        self.artifact_store = artifact_store
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (result, artifact names, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, artifacts, size = entry
+            # Artifacts removed behind our back (e.g. collected) make the entry useless
+            if not all(self.artifact_store.exists(name) for name in artifacts):
+                self._remove(key, delete_artifacts=True)
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, result, artifacts=()):
+        artifacts = list(artifacts)
+        size = sum(self.artifact_store.size(name) for name in artifacts)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, delete_artifacts=True)
+            self._entries[key] = (result, artifacts, size)
+            self.total_bytes += size
+            self._evict()
+
+    def _remove(self, key, delete_artifacts):
+        result, artifacts, size = self._entries.pop(key)
+        self.total_bytes -= size
+        if delete_artifacts:
+            for name in artifacts:
+                self.artifact_store.delete(name)
+
+    def _evict(self):
+        # Drop least recently used entries, but always keep the newest one
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key, delete_artifacts=True)
@@ -0,0 +1,115 @@
+#sessions.py
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class Session:
+    """A decoded volume kept for re-slicing, with its arch control points and current rendering"""
+
+    def __init__(self, volume_path, shape, dtype, nbytes, params):
+        self.id = str(uuid.uuid4())
+        self.volume_path = volume_path
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.nbytes = nbytes
+        self.params = dict(params)
+        self.control_points = None
+        self.artifacts = []  # artifact names of the current rendering
+        self.cross_section_artifacts = []  # artifact names of the latest cross-sections
+        self.last_access = time.time()
+
+
+class SessionStore:
+    """
+    Re-slicing sessions, evicted after ttl_seconds without access or least recently
+    used first when max_sessions or the max_bytes budget of volumes is exceeded
+
+    Removing a session deletes its volume buffer and its rendered artifacts (in artifact_store).
+    """
+
+    def __init__(self, artifact_store, ttl_seconds=1800, max_sessions=8, max_bytes=4 << 30):
+        self.artifact_store = artifact_store
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, volume_path, shape, dtype, nbytes, params):
+        session = Session(volume_path, shape, dtype, nbytes, params)
+        with self._lock:
+            self._evict_expired(time.time())
+            # Make room for the new volume, least recently used sessions first
+            while self._sessions and (len(self._sessions) >= self.max_sessions
+                                      or self.total_bytes + nbytes > self.max_bytes):
+                self._remove(next(iter(self._sessions)))
+            self._sessions[session.id] = session
+            self.total_bytes += nbytes
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._evict_expired(time.time())
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def _delete_artifacts(self, artifacts):
+        for name in artifacts:
+            self.artifact_store.delete(name)
+
+    def set_rendering(self, session_id, params, control_points, artifacts):
+        """Record a new rendering of a session, replacing (and deleting) the previous one"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                # Evicted while rendering
+                self._delete_artifacts(artifacts)
+                return None
+            previous_artifacts = session.artifacts
+            session.params = dict(params)
+            session.control_points = control_points
+            session.artifacts = list(artifacts)
+            session.last_access = time.time()
+        self._delete_artifacts(previous_artifacts)
+        return session
+
+    def set_cross_sections(self, session_id, artifacts):
+        """Record the latest cross-sections of a session, replacing (and deleting) the previous ones"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._delete_artifacts(artifacts)
+                return None
+            previous_artifacts = session.cross_section_artifacts
+            session.cross_section_artifacts = list(artifacts)
+            session.last_access = time.time()
+        self._delete_artifacts(previous_artifacts)
+        return session
+
+    def remove(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= session.nbytes
+        if os.path.exists(session.volume_path):
+            os.remove(session.volume_path)
+        self._delete_artifacts([*session.artifacts, *session.cross_section_artifacts])
+
+    def _evict_expired(self, now):
+        expired = [session_id for session_id, session in self._sessions.items()
+                   if now - session.last_access > self.ttl_seconds]
+        for session_id in expired:
+            self._remove(session_id)
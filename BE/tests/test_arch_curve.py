@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+import arch_curve
+
+
+@pytest.mark.parametrize("points", [[[10, 10], [10, 10], [10, 10]], [[5, 5], [5, 5], [6, 6]]])
+def test_repeated_control_points_raise_arch_curve_error(points):
+    with pytest.raises(arch_curve.ArchCurveError):
+        arch_curve.sample_arch_spline(np.array(points, dtype=float)[:, ::-1])
+
+
+def test_samples_are_spaced_by_the_sample_spacing():
+    insertion_points = np.array([[100, 0], [20, 50], [0, 100], [20, 150], [100, 200]], dtype=float)
+    curve_x, curve_y = arch_curve.sample_arch_spline(insertion_points, spacing=(0.5, 0.5, 1), sample_spacing=1.0)
+    steps = np.hypot(np.diff(curve_x), np.diff(curve_y)) * 0.5
+    np.testing.assert_allclose(steps, 1.0, rtol=0.02)
@@ -0,0 +1,41 @@
+from artifacts import LocalArtifactStore
+from result_cache import ResultCache
+from sessions import SessionStore
+
+
+def write(store, name, size):
+    with open(store.path(name), "wb") as artifact:
+        artifact.write(b"\0" * size)
+
+
+def test_result_cache_owns_artifact_names(tmp_path):
+    store = LocalArtifactStore(str(tmp_path), "http://localhost/static/")
+    cache = ResultCache(store, max_entries=2)
+    for index in range(3):
+        name = store.new_name("panorama", ".jpg")
+        write(store, name, 10)
+        cache.put(f"key{index}", {"index": index}, artifacts=[name])
+    assert cache.get("key0") is None and len(list(tmp_path.iterdir())) == 2  # evicted with its artifact
+    assert cache.total_bytes == 20
+
+    # A collected artifact invalidates its entry
+    store.delete(next(tmp_path.iterdir()).name)
+    assert [cache.get(key) is None for key in ("key1", "key2")].count(True) == 1
+
+
+def test_session_artifacts_are_deleted_through_the_store(tmp_path):
+    store = LocalArtifactStore(str(tmp_path / "static"), "http://localhost/static/")
+    volume_path = tmp_path / "volume.raw"
+    volume_path.write_bytes(b"\0" * 16)
+    sessions = SessionStore(store)
+    session = sessions.create(str(volume_path), (1, 4, 4), "|u1", 16, {})
+    first, second, tiles = "panorama_1.jpg", "panorama_2.jpg", "panorama_2_tiles"
+    write(store, first, 4)
+    write(store, second, 4)
+    (tmp_path / "static" / tiles).mkdir()
+    sessions.set_rendering(session.id, {}, [[0, 0]], [first])
+    sessions.set_rendering(session.id, {}, [[0, 0]], [second, tiles])
+    assert not store.exists(first) and store.exists(second)
+
+    sessions.remove(session.id)
+    assert not store.exists(second) and not store.exists(tiles) and not volume_path.exists()
@@ -0,0 +1,90 @@
+import io
+import zipfile
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+import dicom_series
+import panorama_extraction as pe
+
+
+def series_files(stored, pixel_representation=0, intercept=-1024.0):
+    """In-memory DICOM files of the (Depth, Height, Width) stored values, one slice per file"""
+    series_uid = generate_uid()
+    files = []
+    for index, pixels in enumerate(stored):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = series_uid
+        ds.InstanceNumber = index + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(index)]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.PixelSpacing = [0.5, 0.5]
+        ds.Rows, ds.Columns = pixels.shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 16, 15
+        ds.PixelRepresentation = pixel_representation
+        ds.RescaleIntercept = intercept
+        ds.RescaleSlope = 1
+        ds.PixelData = pixels.astype("<i2" if pixel_representation else "<u2").tobytes()
+        buffer = io.BytesIO()
+        pydicom.dcmwrite(buffer, ds, enforce_file_format=True)
+        files.append(io.BytesIO(buffer.getvalue()))
+    return files
+
+
+@pytest.mark.parametrize("pixel_representation", [0, 1])
+def test_16_bit_series_with_intercept_decodes_to_a_dtype_the_pipeline_filters(pixel_representation):
+    # Unsigned or signed 16-bit with RescaleIntercept -1024 (e.g. GE) exceeds both int16 and uint16
+    volume = pe.synthetic_volume()
+    stored = volume.astype(np.int32) + 1024
+    series = dicom_series.read_series(series_files(stored, pixel_representation))
+    assert series.dtype == np.float32
+
+    decoded, _, _ = dicom_series.decode_series(series)
+    np.testing.assert_array_equal(decoded, volume)
+    assert pe.PanoramaPipeline(decoded).panoramic_view().shape[0] == len(volume)
+
+
+def test_series_fitting_16_bits_keeps_integers():
+    stored = np.full((3, 8, 8), 40000)
+    assert dicom_series.read_series(series_files(stored, intercept=0)).dtype == np.uint16
+    assert dicom_series.read_series(series_files(stored - 30000, 1, intercept=0)).dtype == np.int16
+
+
+def test_pipeline_blurs_volumes_opencv_cannot_filter():
+    volume = pe.synthetic_volume()
+    blurred, threshold = pe.PanoramaPipeline(volume.astype(np.int32)).axial_threshold()
+    assert blurred.dtype == np.float32
+    assert threshold == pytest.approx(pe.PanoramaPipeline(volume.astype(np.float32)).axial_threshold()[1])
+
+
+def zip_archive(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_zip_members_rejects_archives_over_budget_before_decompressing():
+    # 64 MB of zeros compress to about 64 KB
+    bomb = zip_archive({"slice.dcm": b"\0" * (64 << 20)})
+    with pytest.raises(dicom_series.SeriesTooLargeError):
+        dicom_series.zip_members(bomb, max_bytes=1 << 20)
+    with pytest.raises(dicom_series.SeriesTooLargeError):
+        dicom_series.zip_members(zip_archive({f"{i}.dcm": b"" for i in range(5)}), max_files=4)
+
+    members = dicom_series.zip_members(zip_archive({"a.dcm": b"a", ".hidden": b"b", "dir/b.dcm": b"b"}), 2, 2)
+    assert [member.read() for member in members] == [b"a", b"b"]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from scipy.signal import find_peaks
+
+import histogram_analysis as ha
+
+
+@pytest.mark.parametrize("values", [
+    np.random.default_rng(0).integers(-1024, 3000, (40, 50)).astype(np.int16),
+    np.random.default_rng(1).integers(0, 65535, 5000).astype(np.uint16),
+    np.random.default_rng(2).integers(0, 7, 1000).astype(np.uint8),  # fewer values than bins
+    np.full(100, 42, dtype=np.int32),
+    np.random.default_rng(3).normal(500, 120, 10000).astype(np.float32),
+    np.random.default_rng(4).normal(0, 1, 3001),
+    np.full(10, 1.5),
+])
+@pytest.mark.parametrize("bins", [256, 7])
+def test_histogram_matches_np_histogram(values, bins):
+    hist, bin_centers = ha.histogram(values, bins)
+    expected, bin_edges = np.histogram(values, bins)
+    np.testing.assert_array_equal(hist, expected)
+    np.testing.assert_array_equal(bin_centers, (bin_edges[:-1] + bin_edges[1:]) / 2)
+
+
+def test_histogram_subsamples_large_float_data():
+    values = np.random.default_rng(5).random(10000)
+    hist, _ = ha.histogram(values, 16, max_samples=1000)
+    assert hist.sum() == 1000
+    np.testing.assert_array_equal(ha.histogram(values, 16, max_samples=None)[0], np.histogram(values, 16)[0])
+
+
+@pytest.mark.parametrize("values", [
+    [0, 1, 0],
+    [3, 1, 2, 1, 3],  # maxima at the ends are never peaks
+    [0, 2, 2, 0, 5, 5, 5, 5, 1],  # plateaus, reported at their middle
+    [0, 2, 2, 3, 1, 4, 4, 4, 4, 4],  # plateau running into the end
+    [1, 1, 1, 1],
+    [5],
+    [],
+    np.random.default_rng(6).integers(0, 4, 500),
+    np.random.default_rng(7).normal(0, 1, 500),
+])
+@pytest.mark.parametrize("height", [None, 2, 0.5])
+def test_local_maxima_matches_find_peaks(values, height):
+    values = np.asarray(values, dtype=float)
+    np.testing.assert_array_equal(ha.local_maxima(values, height), find_peaks(values, height=height)[0])
+
+
+def test_percentile_from_histogram_weighs_the_counts():
+    hist = np.array([1, 1, 1, 1, 96])
+    bin_centers = np.arange(5.0)
+    assert ha.percentile_from_histogram(hist, bin_centers, 95) == 4.0
+    assert ha.percentile_from_histogram(hist, bin_centers, 3) == 2.0
+
+
+def test_fit_peak_threshold_falls_back_to_the_histogram_percentile(monkeypatch):
+    # Pins the fallback: the 95th percentile of the histogrammed values (formerly of the bin centers, 3.8 here)
+    monkeypatch.setattr(ha, "fit_gaussian", lambda x, y: None)
+    hist = np.array([1, 1, 50, 1, 96, 0, 0, 0, 0, 0])
+    fit = ha.fit_peak_threshold(hist, np.arange(10.0) * 0.5, peak_width=1)
+    assert (fit.method, fit.threshold, fit.mean) == ("percentile", 2.0, None)
@@ -0,0 +1,211 @@
+import cv2
+import numpy as np
+import pytest
+
+import arch_curve
+import panorama_extraction as pe
+
+
+# Baseline per-pixel skeleton analysis (formerly inlined in main.upload_image), the reference
+def analyze_skeleton_loop(skeleton):
+    skeleton = skeleton.copy()
+    branch_points = np.zeros_like(skeleton)
+    end_points = np.zeros_like(skeleton)
+    for i in range(1, skeleton.shape[0] - 1):
+        for j in range(1, skeleton.shape[1] - 1):
+            if skeleton[i, j] == 255:
+                neighbors = np.sum(skeleton[i - 1:i + 2, j - 1:j + 2] == 255)
+                if neighbors > 3:
+                    branch_points[i, j] = 255
+                elif neighbors == 2:
+                    end_points[i, j] = 255
+    skeleton[branch_points == 255] = 0
+    return skeleton, branch_points, end_points
+
+
+# Baseline per-voxel extract_panoramic_view (nearest / max), the reference
+def extract_panoramic_view_loop(cbct_data, curve_x, curve_y, thickness=100, stretch_factor=1.5):
+    depth, height, width = cbct_data.shape
+    num_points = int(len(curve_x) * stretch_factor)
+    panoramic = np.zeros((depth, num_points))
+    t = np.linspace(0, 1, len(curve_x))
+    t_new = np.linspace(0, 1, num_points)
+    curve_x_stretched = np.interp(t_new, t, curve_x)
+    curve_y_stretched = np.interp(t_new, t, curve_y)
+    dx = np.gradient(curve_x_stretched)
+    dy = np.gradient(curve_y_stretched)
+    for z in range(depth):
+        slice_data = cbct_data[z]
+        for i in range(num_points):
+            x, y = int(curve_x_stretched[i]), int(curve_y_stretched[i])
+            normal_x = -dy[i]
+            normal_y = dx[i]
+            norm = np.sqrt(normal_x**2 + normal_y**2)
+            if norm != 0:
+                normal_x /= norm
+                normal_y /= norm
+            samples = []
+            for t in range(-thickness // 2, thickness // 2):
+                sample_x = int(x + normal_x * t)
+                sample_y = int(y + normal_y * t)
+                if 0 <= sample_x < width and 0 <= sample_y < height:
+                    samples.append(slice_data[sample_y, sample_x])
+            if samples:
+                panoramic[z, i] = np.max(samples)
+    return panoramic
+
+
+def random_skeleton(shape, density, seed):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random(shape) < density, 255, 0).astype(np.uint8)
+
+
+@pytest.mark.parametrize("shape, density, seed", [
+    ((64, 64), 0.05, 0), ((64, 64), 0.3, 1), ((31, 47), 0.6, 2), ((50, 80), 1.0, 3), ((40, 40), 0.0, 4),
+])
+def test_analyze_skeleton_matches_the_loop_on_random_skeletons(shape, density, seed):
+    skeleton = random_skeleton(shape, density, seed)
+    for result, expected in zip(pe.analyze_skeleton(skeleton), analyze_skeleton_loop(skeleton)):
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (1, 5), (2, 2), (3, 3), (3, 7)])
+def test_analyze_skeleton_matches_the_loop_on_tiny_images(shape):
+    skeleton = np.full(shape, 255, dtype=np.uint8)
+    for result, expected in zip(pe.analyze_skeleton(skeleton), analyze_skeleton_loop(skeleton)):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_analyze_skeleton_matches_the_loop_on_the_border():
+    # Lines along and across the image border: border pixels are neighbors but never classified
+    skeleton = np.zeros((20, 30), dtype=np.uint8)
+    skeleton[0, :] = skeleton[-1, 5:25] = skeleton[:, 0] = skeleton[3:17, -1] = 255
+    skeleton[1, 1:10] = skeleton[10, :] = skeleton[:, 15] = 255
+    skeleton[2, 2] = skeleton[18, 28] = 255
+    for result, expected in zip(pe.analyze_skeleton(skeleton), analyze_skeleton_loop(skeleton)):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_analyze_skeleton_leaves_its_input_unchanged():
+    skeleton = random_skeleton((32, 32), 0.4, 5)
+    original = skeleton.copy()
+    pe.analyze_skeleton(skeleton)
+    np.testing.assert_array_equal(skeleton, original)
+
+
+@pytest.mark.parametrize("thickness, stretch_factor", [(20, 1.5), (21, 1.0), (1, 2.0)])
+def test_extract_panoramic_view_matches_the_loop(thickness, stretch_factor):
+    rng = np.random.default_rng(0)
+    volume = rng.integers(0, 3000, (4, 48, 64)).astype(np.int16)
+    # Parabola partly outside the volume, with a repeated point (zero normal)
+    t = np.linspace(0, np.pi, 40)
+    curve_x = 32 + 40 * np.cos(t)
+    curve_y = 5 + 50 * np.sin(t)
+    curve_x[20] = curve_x[21]
+    curve_y[20] = curve_y[21]
+
+    expected = extract_panoramic_view_loop(volume, curve_x, curve_y, thickness, stretch_factor)
+    result = pe.extract_panoramic_view(volume, curve_x, curve_y, thickness, stretch_factor)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_extract_panoramic_view_matches_the_loop_on_the_pipeline_curve():
+    volume = pe.synthetic_volume((8, 96, 96))
+    pipeline = pe.PanoramaPipeline(pe.synthetic_volume())
+    curve_x, curve_y = (coordinates / 2 for coordinates in pipeline.arch_curve())
+
+    expected = extract_panoramic_view_loop(volume, curve_x, curve_y, 30)
+    for threads in (1, 3):
+        result = pe.extract_panoramic_view(volume, curve_x, curve_y, 30, threads=threads)
+        np.testing.assert_array_equal(result, expected)
+
+
+
+
+def curve_distance(curve, reference):
+    """Distances (pixels) from every point of curve to the closest point of reference"""
+    from scipy.spatial import cKDTree
+
+    return cKDTree(np.column_stack(reference)).query(np.column_stack(curve))[0]
+
+
+@pytest.mark.parametrize("shape", [(64, 192, 192), (48, 128, 200), (64, 256, 256)])
+@pytest.mark.parametrize("factor", [2, 3, 4])
+def test_coarse_to_fine_arch_curve_stays_close_to_full_resolution(shape, factor):
+    volume = pe.synthetic_volume(shape)
+    distance = curve_distance(pe.PanoramaPipeline(volume, downsample=factor).arch_curve(),
+                              pe.PanoramaPipeline(volume).arch_curve())
+    assert distance.mean() <= 1.5 * factor
+    assert distance.max() <= 4 * factor
+
+
+def test_coarse_to_fine_falls_back_to_full_resolution_on_small_volumes():
+    # At factor 4 the arch of this volume vanishes from the downsampled coronal mask
+    volume = pe.synthetic_volume((48, 160, 160))
+    pipeline = pe.PanoramaPipeline(volume, downsample=4)
+    np.testing.assert_array_equal(pipeline.panoramic_view(), pe.PanoramaPipeline(volume).panoramic_view())
+    assert pipeline.downsample == 1
+
+# Out-of-core paths: a few slices per slab, on a memmap, must give exactly the in-memory output
+@pytest.fixture(scope="module")
+def volume_buffer(tmp_path_factory):
+    volume = pe.synthetic_volume()
+    path = str(tmp_path_factory.mktemp("buffer") / "volume.raw")
+    volume.tofile(path)
+    return volume, path, 3 * pe._slice_bytes(volume)
+
+
+def read_image(path):
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+
+@pytest.mark.parametrize("interpolation, reduction", [("nearest", "max"), ("trilinear", "mean"),
+                                                      ("nearest", "percentile")])
+def test_out_of_core_pipeline_matches_in_memory(volume_buffer, interpolation, reduction):
+    volume, path, max_slab_bytes = volume_buffer
+    expected = pe.PanoramaPipeline(volume, interpolation=interpolation, reduction=reduction)
+    memmap = np.memmap(path, dtype=volume.dtype, mode="r", shape=volume.shape)
+    for threads in (1, 3):
+        pipeline = pe.PanoramaPipeline(memmap, interpolation=interpolation, reduction=reduction,
+                                       max_slab_bytes=max_slab_bytes, threads=threads)
+        np.testing.assert_array_equal(pipeline.coronal_mip(), expected.coronal_mip())
+        np.testing.assert_array_equal(pipeline.axial_mip(), expected.axial_mip())
+        np.testing.assert_array_equal(pipeline.arch_curve(), expected.arch_curve())
+        np.testing.assert_array_equal(pipeline.panoramic_view(), expected.panoramic_view())
+
+
+def test_process_volume_memmap_matches_in_memory(volume_buffer, tmp_path):
+    volume, path, max_slab_bytes = volume_buffer
+    options = {"encode_options": {"bit_depth": 16}}
+    expected = pe.process_volume_array(volume, str(tmp_path / "expected.png"), **options)
+    result = pe.process_volume_memmap(path, volume.shape, volume.dtype.str, str(tmp_path / "result.png"),
+                                      max_slab_bytes=max_slab_bytes, **options)
+    for key in ("imageShape", "axialBounds", "coronalThreshold", "axialThreshold", "archControlPoints",
+                "archLength", "panorama"):
+        assert result[key] == expected[key]
+    np.testing.assert_array_equal(read_image(str(tmp_path / "result.png")), read_image(str(tmp_path / "expected.png")))
+
+
+def test_render_memmap_matches_in_memory(volume_buffer, tmp_path):
+    volume, path, max_slab_bytes = volume_buffer
+    control_points = pe.PanoramaPipeline(volume).arch_points()[:, ::-1].tolist()
+    spline_x, spline_y = pe.fit_arch_spline(np.asarray(control_points, dtype=np.float64)[:, ::-1])
+
+    pe.render_panorama_memmap(path, volume.shape, volume.dtype.str, str(tmp_path / "panorama.png"), control_points,
+                              thickness=40, reduction="mean", encode_options={"bit_depth": 16},
+                              max_slab_bytes=max_slab_bytes, threads=2)
+    pe.save_panoramic_view(pe.extract_panoramic_view(volume, spline_x, spline_y, 40, reduction="mean"),
+                           str(tmp_path / "expected.png"), bit_depth=16)
+    np.testing.assert_array_equal(read_image(str(tmp_path / "panorama.png")),
+                                  read_image(str(tmp_path / "expected.png")))
+
+    result = pe.render_cross_sections_memmap(path, volume.shape, volume.dtype.str, str(tmp_path / "sections.npy"),
+                                             control_points, step=7, thickness=40, interpolation="trilinear",
+                                             max_slab_bytes=max_slab_bytes, threads=2)
+    sections, columns, _ = pe.extract_cross_sections(volume, spline_x, spline_y, 7, 40, interpolation="trilinear")
+    np.testing.assert_array_equal(np.load(str(tmp_path / "sections.npy")), sections.astype(np.float32))
+    assert result["crossSections"]["columns"] == columns.tolist()
+
+def test_build_panoramic_grid_rejects_curves_narrower_than_two_columns():
+    with pytest.raises(arch_curve.ArchCurveError):
+        pe.build_panoramic_grid(np.array([10.0, 20.0]), np.array([5.0, 5.0]), stretch_factor=0.1)
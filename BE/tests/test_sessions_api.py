@@ -0,0 +1,50 @@
+import importlib
+
+import pytest
+
+import panorama_extraction as pe
+
+
+def mha_bytes(volume):
+    depth, height, width = volume.shape
+    header = (f"ObjectType = Image\nNDims = 3\nBinaryData = True\nBinaryDataByteOrderMSB = False\n"
+              f"ElementSpacing = 1 1 1\nDimSize = {width} {height} {depth}\nElementType = MET_SHORT\n"
+              f"ElementDataFile = LOCAL\n")
+    return header.encode() + volume.astype("<i2").tobytes()
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # main creates its directories in the working directory when imported
+    from fastapi.testclient import TestClient
+
+    directory = tmp_path_factory.mktemp("server")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(directory)
+        monkeypatch.setenv("PANORAMA_BUFFER_DIR", str(directory))
+        monkeypatch.setenv("PANORAMA_WORKERS", "1")
+        monkeypatch.setenv("PANORAMA_LOG_LEVEL", "WARNING")
+        main = importlib.import_module("main")
+        with TestClient(main.app) as client:
+            yield client
+
+
+@pytest.fixture(scope="module")
+def session_id(client):
+    response = client.post("/sessions?filename=volume.mha", content=mha_bytes(pe.synthetic_volume()))
+    assert response.status_code == 201
+    return response.json()["sessionId"]
+
+
+@pytest.mark.parametrize("update", [
+    {"numSplinePoints": 2, "stretchFactor": 0.1},
+    {"sampleSpacing": 1000, "stretchFactor": 0.1},
+])
+def test_panorama_update_narrower_than_two_columns_is_rejected(client, session_id, update):
+    response = client.put(f"/sessions/{session_id}/panorama", json=update)
+    assert response.status_code == 422
+
+
+def test_panorama_update_renders_valid_parameters(client, session_id):
+    response = client.put(f"/sessions/{session_id}/panorama", json={"numSplinePoints": 20, "stretchFactor": 0.1})
+    assert response.status_code == 200
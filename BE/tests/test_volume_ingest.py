@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+import volume_ingest
+
+
+def test_allocate_volume_spills_when_the_buffer_dir_is_full(tmp_path, monkeypatch):
+    buffer_dir, spill_dir = tmp_path / "shm", tmp_path / "disk"
+    buffer_dir.mkdir()
+    spill_dir.mkdir()
+    free = {str(buffer_dir): 1000, str(spill_dir): 1 << 40}
+    monkeypatch.setattr(volume_ingest, "free_bytes", lambda directory: free[str(directory)])
+
+    small, small_path = volume_ingest.allocate_volume((10, 10), np.int16, buffer_dir, spill_dir, 1 << 20)
+    large, large_path = volume_ingest.allocate_volume((100, 100), np.int16, buffer_dir, spill_dir, 1 << 20)
+    assert os.path.dirname(small_path) == str(buffer_dir)
+    assert os.path.dirname(large_path) == str(spill_dir)
+    # Preallocated rather than sparse
+    assert os.stat(large_path).st_blocks * 512 >= large.nbytes
+
+
+def test_remove_stale_buffers(tmp_path):
+    _, path = volume_ingest.allocate_volume((4, 4), np.uint8, tmp_path)
+    other = tmp_path / "upload_scan.mha"
+    other.write_bytes(b"")
+    assert volume_ingest.remove_stale_buffers(tmp_path) == 1
+    assert not os.path.exists(path) and other.exists()
@@ -0,0 +1,21 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from worker_pool import ProcessingPool
+
+
+def test_pool_recovers_from_a_dead_worker():
+    pool = ProcessingPool(max_workers=2)
+    try:
+        pids = pool.start()
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result(timeout=30)
+
+        # The jobs after the crash run on new workers
+        assert pool.submit(os.getpid).result(timeout=30) not in pids
+        assert pool.submit(sum, [1, 2, 3]).result(timeout=30) == 6
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
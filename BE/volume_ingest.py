@@ -0,0 +1,359 @@
+#volume_ingest.py
+import errno
+import hashlib
+import os
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+# Headers larger than this are rejected before any payload is read
+MAX_HEADER_BYTES = 1 << 16
+
+# Names of the memmap buffers volumes are decoded into (see allocate_volume)
+BUFFER_PREFIX, BUFFER_SUFFIX = "volume_", ".raw"
+
+METAIMAGE_TYPES = {
+    "MET_CHAR": np.int8, "MET_UCHAR": np.uint8,
+    "MET_SHORT": np.int16, "MET_USHORT": np.uint16,
+    "MET_INT": np.int32, "MET_UINT": np.uint32,
+    "MET_LONG_LONG": np.int64, "MET_ULONG_LONG": np.uint64,
+    "MET_FLOAT": np.float32, "MET_DOUBLE": np.float64,
+}
+
+NRRD_TYPES = {
+    np.int8: ("signed char", "int8", "int8_t"),
+    np.uint8: ("uchar", "unsigned char", "uint8", "uint8_t"),
+    np.int16: ("short", "short int", "signed short", "signed short int", "int16", "int16_t"),
+    np.uint16: ("ushort", "unsigned short", "unsigned short int", "uint16", "uint16_t"),
+    np.int32: ("int", "signed int", "int32", "int32_t"),
+    np.uint32: ("uint", "unsigned int", "uint32", "uint32_t"),
+    np.int64: ("longlong", "long long", "long long int", "signed long long", "signed long long int", "int64", "int64_t"),
+    np.uint64: ("ulonglong", "unsigned long long", "unsigned long long int", "uint64", "uint64_t"),
+    np.float32: ("float",),
+    np.float64: ("double",),
+}
+NRRD_TYPES = {name: dtype for dtype, names in NRRD_TYPES.items() for name in names}
+
+
+class VolumeFormatError(ValueError):
+    """Raised when an uploaded volume is malformed or uses an unsupported feature"""
+
+
+class VolumeHeader:
+    """Geometry and encoding of a volume, shape is in array order (Depth, Height, Width)"""
+
+    def __init__(self, shape, dtype, big_endian=False, compressed=False, spacing=None, origin=None):
+        self.shape = tuple(int(size) for size in shape)
+        self.dtype = np.dtype(dtype)
+        self.big_endian = big_endian
+        self.compressed = compressed
+        self.spacing = spacing  # (x, y, z) in mm, like SimpleITK's GetSpacing()
+        self.origin = origin    # (x, y, z)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+
+def _floats(value):
+    return tuple(float(part) for part in value.split())
+
+
+def parse_metaimage_header(text):
+    """Parse a MetaImage (.mha / .mhd) header whose data is stored LOCAL after it"""
+    fields = {}
+    for line in text.splitlines():
+        if "=" in line:
+            key, value = line.split("=", 1)
+            fields[key.strip()] = value.strip()
+
+    if fields.get("ElementDataFile") != "LOCAL":
+        raise VolumeFormatError("Only MetaImage files with embedded data (ElementDataFile = LOCAL) can be streamed")
+    if fields.get("ElementType") not in METAIMAGE_TYPES:
+        raise VolumeFormatError(f"Unsupported MetaImage ElementType {fields.get('ElementType')}")
+    if int(fields.get("ElementNumberOfChannels", 1)) != 1:
+        raise VolumeFormatError("Only single channel volumes are supported")
+    if int(fields.get("HeaderSize", 0)) != 0:
+        raise VolumeFormatError("MetaImage HeaderSize is not supported")
+
+    dims = [int(size) for size in fields.get("DimSize", "").split()]
+    if len(dims) != 3 or int(fields.get("NDims", 3)) != 3 or min(dims) <= 0:
+        raise VolumeFormatError(f"Expected a 3D volume, got DimSize '{fields.get('DimSize')}'")
+
+    byte_order = fields.get("BinaryDataByteOrderMSB", fields.get("ElementByteOrderMSB", "False"))
+    origin = fields.get("Offset", fields.get("Origin", fields.get("Position")))
+    return VolumeHeader(
+        shape=dims[::-1],
+        dtype=METAIMAGE_TYPES[fields["ElementType"]],
+        big_endian=byte_order.lower() == "true",
+        compressed=fields.get("CompressedData", "False").lower() == "true",
+        spacing=_floats(fields["ElementSpacing"]) if "ElementSpacing" in fields else None,
+        origin=_floats(origin) if origin else None,
+    )
+
+
+def _nrrd_vectors(value):
+    # "(1,0,0) (0,1,0) none" -> [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), None]
+    vectors = []
+    for part in value.split():
+        part = part.strip()
+        vectors.append(None if part == "none" else tuple(float(v) for v in part.strip("()").split(",")))
+    return vectors
+
+
+def parse_nrrd_header(text):
+    """Parse an NRRD header with attached data"""
+    lines = text.splitlines()
+    if not lines or not lines[0].startswith("NRRD"):
+        raise VolumeFormatError("Not an NRRD file")
+
+    fields = {}
+    for line in lines[1:]:
+        if line.startswith("#") or ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        fields[key.strip().lower()] = value.lstrip("=").strip()
+
+    if "data file" in fields or "datafile" in fields:
+        raise VolumeFormatError("Detached NRRD data files cannot be streamed")
+    if int(fields.get("line skip", 0)) or int(fields.get("byte skip", 0)):
+        raise VolumeFormatError("NRRD line skip / byte skip are not supported")
+    if fields.get("type") not in NRRD_TYPES:
+        raise VolumeFormatError(f"Unsupported NRRD type {fields.get('type')}")
+    encoding = fields.get("encoding", "raw")
+    if encoding not in ("raw", "gzip", "gz"):
+        raise VolumeFormatError(f"Unsupported NRRD encoding {encoding}")
+
+    sizes = [int(size) for size in fields.get("sizes", "").split()]
+    if len(sizes) != 3 or int(fields.get("dimension", 3)) != 3 or min(sizes) <= 0:
+        raise VolumeFormatError(f"Expected a 3D volume, got sizes '{fields.get('sizes')}'")
+
+    spacing = None
+    if "spacings" in fields:
+        spacing = _floats(fields["spacings"])
+    elif "space directions" in fields:
+        spacing = tuple(float(np.linalg.norm(v)) if v else 1.0 for v in _nrrd_vectors(fields["space directions"]))
+    origin = _nrrd_vectors(fields["space origin"])[0] if "space origin" in fields else None
+
+    return VolumeHeader(
+        shape=sizes[::-1],
+        dtype=NRRD_TYPES[fields["type"]],
+        big_endian=fields.get("endian", "little") == "big",
+        compressed=encoding != "raw",
+        spacing=spacing,
+        origin=origin,
+    )
+
+
+def _find_header_end(data):
+    """Index just past the header in data, or None while the header is incomplete"""
+    if data.startswith(b"NRRD"):
+        # The NRRD header ends with an empty line
+        for separator in (b"\n\n", b"\r\n\r\n"):
+            index = data.find(separator)
+            if index != -1:
+                return index + len(separator), "nrrd"
+        return None, "nrrd"
+
+    # The MetaImage header ends with the ElementDataFile line
+    index = data.find(b"ElementDataFile")
+    if index != -1:
+        newline = data.find(b"\n", index)
+        if newline != -1:
+            return newline + 1, "metaimage"
+    return None, "metaimage"
+
+
+def free_bytes(directory):
+    """Space left for an unprivileged process in the file system of directory"""
+    stat = os.statvfs(directory)
+    return stat.f_bavail * stat.f_frsize
+
+
+def _preallocate(path, nbytes):
+    # Reserve the blocks of the file now: writing a sparse memmap in a full tmpfs (e.g. Docker's
+    # 64 MB /dev/shm) raises SIGBUS and kills the process, a failed fallocate only raises OSError
+    with open(path, "wb") as buffer_file:
+        if nbytes and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(buffer_file.fileno(), 0, nbytes)
+        else:
+            buffer_file.truncate(nbytes)
+
+
+def allocate_volume(shape, dtype, buffer_dir=None, spill_dir=None, spill_bytes=None):
+    """
+    Preallocate a volume to decode into: in memory, or a np.memmap file in buffer_dir (spill_dir
+    above spill_bytes, or when buffer_dir has no room left for it). Returns the array and the path
+    of its memmap file (None in memory).
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    directories = [buffer_dir]
+    if spill_dir is not None and spill_bytes is not None and nbytes > spill_bytes:
+        directories = [spill_dir]
+    elif buffer_dir is not None and spill_dir is not None and spill_dir != buffer_dir:
+        directories.append(spill_dir)
+
+    if directories[0] is None:
+        return np.empty(shape, dtype=dtype), None
+    for directory in directories:
+        last = directory is directories[-1]
+        if not last and free_bytes(directory) < nbytes:
+            continue
+        path = os.path.join(directory, f"{BUFFER_PREFIX}{uuid.uuid4()}{BUFFER_SUFFIX}")
+        try:
+            _preallocate(path, nbytes)
+        except OSError as e:
+            if os.path.exists(path):
+                os.remove(path)
+            if last or e.errno != errno.ENOSPC:
+                raise
+            continue  # filled up meanwhile
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape), path
+
+
+def remove_stale_buffers(directory, min_age_seconds=0, now=None):
+    """
+    Remove the volume buffers left in directory by a previous server process (e.g. after a crash,
+    they would otherwise stay in a RAM-backed tmpfs forever), returns the number removed
+    """
+    now = time.time() if now is None else now
+    removed = 0
+    for entry in os.scandir(directory):
+        if not (entry.name.startswith(BUFFER_PREFIX) and entry.name.endswith(BUFFER_SUFFIX)):
+            continue
+        try:
+            if now - entry.stat().st_mtime >= min_age_seconds:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class StreamingVolumeReader:
+    """
+    Decode an MHA / NRRD volume from chunks as they arrive
+
+    The header is parsed as soon as it is complete, then the payload (raw or
+    zlib/gzip compressed) is decoded straight into a preallocated array: in memory,
+    or a np.memmap file in buffer_dir when one is given (e.g. to hand the volume to
+    worker processes without copying it). Volumes larger than spill_bytes go to a
+    memmap in spill_dir instead, typically on disk rather than RAM. The content is
+    sha256-hashed on the way, and malformed headers or payload sizes are reported
+    during the transfer instead of after it.
+    """
+
+    def __init__(self, buffer_dir=None, spill_dir=None, spill_bytes=None):
+        self.buffer_dir = buffer_dir
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self.header = None
+        self.array = None
+        self.path = None  # memmap file backing array, when buffer_dir is given
+        self.bytes_received = 0
+        self._digest = hashlib.sha256()
+        self._pending = b""
+        self._flat = None
+        self._written = 0
+        self._decompressor = None
+
+    @property
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def feed(self, chunk):
+        self._digest.update(chunk)
+        self.bytes_received += len(chunk)
+
+        if self.header is None:
+            self._pending += chunk
+            end, kind = _find_header_end(self._pending)
+            if end is None:
+                if len(self._pending) > MAX_HEADER_BYTES:
+                    raise VolumeFormatError("Volume header not found, only MHA and NRRD uploads can be streamed")
+                return
+            header_text = self._pending[:end].decode("latin-1")
+            self.header = parse_nrrd_header(header_text) if kind == "nrrd" else parse_metaimage_header(header_text)
+            self._allocate()
+            chunk, self._pending = self._pending[end:], b""
+
+        if self.header.compressed:
+            chunk = self._decompressor.decompress(chunk)
+        self._write(chunk)
+
+    def _allocate(self):
+        self.array, self.path = allocate_volume(self.header.shape, self.header.dtype, self.buffer_dir,
+                                                self.spill_dir, self.spill_bytes)
+        self._flat = self.array.reshape(-1).view(np.uint8)
+        if self.header.compressed:
+            # 32 + MAX_WBITS accepts both zlib (MetaImage) and gzip (NRRD) streams
+            self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def _write(self, data):
+        if not data:
+            return
+        end = self._written + len(data)
+        if end > len(self._flat):
+            raise VolumeFormatError(f"Payload is larger than the {len(self._flat)} bytes announced by the header")
+        self._flat[self._written:end] = np.frombuffer(data, dtype=np.uint8)
+        self._written = end
+
+    def finish(self):
+        """Check the payload is complete and return the decoded array"""
+        if self.header is None:
+            raise VolumeFormatError("Upload ended before the volume header was complete")
+        if self.header.compressed:
+            self._write(self._decompressor.flush())
+        if self._written != len(self._flat):
+            raise VolumeFormatError(f"Payload has {self._written} bytes, expected {len(self._flat)}")
+        if self.header.big_endian and self.header.dtype.itemsize > 1:
+            self.array.byteswap(inplace=True)
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+        return self.array
+
+    def discard(self):
+        """Drop the array and remove its memmap file, if any"""
+        self.array = None
+        self._flat = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_header(path):
+    """Header of an MHA / NRRD file and the offset of its payload"""
+    with open(path, "rb") as volume_file:
+        head = volume_file.read(MAX_HEADER_BYTES)
+    end, kind = _find_header_end(head)
+    if end is None:
+        raise VolumeFormatError("Volume header not found, only MHA and NRRD files can be mapped")
+    header_text = head[:end].decode("latin-1")
+    return (parse_nrrd_header(header_text) if kind == "nrrd" else parse_metaimage_header(header_text)), end
+
+
+def open_volume(path, spill_dir=None, spill_bytes=None, chunk_size=1 << 20):
+    """
+    Open an MHA / NRRD file without reading it into memory when possible
+
+    Uncompressed little-endian payloads are memory-mapped in place. Compressed or
+    big-endian ones are decoded chunk by chunk, into memory or, above spill_bytes,
+    into a memmap file in spill_dir. Returns the array and the path of the memmap
+    buffer created for it (None if there is none), which the caller removes.
+    """
+    header, end = read_header(path)
+    if not header.compressed and (not header.big_endian or header.dtype.itemsize == 1):
+        if os.path.getsize(path) - end < header.nbytes:
+            raise VolumeFormatError(f"Payload is smaller than the {header.nbytes} bytes announced by the header")
+        return np.memmap(path, dtype=header.dtype, mode="r", offset=end, shape=header.shape), None
+
+    reader = StreamingVolumeReader(spill_dir=spill_dir, spill_bytes=spill_bytes)
+    try:
+        with open(path, "rb") as volume_file:
+            for chunk in iter(lambda: volume_file.read(chunk_size), b""):
+                reader.feed(chunk)
+        return reader.finish(), reader.path
+    except BaseException:
+        reader.discard()
+        raise
@@ -0,0 +1,174 @@
+#worker_pool.py
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Queue the worker processes send (job_id, stage) progress events on, set by the pool initializer
+_progress_queue = None
+
+
+def _init_worker(progress_queue, warm_up=None):
+    global _progress_queue
+    _progress_queue = progress_queue
+    if warm_up is not None:
+        # A failed warm-up only means a slower first job, the worker itself is fine
+        try:
+            warm_up()
+        except Exception:
+            logger.exception("Worker warm-up failed")
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+def report_progress(job_id, stage):
+    """Send a progress event from a worker process, use functools.partial(report_progress, job_id)"""
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, stage))
+
+
+def default_worker_count():
+    # Scale with the cores this process is allowed to run on
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+class ProcessingPool:
+    """
+    Bounded process pool for the CPU-bound panorama processing
+
+    At most max_workers jobs run at once and at most queue_depth more wait for a
+    worker; submitting beyond that raises PoolBusyError instead of queueing forever.
+    Progress events sent with report_progress are passed to on_progress(job_id, stage)
+    from a listener thread in the server process.
+
+    Workers are started with the first job, or all at once by start(); each one calls
+    warm_up() first, if given, to pay its import and first-call costs before any job.
+
+    A worker dying (e.g. killed for memory) breaks the whole executor: its running and
+    queued jobs fail with BrokenProcessPool, and the pool starts a new executor (warmed
+    up again if start() was used) so the next jobs run normally.
+    """
+
+    def __init__(self, max_workers=None, queue_depth=None, on_progress=None, warm_up=None):
+        self.max_workers = max_workers or default_worker_count()
+        self.queue_depth = self.max_workers if queue_depth is None else queue_depth
+        self.on_progress = on_progress
+        self.warm_up = warm_up
+        self._executor = None
+        self._progress_queue = None
+        self._listener = None
+        self._pending = 0
+        self._started = False
+        self._lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Number of running and queued jobs"""
+        return self._pending
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.queue_depth
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._progress_queue = multiprocessing.get_context().Queue()
+                self._listener = threading.Thread(target=self._listen, args=(self._progress_queue,), daemon=True)
+                self._listener.start()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=_init_worker,
+                    initargs=(self._progress_queue, self.warm_up),
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        """Drop a broken executor, the next job (or start()) creates a new one"""
+        with self._executor_lock:
+            if self._executor is not executor:
+                return  # already reset, e.g. by another job of the same executor
+            progress_queue = self._progress_queue
+            self._executor, self._progress_queue, self._listener = None, None, None
+        logger.error("A worker process died, restarting the worker pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+        progress_queue.put(None)
+        if self._started:
+            threading.Thread(target=self._restart, daemon=True).start()
+
+    def _restart(self):
+        try:
+            self.start()
+        except Exception:
+            logger.exception("Worker pool restart failed")
+
+    def start(self):
+        """Start (and warm up) every worker now rather than with the first jobs, returns their pids"""
+        self._started = True
+        executor = self._get_executor()
+        # Workers are spawned while none is idle: one task each, submitted at once, starts them all
+        futures = [executor.submit(_worker_pid) for _ in range(self.max_workers)]
+        return {future.result() for future in futures}
+
+    def _listen(self, progress_queue):
+        while True:
+            event = progress_queue.get()
+            if event is None:
+                break
+            if self.on_progress is not None:
+                self.on_progress(*event)
+
+    def _release(self, executor, future):
+        with self._lock:
+            self._pending -= 1
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._reset(executor)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise PoolBusyError(f"{self._pending} jobs pending, capacity is {self.capacity}")
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # Broken before any of its jobs reported it: start over on a new executor
+                self._reset(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(functools.partial(self._release, executor))
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Submit fn to the pool and wait for it without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        self._started = False
+        with self._executor_lock:
+            executor, progress_queue = self._executor, self._progress_queue
+            self._executor, self._progress_queue, self._listener = None, None, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            progress_queue.put(None)
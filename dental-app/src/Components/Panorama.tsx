@@ -6,6 +6,22 @@ interface UploadResponse {
   panoramicViewUrl: string;
 }
 
+// Status of a panorama extraction job, as returned by POST /jobs and GET /jobs/{id}
+interface JobStatus {
+  jobId: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  stage: string | null;
+  stages: string[];
+  progress: number; // 0..1
+  error?: string;
+}
+
+const API_URL = 'http://localhost:8000';
+const JOB_POLL_INTERVAL_MS = 500;
+const STREAMABLE_VOLUME = /\.(mha|nrrd)$/i;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
 // Define tool interface
 interface AnnotationTool {
   name: string;
@@ -16,6 +32,7 @@ interface AnnotationTool {
 const PanoramaViewer: React.FC = () => {
   const [file, setFile] = useState<File | null>(null);
   const [loading, setLoading] = useState<boolean>(false);
+  const [jobStatus, setJobStatus] = useState<JobStatus | null>(null);
   const [error, setError] = useState<string>('');
   const [responseData, setResponseData] = useState<UploadResponse | null>(null);
   const [currentTool, setCurrentTool] = useState<string>('Line');
@@ -153,22 +170,50 @@ const PanoramaViewer: React.FC = () => {
     formData.append('file', file);
 
     try {
-      const response = await axios.post<UploadResponse>(
-        'http://localhost:8000/upload-image',
-        formData,
-        {
-          headers: {
-            'Content-Type': 'multipart/form-data'
-          }
-        }
-      );
+      // Start an extraction job, then poll its progress until the panorama is ready.
+      // MHA / NRRD volumes are sent as a raw body the server decodes while it arrives
+      const created = STREAMABLE_VOLUME.test(file.name)
+        ? await axios.post<JobStatus>(`${API_URL}/jobs/stream`, file, {
+            params: { filename: file.name },
+            headers: {
+              'Content-Type': 'application/octet-stream'
+            }
+          })
+        : await axios.post<JobStatus>(
+            `${API_URL}/jobs`,
+            formData,
+            {
+              headers: {
+                'Content-Type': 'multipart/form-data'
+              }
+            }
+          );
+      let job = created.data;
+      setJobStatus(job);
+      while (job.status !== 'done' && job.status !== 'failed') {
+        await sleep(JOB_POLL_INTERVAL_MS);
+        job = (await axios.get<JobStatus>(`${API_URL}/jobs/${job.jobId}`)).data;
+        setJobStatus(job);
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Image processing failed');
+      }
+
+      const response = await axios.get<UploadResponse>(`${API_URL}/jobs/${job.jobId}/result`);
       setResponseData(response.data);
       setAnnotations([]);
     } catch (err: any) {
-      setError('Error processing the image. Please try again.');
+      if (err?.response?.status === 400 && err.response.data?.detail) {
+        setError(`Invalid volume: ${err.response.data.detail}`);
+      } else if (err?.response?.status === 503) {
+        setError('The server is busy processing other images. Please try again shortly.');
+      } else {
+        setError('Error processing the image. Please try again.');
+      }
       console.error(err);
     } finally {
       setLoading(false);
+      setJobStatus(null);
     }
   };
 
@@ -469,6 +514,23 @@ const PanoramaViewer: React.FC = () => {
         >
           {loading ? 'Processing...' : 'Upload and Process'}
         </button>
+
+        {/* Job progress while the panorama is being extracted */}
+        {loading && jobStatus && (
+          <div className="mt-3">
+            <div className="w-full h-2 bg-gray-200 rounded">
+              <div
+                className="h-2 bg-blue-500 rounded transition-all"
+                style={{ width: `${Math.round(jobStatus.progress * 100)}%` }}
+              />
+            </div>
+            <p className="text-sm text-gray-600 mt-1">
+              {jobStatus.status === 'queued'
+                ? 'Waiting for a free worker...'
+                : `${jobStatus.stage?.replace(/_/g, ' ')} (${Math.round(jobStatus.progress * 100)}%)`}
+            </p>
+          </div>
+        )}
       </div>
   
       {error && <p className="text-red-500 mt-2">{error}</p>}